@@ -6,23 +6,60 @@ __version__ = 'bb_reader.v.12.0.0'
 __author__ = 'Alfredo Martin 2023'
 
 import os
+import sys
+import subprocess
+from multiprocessing import Pool
+from multiprocessing import cpu_count
 import pandas as pd
 import numpy as np
 import copy
-import _pickle as pic
+from itertools import zip_longest
 from tqdm import tqdm
+from classes.pipeline import StreamedCommand
+from classes.bbt_store import save_bbts
+from classes.bbt import BBT, compatible
+from classes.smi_io import write_nha_index
+
+
+def desalt_source(command, db_name, shard):
+    """desalts and canonicalizes one bbs source and writes its compounds to a shard file with the id of each compound
+    tagged with the name of the source. It runs in a worker process so errors are returned instead of exiting
+    command: list of str: fileconv command that writes the desalted smiles to its standard output
+    db_name: str: name of the source
+    shard: str: path to the shard file
+    returns: tuple of int, int: number of compounds written and return code of fileconv"""
+    counter = 0
+    with open(shard, 'w') as f:
+        proc = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+        for line in proc.stdout:
+            smiles, _, name = line.rstrip('\n').partition(' ')
+            if len(smiles) == 0:
+                continue
+            counter += 1
+            f.write(f'{smiles} {db_name}:{name}\n')
+        proc.stdout.close()
+        returncode = proc.wait()
+    return counter, returncode
+
+
+def _starred_desalt_source(job):
+    """unpacks the arguments of desalt_source (Pool.imap passes a single argument)
+    job: tuple: arguments of desalt_source
+    returns: tuple of int, int"""
+    return desalt_source(*job)
 
 
 class BBReader:
     """class that handles the reading and processing of building blocks and update s the already created
     BBTs list. It also creates BB files required to enumeration of designs."""
 
-    def __init__(self, wf, runfolder, BBTs, db, fg, antifg, calcfg, bblim, log, smi=None, verbose=False, debug=False):
+    def __init__(self, wf, runfolder, BBTs, db, fg, antifg, calcfg, bblim, log, smi=None, scratch=None, chunksize=None,
+                 headpieces=None, verbose=False, debug=False):
         """
         Initiallizes the class
         :param wf: str: working folder
         :param runfolder: str: folder tor the current run
-        :param BBTs: list of BBT objects
+        :param BBTs: list of BBT objects or None. If None the BBTs are derived from the FG vectors found in the bbs
         :param dbpar: instance of the Parameters class corresponding to the db parameters
         :param fg: instance of the Parameters class corresponding to the fg parameters
         :param antifg: instance of the Parameters class corresponding to the antifg parameters
@@ -30,6 +67,11 @@ class BBReader:
         :param bblim: instance of the Parameters class corresponding to the bblim parameters
         :param log: instance of logger class
         :param smi: str: path to a smiles file containing all building blocks
+        :param scratch: str: folder for temporary files (for example a tmpfs folder). If None wf is used
+        :param chunksize: int: number of compounds processed at once while filtering by fgs, so memory does not grow
+            with the size of the catalogue. If None all compounds are processed at once
+        :param headpieces: instance of the Parameters class corresponding to the headpieces parameters (required when
+            BBTs is None)
         :param verbose: report Lyllymol detailed info
         :param debug: report file lengths and headers for debugging purposes
         :return None
@@ -48,6 +90,15 @@ class BBReader:
         self.verbose = verbose
         self.debug = debug
         self.runfolder = runfolder
+        self.chunksize = chunksize
+        self.headpieces = headpieces
+        if self.BBTs is None and self.headpieces is None:
+            self.log.update('ERROR::: headpieces must be passed when BBTs are derived from the building blocks')
+            sys.exit(1)
+        if scratch is None:
+            self.scratch = wf
+        else:
+            self.scratch = scratch
         if os.path.isdir(os.environ['LILLYMOL_EXECUTABLES']):
             self.tsubstructure = os.path.join(os.environ['LILLYMOL_EXECUTABLES'], 'tsubstructure')
             self.fileconv = os.path.join(os.environ['LILLYMOL_EXECUTABLES'], 'fileconv')
@@ -61,12 +112,13 @@ class BBReader:
             self.iwdescr = 'iwdescr.sh'
             self.iwcut = 'iwcut.sh'
 
-    def _annotate_bbs(self, bb_file, how='fg'):
+    def _annotation_command(self, bb_file, how='fg'):
         """
-        Annotates the file of bbs file with the vector of fgs for anti-fgs (how='antifg') or fgs (how='fg')
+        Builds the tsubstructure command that annotates a bbs file with the vector of fgs for anti-fgs (how='antifg')
+        or fgs (how='fg')
         :param bb_file: str: path to smiles file containing bbs (two columns space separated with smiles an id fields)
         :param how: str: what type of fgs to annotate
-        :return: str: path to the annotated file
+        :return: list of str: command
         """
         qrys = []
         protos = []
@@ -78,160 +130,234 @@ class BBReader:
             for fg in self.fg.par:
                 qrys += [os.path.expandvars(file) for file in fg['base_queries'] if file is not None and file.endswith('qry')]
                 protos += [os.path.expandvars(file) for file in fg['base_queries'] if file is not None and file.endswith('proto')]
-        with open(os.path.join(self.wf, "qrys.txt"), 'w') as f:
+        with open(os.path.join(self.scratch, "qrys.txt"), 'w') as f:
             for file in qrys:
                 f.write(file + '\n')
-        with open(os.path.join(self.wf, "protos.txt"), 'w') as f:
+        with open(os.path.join(self.scratch, "protos.txt"), 'w') as f:
             for file in protos:
                 f.write(file + '\n')
-        if len(qrys) > 0:
-            qry_stamp = f'-q F:{os.path.join(self.wf, "qrys.txt")}'
-        else:
-            qry_stamp = ''
-        if len(protos) > 0:
-            proto_stamp = f'-q PROTOFILE:{os.path.join(self.wf, "protos.txt")}'
-        else:
-            proto_stamp = ''
         if len(qrys) + len(protos) == 0:
             self.log.update("ERROR::: no fg qry or proto files found")
-        command = f'{self.tsubstructure}'
-        command += f' {qry_stamp} {proto_stamp}'
+        command = [self.tsubstructure]
+        if len(qrys) > 0:
+            command += ['-q', f'F:{os.path.join(self.scratch, "qrys.txt")}']
+        if len(protos) > 0:
+            command += ['-q', f'PROTOFILE:{os.path.join(self.scratch, "protos.txt")}']
         if self.verbose:
-            command += f' -v'
-        command += f' -A D -u -r -a -l {bb_file} > {os.path.join(self.wf, "annotated.txt")}'
-        os.system(command)
-        return os.path.join(self.wf, "annotated.txt")
+            command += ['-v']
+        command += ['-A', 'D', '-u', '-r', '-a', '-l', bb_file]
+        return command
 
-    def _read_bbs(self):
+    def _annotate_bbs(self, bb_file, how='fg'):
         """
-        reads, canonicalize, deduplicate, desalt and compute properties for all bbs
-        :return: tuple of str: file1, file2
-           file1: path to file smiles and id of returned compounds
-           file2: path to file with header containing nha and nhbd for the same compounds in the smiles file
+        Annotates the file of bbs file with the vector of fgs for anti-fgs (how='antifg') or fgs (how='fg'). The
+        output of tsubstructure is parsed while it is produced, so no annotated file is written
+        :param bb_file: str: path to smiles file containing bbs (two columns space separated with smiles an id fields)
+        :param how: str: what type of fgs to annotate
+        :return: pandas dataframe: Name column and one column per fg
+        """
+        with StreamedCommand(self._annotation_command(bb_file, how=how)) as stream:
+            df = pd.read_csv(stream, sep=' ')
+        if self.debug:
+            self.log.update(f'DEBUG::: {df.shape[0]} compounds annotated with {how}: {df.columns.tolist()[:5]}...')
+        return df
+
+    def _desalt_jobs(self):
+        """
+        sets up the desalting job of each bbs source
+        :return: list of tuples: arguments of desalt_source for each source
         """
-        # 1. Read compounds from a single smiles
         if self.smi is not None:
-            self.log.update(f'INFO::: Working in bbs file {self.smi}')
-            file = os.path.expandvars(self.smi)
             _, name = os.path.split(self.smi)
-            name = name.replace('.smi', '')
-            command = f'{self.fileconv}'
-            command += f' -O B -i smi -o usmi -V -E autocreate -f lod -S'
-            command += f' {os.path.join(self.wf, "c_desalted")} {file}'
-            os.system(command)
-            df = pd.read_csv(os.path.join(self.wf, "c_desalted.smi"), sep=' ', header=None, names=['smiles', 'id'])
-            df['id'] = df['id'].apply(lambda x: name + ':' + x)
-            df[['smiles', 'id']].to_csv(os.path.join(self.wf, "c_desalted.smi"), sep=' ', header=False, index=False)
-            self.log.update(f'INFO::: Adding {df.shape[0]} compounds to the desalted compounds pool')
-            command = f'cat {os.path.join(self.wf, "c_desalted.smi")} >> {os.path.join(self.wf, "desalted.smi")}'
-            os.system(command)
-        # 1. Read compounds from all the sets, desalt them and tag them with its source. Creates a single file
+            sources = [{'db': name.replace('.smi', ''), 'filename': self.smi}]
         else:
-            for db in self.db.par:
-                self.log.update(f'INFO::: Working in bbs file {db["db"]}')
-                file = os.path.expandvars(db['filename'])
-                command = f'{self.fileconv}'
-                command += f' -O B -i smi -o usmi -V -E autocreate -f lod -S'
-                command += f' {os.path.join(self.wf, "c_desalted")} {file}'
-                os.system(command)
-                df = pd.read_csv(os.path.join(self.wf, "c_desalted.smi"), sep=' ', header=None, names=['smiles', 'id'])
-                df['id'] = df['id'].apply(lambda x: db['db'] + ':' + x)
-                df[['smiles', 'id']].to_csv(os.path.join(self.wf, "c_desalted.smi"), sep=' ', header=False, index=False)
-                self.log.update(f'INFO::: Adding {df.shape[0]} compounds to the desalted compounds pool')
-                command = f'cat {os.path.join(self.wf, "c_desalted.smi")} >> {os.path.join(self.wf, "desalted.smi")}'
-                os.system(command)
-        if self.debug:
-            os.system(f'wc -l {os.path.join(self.wf, "desalted.smi")}')
-            os.system(f'head -n 1 {os.path.join(self.wf, "desalted.smi")}')
+            sources = self.db.par
+        jobs = []
+        for i, db in enumerate(sources):
+            file = os.path.expandvars(db['filename'])
+            command = [self.fileconv, '-O', 'B', '-i', 'smi', '-o', 'usmi', '-V', '-E', 'autocreate', '-f', 'lod',
+                       '-S', '-', file]
+            jobs.append((command, db['db'], os.path.join(self.scratch, f'desalted_{i}.smi')))
+        return jobs
+
+    def _desalted_lines(self, jobs, results):
+        """
+        generator of the desalted and canonicalized smiles lines of all the bbs sources, with the id of each compound
+        tagged with the name of its source. Shards are streamed in the order of the sources as soon as each one is
+        finished and removed afterwards
+        :param jobs: list of tuples: arguments of desalt_source for each source
+        :param results: iterator of the results of desalt_source for each job (in the same order)
+        :return: generator of str
+        """
+        for (command, db_name, shard), (counter, returncode) in zip(jobs, results):
+            self.log.update(f'INFO::: Working in bbs file {command[-1]}')
+            if returncode != 0:
+                self.log.update(f'ERROR::: fileconv exited with status {returncode} for {command[-1]}')
+                sys.exit(1)
+            with open(shard, 'r') as f:
+                for line in f:
+                    yield line
+            os.remove(shard)
+            self.log.update(f'INFO::: Adding {counter} compounds to the desalted compounds pool')
+
+    def _read_bbs(self, properties=True):
+        """
+        reads, canonicalize, deduplicate, desalt and compute properties for all bbs. Desalting, deduplication and
+        filtering are streamed through pipes so the only file written is the smiles file of the returned compounds
+        :param properties: bool: whether to compute the properties of the compounds
+        :return: tuple of str, pandas dataframe: file, df
+           file: path to file smiles and id of returned compounds
+           df: dataframe containing w_natoms and w_rotbond for the same compounds in the smiles file (None if
+           properties is False)
+        """
+        # 1. Read compounds from all the sets (or from a single smiles), desalt them and tag them with its source.
         # 2. Eliminate repeated smiles
-        self.log.update('INFO::: eliminating duplicated smiles')
-        command = f'{self.unique_molecules}'
-        command += f' -l -a -I -A D -g all -S {os.path.join(self.wf, "unique")}'
-        command += f' {os.path.join(self.wf, "desalted.smi")}'
-        os.system(command)
-        if self.debug:
-            os.system(f'wc -l {os.path.join(self.wf, "unique.smi")}')
-            os.system(f'head -n 1 {os.path.join(self.wf, "unique.smi")}')
-        command = f'rm {os.path.join(self.wf, "desalted.smi")}'
-        os.system(command)
         # 3. filter among number of heavy atoms and rotatable bonds
-        self.log.update('INFO::: level 1 filetering by heavy atoms and rotatable bonds')
+        self.log.update('INFO::: desalting, eliminating duplicated smiles and level 1 filtering by heavy atoms and '
+                        'rotatable bonds')
         max_atoms = self.bblim.par['raw_na_filter']
         max_rb = self.bblim.par['raw_rb_filter']
         if max_atoms is None:
             max_atoms = 10000
         if max_rb is None:
             max_rb = 10000
-        command = f'{self.iwdescr}'
-        command += f' -F "w_natoms<{max_atoms}" -F "w_rotbond<{max_rb}" {os.path.join(self.wf, "unique.smi")}'
-        command += f' > {os.path.join(self.wf, "f_unique.smi")}'
-        os.system(command)
-        if self.debug:
-            os.system(f'wc -l {os.path.join(self.wf, "f_unique.smi")}')
-            os.system(f'head -n 1  {os.path.join(self.wf, "f_unique.smi")}')
-        # 4. annotate compounds with all properties
+        unique_command = [self.unique_molecules, '-l', '-a', '-I', '-A', 'D', '-g', 'all', '-i', 'smi', '-S', '-', '-']
+        filter_command = [self.iwdescr, '-F', f'w_natoms<{max_atoms}', '-F', f'w_rotbond<{max_rb}', '-i', 'smi', '-']
+        smiles_file = os.path.join(self.scratch, "f_unique.smi")
+        counter = 0
+        # sources are desalted concurrently, each one in its own shard, while the shards are streamed into the
+        # deduplication as they are finished
+        jobs = self._desalt_jobs()
+        if len(jobs) == 0:
+            self.log.update('ERROR::: no building block sources found (check db.par or the smiles file)')
+            sys.exit(1)
+        with Pool(min(cpu_count(), len(jobs))) as pool:
+            results = pool.imap(_starred_desalt_source, jobs)
+            with StreamedCommand(unique_command, lines=self._desalted_lines(jobs, results)) as unique, \
+                    StreamedCommand(filter_command, stdin=unique) as filtered, \
+                    open(smiles_file, 'w') as f:
+                for line in filtered:
+                    counter += 1
+                    f.write(line)
+        self.log.update(f'INFO::: {counter} compounds remaining')
+        if not properties:
+            return smiles_file, None
+        # 4. annotate compounds with number of heavy atoms and number of rotatable bonds
         self.log.update('INFO::: Annotating compounds with properties')
-        command = f'{self.iwdescr}'
-        command += f' {os.path.join(self.wf, "f_unique.smi")} > {os.path.join(self.wf, "f_unique.txt")}'
-        os.system(command)
-        if self.debug:
-            os.system(f'wc -l {os.path.join(self.wf, "f_unique.txt")}')
-            os.system(f'head -n 1 {os.path.join(self.wf, "f_unique.txt")}')
-        # 4. eliminate all properties except for number of heavy atoms and number of rotatable bon
-        command = f'{self.iwcut}'
-        command += f' -d w_natoms,w_rotbond {os.path.join(self.wf, "f_unique.txt")}'
-        command += f' > {os.path.join(self.wf, "s_unique.txt")}'
-        os.system(command)
+        with StreamedCommand([self.iwdescr, smiles_file]) as stream:
+            df = pd.read_csv(stream, sep=' ', usecols=['w_natoms', 'w_rotbond'])
         if self.debug:
-            os.system(f'wc -l {os.path.join(self.wf, "s_unique.txt")}')
-            os.system(f'head -n 1 {os.path.join(self.wf, "s_unique.txt")}')
-        # 5. separate the properties file so it only contains properties
-        command = f'cut {os.path.join(self.wf, "s_unique.txt")} -d " " -f 2,3 > {os.path.join(self.wf, "iwdata.txt")}'
-        os.system(command)
-        if self.debug:
-            os.system(f'wc -l {os.path.join(self.wf, "iwdata.txt")}')
-            os.system(f'head -n 1 {os.path.join(self.wf, "iwdata.txt")}')
-        return os.path.join(self.wf, "f_unique.smi"), os.path.join(self.wf, "iwdata.txt")
+            self.log.update(f'DEBUG::: {df.shape[0]} compounds annotated with properties')
+        return smiles_file, df
 
     def _add_anitfg(self, in_smiles, in_data):
         """
-        creates annotated files for bbs
+        annotates the bbs with the antifg
         in_smiles: str: path to file smiles and id of returned compounds
-        in_data: str: path to file with header containing nha and nhbd for the same compounds in the smiles file
-        :return: str: file with annotated antifg
+        in_data: pandas dataframe: w_natoms and w_rotbond for the same compounds in the smiles file
+        :return: pandas dataframe: smiles, Name, antifg counts, w_natoms and w_rotbond
         """
         self.log.update('INFO::: Annotating anti FG')
         # 1. compute the vector for the antitargets
-        annotated = self._annotate_bbs(in_smiles, how='antifg')
-        if self.debug:
-            os.system(f'wc -l {annotated}')
-            os.system(f'head -n 1 {annotated}')
-        # 2. add smiles header
-        os.system(f'echo "smiles id" > {os.path.join(self.wf, "header")}')
-        os.system(f'cat {os.path.join(self.wf, "header")} {in_smiles} > {os.path.join(self.wf, "h_smiles")}')
-        os.system(f'cut -d " " -f 1 {os.path.join(self.wf, "h_smiles")} > {os.path.join(self.wf, "h_smiles.txt")}')
+        df = self._annotate_bbs(in_smiles, how='antifg')
+        # 2. add smiles and properties (rows are in the same order in all sources)
+        smiles = pd.read_csv(in_smiles, sep=' ', header=None, usecols=[0], names=['smiles'])
+        if smiles.shape[0] != df.shape[0]:
+            self.log.update(f'ERROR::: {smiles.shape[0]} compounds were read but {df.shape[0]} were annotated')
+            sys.exit(1)
+        df.insert(0, 'smiles', smiles['smiles'].values)
+        for column in in_data.columns:
+            df[column] = in_data[column].values
         if self.debug:
-            os.system(f'wc -l {os.path.join(self.wf, "h_smiles.txt")}')
-            os.system(f'head -n 1 {os.path.join(self.wf, "h_smiles.txt")}')
-        # 3. add properties to file
-        command = f'paste -d " " {os.path.join(self.wf, "h_smiles.txt")} {annotated} {in_data} '
-        command += f'> {os.path.join(self.wf, "processed.txt")}'
-        os.system(command)
-        if self.debug:
-            os.system(f'wc -l {os.path.join(self.wf, "processed.txt")}')
-            os.system(f'head -1 {os.path.join(self.wf, "processed.txt")}')
-        return os.path.join(self.wf, "processed.txt")
+            self.log.update(f'DEBUG::: {df.shape[0]} compounds processed')
+        return df
+
+    def _assemble_block(self, block, smiles, properties):
+        """
+        completes a block of annotated compounds with its smiles and properties, storing fg counts as uint8
+        :param block: pandas dataframe: Name column and one column per fg
+        :param smiles: pandas series: smiles of the compounds in the block
+        :param properties: pandas dataframe: w_natoms and w_rotbond of the compounds in the block
+        :return: pandas dataframe: smiles, Name, fg counts, w_natoms and w_rotbond
+        """
+        if block.shape[0] != smiles.shape[0] or block.shape[0] != properties.shape[0]:
+            self.log.update(f'ERROR::: annotated ({block.shape[0]}), smiles ({smiles.shape[0]}) and properties '
+                            f'({properties.shape[0]}) blocks do not match')
+            sys.exit(1)
+        fgs = [item for item in block.columns.tolist() if item != 'Name']
+        block[fgs] = np.minimum(block[fgs].to_numpy(), 255).astype('uint8')
+        block.insert(0, 'smiles', smiles.values)
+        block['w_natoms'] = properties['w_natoms'].values
+        block['w_rotbond'] = properties['w_rotbond'].values
+        return block
+
+    def _annotated_blocks(self, smiles_file, how='fg', data=None):
+        """
+        annotates a bbs file and yields the annotations in blocks of self.chunksize compounds, so the whole fg count
+        matrix is never held in memory
+        :param smiles_file: str: path to smiles file containing bbs (two columns space separated with smiles an id fields)
+        :param how: str: what type of fgs to annotate
+        :param data: pandas dataframe containing smiles, w_natoms and w_rotbond for the compounds in smiles_file (same
+            order) or None. If None smiles are read from smiles_file and properties are computed with iwdescr
+        :return: generator of pandas dataframes: smiles, Name, fg counts, w_natoms and w_rotbond
+        """
+        with StreamedCommand(self._annotation_command(smiles_file, how=how)) as stream:
+            annotated = pd.read_csv(stream, sep=' ', chunksize=self.chunksize)
+            if data is not None:
+                offset = 0
+                for block in annotated:
+                    chunk = data.iloc[offset: offset + block.shape[0]]
+                    offset += block.shape[0]
+                    yield self._assemble_block(block, chunk['smiles'], chunk[['w_natoms', 'w_rotbond']])
+                if offset != data.shape[0]:
+                    self.log.update(f'ERROR::: {data.shape[0]} compounds were read but {offset} were annotated')
+                    sys.exit(1)
+            else:
+                smiles = pd.read_csv(smiles_file, sep=' ', header=None, usecols=[0], names=['smiles'],
+                                     chunksize=self.chunksize)
+                with StreamedCommand([self.iwdescr, smiles_file]) as properties_stream:
+                    properties = pd.read_csv(properties_stream, sep=' ', usecols=['w_natoms', 'w_rotbond'],
+                                             chunksize=self.chunksize)
+                    for block, s_block, p_block in zip_longest(annotated, smiles, properties):
+                        if block is None or s_block is None or p_block is None:
+                            self.log.update('ERROR::: annotated, smiles and properties streams have different lengths')
+                            sys.exit(1)
+                        yield self._assemble_block(block, s_block['smiles'], p_block)
+
+    def _filter_in_blocks(self, blocks, how='fg'):
+        """
+        adds the calc_fgs and filters by fgs every block of compounds and appends the survivors. If filtering by
+        antifgs only the smiles, Name, w_natoms and w_rotbond columns are kept
+        :param blocks: iterable of pandas dataframes
+        :param how: str: which ar the base fgs ['antifg' | 'fg']
+        :return: pandas dataframe
+        """
+        self.log.update(f'INFO::: Adding calc_FG and filtering compounds by {how} in blocks of {self.chunksize}')
+        survivors = []
+        n_compounds = 0
+        for block in blocks:
+            n_compounds += block.shape[0]
+            block = self._add_calc_fgs(block, how=how, report=False)
+            block = self._filter_by_fgs(block, how=how, report=False)
+            if how == 'antifg':
+                block = block[['smiles', 'Name', 'w_natoms', 'w_rotbond']]
+            survivors.append(block)
+        df = pd.concat(survivors, ignore_index=True)
+        self.log.update(f'INFO::: {n_compounds} compounds processed')
+        self.log.update(f'INFO::: {df.shape[0]} compounds remaining')
+        return df
 
-    def _add_calc_fgs(self, file, how='fg'):
+    def _add_calc_fgs(self, df, how='fg', report=True):
         """
         calculates the calc_fgs
-        :param file: file with annotations
+        :param df: pandas dataframe with annotations
         :param how: str: which ar the base fgs ['antifg' | 'fg']
+        :param report: bool: whether to report progress in the log
         :return: df: pandas dataframe
         """
-        self.log.update(f'INFO::: Adding calc_FG to {how}')
-        df = pd.read_csv(file, sep=' ')
-        self.log.update(f'INFO::: Working on {df.shape[0]} compounds')
+        if report:
+            self.log.update(f'INFO::: Adding calc_FG to {how}')
+            self.log.update(f'INFO::: Working on {df.shape[0]} compounds')
         fields = set(df.columns.tolist())
         if how == 'fg':
             domain = copy.deepcopy(self.fg.par)
@@ -250,25 +376,30 @@ class BBReader:
                 c1 = len(set(rule_add).intersection(fields)) == len(rule_add)
                 c2 = len(set(rule_substract).intersection(fields)) == len(rule_substract)
                 if c1 and c2:
-                    if self.verbose:
+                    if self.verbose and report:
                         self.log.update(f'INFO::: adding fg {fg["name"]}')
-                    df[fg['name']] = 0
+                    if self.chunksize is None:
+                        df[fg['name']] = 0
+                    else:
+                        df[fg['name']] = np.zeros(df.shape[0], dtype='int16')
                     for field in rule_add:
                         df[fg['name']] += df[field]
                     for field in rule_substract:
                         df[fg['name']] -= df[field]
         return df
 
-    def _filter_by_fgs(self, df, how='fg'):
+    def _filter_by_fgs(self, df, how='fg', report=True):
         """
         filters dataframe by the number on instances of fgs for every given record. If filtering by antifgs remove all
         fg counts columns if not keeps only the ones with 1 to 3 FG counts of different FGs.
         :param df: pandas dataframe
         :param how: str: which ar the base fgs ['antifg' | 'fg']
+        :param report: bool: whether to report progress in the log
         :return: pandas dataframe
         """
-        self.log.update(f'INFO::: Filtering componds by {how}')
-        self.log.update(f'INFO::: {df.shape[0]} compounds to process')
+        if report:
+            self.log.update(f'INFO::: Filtering componds by {how}')
+            self.log.update(f'INFO::: {df.shape[0]} compounds to process')
         if how == 'fg':
             domain = copy.deepcopy(self.fg.par)
         else:
@@ -280,46 +411,86 @@ class BBReader:
         df.drop(inplace=True, columns=remove)
         fgs = [item for item in df.columns.tolist() if item not in base]
 
-        if len(fgs) != len(expected_fgs):
+        if len(fgs) != len(expected_fgs) and report:
             self.log.update(f"WARNING::: The number of fields in the dataframe ({len(fgs)}) does not match the number of fgs in {how} ({len(domain)})")
+        arr = df[fgs].to_numpy()  # computed once, the fg count matrix can be very large
+        n_fgs = arr.sum(axis=1)
         if how == 'fg':
-            keep1 = np.greater(np.array(df[fgs]).sum(axis=1), 0)  # at least onf FG
-            keep2 = np.less_equal(np.array(df[fgs]).sum(axis=1), 3)  # at most three FG
-            keep3 = np.less(np.array(df[fgs]).max(axis=1), 2)  # all fgs are different
-            keep = np.logical_and(keep1, keep2, keep3)
+            keep1 = np.greater(n_fgs, 0)  # at least onf FG
+            keep2 = np.less_equal(n_fgs, 3)  # at most three FG (repeated fgs are valid, see _observed_bbts)
+            keep = np.logical_and(keep1, keep2)
         else:
-            keep = np.equal(np.array(df[fgs]).sum(axis=1), 0)
+            keep = np.equal(n_fgs, 0)
 
         if self.verbose:
             self.log.update('INFO::: list of excluded compounds')
-            for index, row in df.iterrows():
-                if not keep[index]:
+            excluded = []
+            for i, (index, row) in enumerate(df.iterrows()):
+                if not keep[i]:
                     linea = row['smiles']
                     for column in fgs:
                         if row[column] > 0:
                             linea += ' ' + column
-                    self.log.update(linea, np.array(df[fgs])[index])  # check compounds excluded
+                    excluded.append(linea)  # check compounds excluded
+            if len(excluded) > 0:
+                self.log.update('\n'.join(excluded), counters={'n_excluded': len(excluded)})
         df = df[keep].copy()
-        self.log.update(f'INFO::: {df.shape[0]} compounds remaining')
+        if report:
+            self.log.update(f'INFO::: {df.shape[0]} compounds remaining')
         return df
 
     def _add_fg(self, df):
         """
-        adds the fgs to the dataframe
+        adds the fgs to the dataframe. If self.chunksize is set, the calc_fgs are added and compounds are filtered by
+        fgs block by block
         :param df: pandas dataframe
-        :return: str: filename
-        """
-        df[['smiles', 'Name']].to_csv(os.path.join(self.wf, "f_unique.smi"), sep=' ', header=False, index=False)
-        df[['smiles']].to_csv(os.path.join(self.wf, "smiles.txt"), sep=' ', index=False)
-        df[['w_natoms', 'w_rotbond']].to_csv(os.path.join(self.wf, "iwdata.txt"), sep=' ', index=False)
-        file = self._annotate_bbs(os.path.join(self.wf, "f_unique.smi"), how='fg')
-        command = f'paste -d " " {os.path.join(self.wf, "smiles.txt")} {file} '
-        command += f'{os.path.join(self.wf, "iwdata.txt")} > {os.path.join(self.wf, "processed.txt")}'
-        os.system(command)
+        :return: pandas dataframe: smiles, Name, fg counts, w_natoms and w_rotbond
+        """
+        smiles_file = os.path.join(self.scratch, "f_unique.smi")
+        df[['smiles', 'Name']].to_csv(smiles_file, sep=' ', header=False, index=False)
+        if self.chunksize is not None:
+            return self._filter_in_blocks(self._annotated_blocks(smiles_file, how='fg', data=df), how='fg')
+        fdf = self._annotate_bbs(smiles_file, how='fg')
+        if fdf.shape[0] != df.shape[0]:
+            self.log.update(f'ERROR::: {df.shape[0]} compounds were read but {fdf.shape[0]} were annotated')
+            sys.exit(1)
+        fdf.insert(0, 'smiles', df['smiles'].values)
+        fdf['w_natoms'] = df['w_natoms'].values
+        fdf['w_rotbond'] = df['w_rotbond'].values
         if self.debug:
-            os.system(f'wc -l {os.path.join(self.wf, "processed.txt")}')
-            os.system(f'head -1 {os.path.join(self.wf, "processed.txt")}')
-        return os.path.join(self.wf, "processed.txt")
+            self.log.update(f'DEBUG::: {fdf.shape[0]} compounds processed')
+        return fdf
+
+    def _observed_bbts(self, arr):
+        """
+        creates self.BBTs from the distinct FG vectors found in the bbs instead of generating all combinations of
+        compatible FGs. BBTs of the headpieces and [0, 0, 0] are always created. BBTs are sorted as they would be
+        sorted by generate_bbts so their index is their position in the list
+        :param arr: numpy array of shape (n_bbs, n_fgs) containing the FG counts of each bb (NO_FG excluded)
+        :return: numpy array of int32 containing the index of the BBT of each bb (0 if the bb has no valid BBT)
+        """
+        self.log.update('INFO::: Deriving BBTs from the FG vectors found in the bbs')
+        vectors, inverse = np.unique(arr, axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        vector_bbts = []  # BBT (tuple) for each distinct vector, None if the vector does not correspond to a BBT
+        for vector in vectors:
+            if vector.min() < 0 or not 0 < vector.sum() <= 3:
+                vector_bbts.append(None)
+                continue
+            bbt = [0] * (3 - int(vector.sum()))
+            for j in np.nonzero(vector)[0]:
+                bbt += [int(j) + 1] * int(vector[j])
+            vector_bbts.append(tuple(bbt) if compatible(bbt, self.fg) else None)
+        BBT_list = {(0, 0, 0)}
+        BBT_list.update([tuple(item['bbt']) for item in self.headpieces.par])
+        BBT_list.update([bbt for bbt in vector_bbts if bbt is not None])
+        BBT_list = sorted(BBT_list)
+        self.BBTs = [BBT(BBT=list(BBT_list[i]), fg=self.fg, headpieces=self.headpieces, index=i,
+                         maxna=self.bblim.par['max_bb_na']) for i in range(len(BBT_list))]
+        bbt_index = {bbt: i for i, bbt in enumerate(BBT_list)}
+        vector_index = np.array([0 if bbt is None else bbt_index[bbt] for bbt in vector_bbts], dtype='int32')
+        self.log.update(f'INFO::: {len(self.BBTs)} BBTs derived from {vectors.shape[0]} distinct FG vectors')
+        return vector_index[inverse]
 
     def _annotate_with_bbts(self, df):
         """
@@ -330,14 +501,17 @@ class BBReader:
         self.log.update('INFO::: Annotatingg BBTs')
         self.log.update(f'INFO::: annotating {df.shape[0]} bbs')
         # Annotate with index
-        cum_found = np.zeros(df.shape[0]).astype('int32')
         fgs = [item['name'] for item in self.fg.par if item['name'].upper() != 'NO_FG']
         arr = df[fgs].to_numpy()  # numpy array with all items in the dataframe
-        for i in tqdm(range(len(self.BBTs))):
-            bbt_query = np.array(self.BBTs[i].BBT_long[1:])
-            found = np.equal(np.equal(arr, bbt_query[None, :]).sum(axis=1), bbt_query.shape[0])
-            cum_found += found * self.BBTs[i].index
-        df['bbt_index'] = cum_found
+        if self.BBTs is None:
+            df['bbt_index'] = self._observed_bbts(arr)
+        else:
+            cum_found = np.zeros(df.shape[0]).astype('int32')
+            for i in tqdm(range(len(self.BBTs))):
+                bbt_query = np.array(self.BBTs[i].BBT_long[1:])
+                found = np.equal(np.equal(arr, bbt_query[None, :]).sum(axis=1), bbt_query.shape[0])
+                cum_found += found * self.BBTs[i].index
+            df['bbt_index'] = cum_found
         df = df[df['bbt_index'] > 0].copy()
         self.log.update(f'INFO::: {df.shape[0]} bbs remain after annotation')
         self.log.update(f'INFO::: {len(df.bbt_index.unique().tolist())} unique BBTs found in compounds')
@@ -364,7 +538,8 @@ class BBReader:
 
     def _report_compound_files(self, df):
         """report_compound_files create a smi file for each BBT and put in the file all compounds in compound
-        assigned to that BBT_index.
+        assigned to that BBT_index. Compounds are sorted by number of heavy atoms and an index of byte offsets by
+        number of heavy atoms is written next to each file (comps/{index}.idx.npy).
         :param df: pandas dataframe
         :param df: pandas dataframe
         :return: None
@@ -376,9 +551,12 @@ class BBReader:
             if cdf.shape[0] > 0:
                 counter += 1
                 cdf['id'] = cdf.apply(lambda row: ':'.join([str(row['nha']), str(row['Name'])]), axis=1)
+                nha = cdf['nha'].to_numpy()
                 cdf = cdf[['smiles', 'id']].copy()
                 cdf.to_csv(os.path.join(self.runfolder, 'comps', str(bbt.index) + '.smi'), sep=' ',
                            index=False, header=False)
+                write_nha_index(os.path.join(self.runfolder, 'comps', str(bbt.index) + '.smi'), nha,
+                                self.bblim.par['max_bb_na'])
         self.log.update(f'INFO::: Reported {counter} BBT files...')
 
     def _update_bbts(self, df):
@@ -436,19 +614,24 @@ class BBReader:
         runs the complete workflow
         :return: str: path to the bbs file
         """
-        file1, file2 = self._read_bbs()
-        file = self._add_anitfg(file1, file2)
-        df = self._add_calc_fgs(file, how='antifg')
-        df = self._filter_by_fgs(df, how='antifg')
-        file = self._add_fg(df)
-        df = self._add_calc_fgs(file, how='fg')
-        df = self._filter_by_fgs(df, how='fg')
+        if self.chunksize is None:
+            file, df = self._read_bbs()
+            df = self._add_anitfg(file, df)
+            df = self._add_calc_fgs(df, how='antifg')
+            df = self._filter_by_fgs(df, how='antifg')
+            df = self._add_fg(df)
+            df = self._add_calc_fgs(df, how='fg')
+            df = self._filter_by_fgs(df, how='fg')
+        else:
+            file, _ = self._read_bbs(properties=False)
+            self.log.update('INFO::: Annotating anti FG')
+            df = self._filter_in_blocks(self._annotated_blocks(file, how='antifg'), how='antifg')
+            df = self._add_fg(df)
         df = self._annotate_with_bbts(df)
         self._report_compound_files(df)
         self._update_bbts(df)
         self._report_bbt_info()
-        with open(os.path.join(self.wf, 'BBTs.pic'), 'wb') as f:
-            pic.dump(self.BBTs, f)
+        save_bbts(self.BBTs, os.path.join(self.wf, 'BBTs.npz'))
 
 
 if __name__ == '__main__':
@@ -7,6 +7,21 @@ __author__ = 'Alfredo Martin 2023'
 
 import numpy as np
 
+
+def compatible(A, fg):
+    """Function compatible has as argument a list with three indexes corresponding to FGs for one BBT
+    and returns a bool indicating whether these FGs are compatible in the same BBT
+    A : BBT (list of three int corresponding to a BBT)
+    fg : instance of the Parameters class (functional group parameters)
+    returns : resultado (bool)"""
+    resultado = True
+    for i in range(3):
+        for j in range(i+1, 3):
+            if A[j] != 0 and A[i] != 0 and A[j] in fg.par[A[i]]['self_incompatibility']:
+                resultado=False
+    return resultado
+
+
 class BBT:
     """BBT class instances store attributes of a building block type and also methods for its creation
     and modification"""
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+# bbt_store
+# Jose Alfredo Martin
+
+__version__ = 'bbt_store.v.12.0.0'
+__author__ = 'Alfredo Martin 2023'
+
+# Python modules
+import os
+import _pickle as pic
+# External modules
+import numpy as np
+
+
+def save_bbts(BBTs, filename):
+    """saves a list of BBT instances as a columnar store (uncompressed npz file). Each attribute of the BBT class is
+    stored as a column (or a matrix for the attributes that are arrays) with one row per BBT in the order of the list
+    (the list is not sorted here). BBReader._update_bbts ranks the BBTs by BBT_multi and n_compounds into their order
+    attribute and leaves the list sorted by index, so rows can be looked up by the index of the BBT.
+    BBTs: list of instances of BBT class (its index must match its position in the list)
+    filename: str: path to the npz file
+    returns: None"""
+    maxna = BBTs[0].maxna
+    np.savez(filename,
+             maxna=np.array(maxna),
+             BBT=np.array([bbt.BBT for bbt in BBTs], dtype='int32'),
+             BBT_long=np.array([bbt.BBT_long for bbt in BBTs], dtype='uint8'),
+             BBT_name=np.array([bbt.BBT_name for bbt in BBTs], dtype='U'),
+             BBT_multi=np.array([bbt.BBT_multi for bbt in BBTs], dtype='int8'),
+             n_compounds=np.array([bbt.n_compounds for bbt in BBTs], dtype='int32'),
+             smiles_example=np.array(['' if bbt.smiles_example is None else bbt.smiles_example for bbt in BBTs],
+                                     dtype='U'),
+             headpiece=np.array([-1 if bbt.headpiece is None else bbt.headpiece for bbt in BBTs], dtype='int32'),
+             min_atoms=np.array([bbt.min_atoms for bbt in BBTs], dtype='int32'),
+             max_atoms=np.array([bbt.max_atoms for bbt in BBTs], dtype='int32'),
+             index=np.array([bbt.index for bbt in BBTs], dtype='int32'),
+             order=np.array([bbt.order for bbt in BBTs], dtype='int32'))
+
+
+def load_bbts(folder):
+    """loads the BBTs of a BBT creator run. It reads the columnar store if present and falls back to the pickled
+    list of BBT instances created by previous versions
+    folder: str: results folder of the BBT creator run
+    returns: instance of BBTStore class or list of instances of BBT class"""
+    if os.path.isfile(os.path.join(folder, 'BBTs.npz')):
+        return BBTStore(os.path.join(folder, 'BBTs.npz'))
+    with open(os.path.join(folder, 'BBTs.pic'), 'rb') as f:
+        return pic.load(f)
+
+
+class BBTView:
+    """thin read only view of a single BBT in a BBTStore instance. It exposes the same attributes than the BBT class
+    so it can be used wherever a BBT instance is expected"""
+
+    def __init__(self, store, i):
+        """Initiallizes the view
+        store: instance of BBTStore class
+        i: int: row of the BBT in the store
+        returns: None"""
+        self.store = store
+        self.i = i
+
+    @property
+    def BBT(self):
+        return self.store.bbt_lists[self.i]
+
+    @property
+    def BBT_long(self):
+        return self.store.BBT_long[self.i].tolist()
+
+    @property
+    def BBT_name(self):
+        return self.store.BBT_name[self.i].tolist()
+
+    @property
+    def BBT_multi(self):
+        return int(self.store.BBT_multi[self.i])
+
+    @property
+    def n_compounds(self):
+        return self.store.n_compounds[self.i]
+
+    @property
+    def smiles_example(self):
+        smiles = str(self.store.smiles_example[self.i])
+        return smiles if smiles != '' else None
+
+    @property
+    def headpiece(self):
+        headpiece = int(self.store.headpiece[self.i])
+        return headpiece if headpiece >= 0 else None
+
+    @property
+    def min_atoms(self):
+        return int(self.store.min_atoms[self.i])
+
+    @property
+    def max_atoms(self):
+        return int(self.store.max_atoms[self.i])
+
+    @property
+    def index(self):
+        return int(self.store.index[self.i])
+
+    @property
+    def order(self):
+        return int(self.store.order[self.i])
+
+    @property
+    def maxna(self):
+        return self.store.maxna
+
+
+class BBTStore:
+    """BBTStore instances hold all the BBTs of a run as a struct of arrays: an n_compounds matrix of shape
+    (n_BBTs, max_bb_na + 1), BBT and BBT_long index matrices and one column per scalar attribute. Indexing the store
+    returns BBTView instances so the BBTs[i].attr API of the list of BBT instances is kept, while vectorised code can
+    slice the matrices directly (for example BBTs.n_compounds[indexes])."""
+
+    def __init__(self, filename):
+        """Loads the store. The BBT_long matrix is only read from disk when it is used
+        filename: str: path to the npz file written by save_bbts
+        returns: None"""
+        self.filename = filename
+        with np.load(filename) as data:
+            self.maxna = int(data['maxna'])
+            self.BBT = data['BBT']
+            self.BBT_name = data['BBT_name']
+            self.BBT_multi = data['BBT_multi']
+            self.n_compounds = data['n_compounds']
+            self.smiles_example = data['smiles_example']
+            self.headpiece = data['headpiece']
+            self.min_atoms = data['min_atoms']
+            self.max_atoms = data['max_atoms']
+            self.index = data['index']
+            self.order = data['order']
+        self._BBT_long = None
+        self._bbt_lists = None
+        self._views = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_bbt_lists'] = None
+        state['_views'] = None
+        return state
+
+    def __len__(self):
+        return self.BBT.shape[0]
+
+    def __getitem__(self, i):
+        if self._views is None:
+            self._views = [BBTView(self, j) for j in range(len(self))]
+        return self._views[i]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    @property
+    def BBT_long(self):
+        if self._BBT_long is None:
+            with np.load(self.filename) as data:
+                self._BBT_long = data['BBT_long']
+        return self._BBT_long
+
+    @property
+    def bbt_lists(self):
+        """list of BBTs as lists of int (cached because it is used in the inner loops of the design expansion, must not
+        be modified)"""
+        if self._bbt_lists is None:
+            self._bbt_lists = self.BBT.tolist()
+        return self._bbt_lists
+
+
+if __name__ == '__main__':
+    print(__version__)
+    print(__author__)
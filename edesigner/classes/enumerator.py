@@ -4,13 +4,15 @@
 
 # Python modules
 import copy
-import pandas as pd
 import os
 import shutil
 import sys
 import json
 # Local Modules
 from classes.synth_graph import SynthGraph
+from classes.smi_io import find_smi, count_lines, nha_index_file, copy_range
+# external modules
+import numpy as np
 
 
 
@@ -73,7 +75,9 @@ class Enumerator:
     def write_bbs_files(self):
         """
         Writes the building block files into the working folder. Picks the bbs from bbs if passed and if not from lib,
-        but one of them is required
+        but one of them is required. The building blocks of each BBT with up to best_all_index atoms are copied as a
+        single byte range using the index written by BBReader next to the BBT file (files without index are read up to
+        the first building block with more atoms)
         :return: None
         """
         if self.bbs is not None:
@@ -96,12 +100,18 @@ class Enumerator:
             if self.bbs is not None:
                 shutil.copy(self.bbs[i], os.path.join(self.wfolder, out_bbs_file))
             else:
-                for j in range(len(self.lib.bbts[i])):
-                    bbs_file = str(self.lib.bbts[i][j]) + ".smi"
-                    command = f'head -{self.lib.all_bbt_limits[i][j]} '
-                    command += f'{os.path.join(self.base_folder, self.lib.run_id, "comps", bbs_file)} '
-                    command += f'>> {os.path.join(self.wfolder, out_bbs_file)}'
-                    os.system(command)
+                with open(os.path.join(self.wfolder, out_bbs_file), 'wb') as f:
+                    for j in range(len(self.lib.bbts[i])):
+                        bbs_file = os.path.join(self.base_folder, self.lib.run_id, "comps", str(self.lib.bbts[i][j]) + ".smi")
+                        if os.path.isfile(nha_index_file(bbs_file)):
+                            index = np.load(nha_index_file(bbs_file))
+                            copy_range(bbs_file, f, int(index[min(self.lib.best_all_index[i] + 1, index.shape[0] - 1)]))
+                        else:  # ids are nha:name and the file is sorted by nha
+                            with open(bbs_file, 'rb') as g:
+                                for line in g:
+                                    if int(line.split()[1].split(b':')[0]) > self.lib.best_all_index[i]:
+                                        break
+                                    f.write(line)
 
     def get_valences(self, mrd, preparations):
         """
@@ -497,10 +507,12 @@ class Enumerator:
         """runs an analysis of the building blocks and writes a set of files with the compounds in the original
         bbs files that were discarded during preparation
         returns: None"""
+        import pandas as pd  # only needed here, imported on demand to keep the start of the enumerations fast
         for i in range(self.n_cycles):
             cycle = i + 1
             idf = pd.read_csv(os.path.join(self.wfolder, f'C{cycle}.smi'), sep=' ', header=None, names=['smiles', 'id'])
-            odf = pd.read_csv(os.path.join(self.wfolder, f'R0{cycle}.smi'), sep=' ', header=None, names=['smiles', 'id'])
+            odf = pd.read_csv(find_smi(os.path.join(self.wfolder, f'R0{cycle}.smi')), sep=' ', header=None,
+                              names=['smiles', 'id'])
             odf = pd.merge(idf, odf, on='id', how='inner')
             idf = idf[~ idf['id'].isin(odf['id'].unique().tolist())].copy()
             if idf.shape[0] > 0:
@@ -508,8 +520,21 @@ class Enumerator:
                                              header=False, index=False, sep=' ')
 
 
+    def print_file_sizes(self):
+        """prints the number of lines of the smiles files (compressed or not) in the working folder
+        returns: None"""
+        total = 0
+        for file in sorted(os.listdir(self.wfolder)):
+            if file.endswith('.smi') or file.endswith('.smi.gz') or file.endswith('.smi.xz'):
+                count = count_lines(os.path.join(self.wfolder, file))
+                total += count
+                print(str(count).rjust(12), os.path.join(self.wfolder, file))
+        print(str(total).rjust(12), 'total')
+
     def run_graph_enumeration(self, multireaction, preparations, enum_deprotection, enum_reaction,
-                              n=0, chunksize=400000, just_json=False):
+                              n=0, chunksize=400000, just_json=False, local=False, cores=-1, sampling=None,
+                              seed=None, cache=None, compression=None, fuse=False, autotune=False,
+                              target_seconds=900, memory_budget=1024):
         """Runs an enumeration for the instance of the class through graph_enumerator
         base_foldr: str: path to the base folder
         multireaction: instance of Par class coding the multireaction parameters
@@ -517,6 +542,17 @@ class Enumerator:
         enum_deprotection: instacne of Par class coding the enumeration deprotections
         n: str: number of compounds to enumerate, 0 means the whole library
         chunksize: int: maximum number of molecules to enumerate in each core
+        just_json: bool: whether to write the json config file only
+        local: bool: whether chunks are run in a local pool of workers instead of through qsub
+        cores: int: number of workers of the local pool (-1 means all cores)
+        sampling: str or None: 'uniform' or 'nha' to sample building block tuples before enumeration when n > 0
+        seed: int or None: seed for sampling
+        cache: str or None: path to a folder to cache prepared building block files (shared in batch enumerations)
+        compression: str or None: 'gzip' or 'lzma' to write the scaffolds and the enumeration compressed
+        fuse: bool: whether consecutive independent joins are run in a single trxn call
+        autotune: bool: whether the number of compounds per chunk is computed from a calibration run of each reaction
+        target_seconds: int: wall time targeted for each chunk when autotune is set
+        memory_budget: int: maximum size (MB) of the products of each chunk when autotune is set
         returns: str: path to the enumerated library"""
         self.write_graph_enumeration_json(multireaction, preparations, enum_deprotection)
         self.write_summary_file(enum_reaction, enum_deprotection)
@@ -524,15 +560,44 @@ class Enumerator:
             # write the source building block files
             self.write_bbs_files()
             # instantiate the graph enumerator
-            gen = SynthGraph(self.wfolder, os.path.join(self.wfolder, "config.json"), n=n, chunksize=chunksize)
+            gen = SynthGraph(self.wfolder, os.path.join(self.wfolder, "config.json"), n=n, chunksize=chunksize,
+                             local=local, cores=cores, sampling=sampling, seed=seed, cache=cache,
+                             compression=compression, fuse=fuse, autotune=autotune,
+                             target_seconds=target_seconds, memory_budget=memory_budget)
             gen.run_graph()
             if not gen.success:
                 pass
-            print(f'{os.path.join(self.wfolder, "enumeration.smi")} has been created')
-            command = f'wc -l {self.wfolder}/*.smi'
-            os.system(command)
+            print(f'{find_smi(os.path.join(self.wfolder, "enumeration.smi"))} has been created')
+            self.print_file_sizes()
             self.run_bb_analysis()
 
+    def enumerate_members(self, multireaction, preparations, enum_deprotection, enum_reaction, start, stop=None,
+                          verbose=True, cache=None):
+        """Enumerates on demand the members of the library in a range of ordinals. The ordinal of a member is the
+        mixed radix number whose digits are the indexes of its building blocks in the prepared building block file
+        of each cycle (last cycle is the least significant digit), so a huge library can be paged or sharded without
+        enumerating it
+        multireaction: instance of Par class coding the multireaction parameters
+        preparations: instance of Par class coding the preparations parameters
+        enum_deprotection: instacne of Par class coding the enumeration deprotections
+        enum_reaction: instance of Par class coding the enumeration reactions
+        start: int: ordinal of the first member (0 based)
+        stop: int or None: ordinal after the last member (if None only the member start is enumerated)
+        verbose: bool: whether to print the building blocks of each member
+        cache: str or None: path to a folder where prepared building blocks files are cached (see SynthGraph)
+        returns: str: path to the file containing the enumerated members"""
+        self.write_graph_enumeration_json(multireaction, preparations, enum_deprotection)
+        self.write_summary_file(enum_reaction, enum_deprotection)
+        self.write_bbs_files()
+        gen = SynthGraph(self.wfolder, os.path.join(self.wfolder, "config.json"), cache=cache)
+        gen.run_graph(ordinals=(start, stop))
+        if verbose:
+            with open(os.path.join(self.wfolder, 'target.txt'), 'r') as f:
+                for i, line in enumerate(f):
+                    print(start + i, line.strip())
+        print(f'{find_smi(os.path.join(self.wfolder, "enumeration.smi"))} has been created')
+        return find_smi(os.path.join(self.wfolder, "enumeration.smi"))
+
 
 if __name__ == '__main__':
     print(version)
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+# lib_index
+# Jose Alfredo Martin
+
+__version__ = 'lib_index.v.12.0.0'
+__author__ = 'Alfredo Martin 2023'
+
+# Python modules
+import os
+from collections import Counter
+# External modules
+import numpy as np
+# Local modules
+from classes.libdesign_store import LibDesignStore, STORE_FILE, PICKLE_FILE
+
+INDEX_FILE = 'libDESIGNs_index.npz'
+
+
+def postings(triples):
+    """converts (key, id, multiplicity) triples into a compressed posting list (one slice of sorted ids and their
+    multiplicities per key)
+    triples: list of tuples of int: key, library id and multiplicity
+    returns: tuple of numpy arrays: keys, pointers (start of the slice of each key, plus the end), ids, multiplicities"""
+    if len(triples) == 0:
+        empty = np.zeros(0, dtype='int64')
+        return empty, np.zeros(1, dtype='int64'), empty, empty.astype('int32')
+    arr = np.array(sorted(triples), dtype='int64')
+    keys, starts = np.unique(arr[:, 0], return_index=True)
+    pointers = np.append(starts, arr.shape[0]).astype('int64')
+    return keys, pointers, arr[:, 1].copy(), arr[:, 2].astype('int32')
+
+
+class LibIndex:
+    """LibIndex instances hold an inverted index of the libDESIGNs of an eDESIGNER run: for each enumeration reaction
+    and deprotection the sorted array of ids of the libraries containing it, with the number of times it appears in
+    each library. Queries combine the posting lists with vectorised intersections, unions and differences, so the
+    libDESIGNs are not unpickled to answer them. The index is built once per eDESIGNER run and saved in the results
+    folder (libDESIGNs_index.npz)"""
+
+    def __init__(self, ids, n_all, reactions, deprotections):
+        """Initiallizes the instance
+        ids: numpy array: sorted ids of all the libraries
+        n_all: numpy array: number of compounds of each library (in the order of ids)
+        reactions: tuple of numpy arrays: posting lists of the reactions (see postings function)
+        deprotections: tuple of numpy arrays: posting lists of the deprotections (see postings function)
+        returns: None"""
+        self.ids = ids
+        self.n_all = n_all
+        self.reactions = reactions
+        self.deprotections = deprotections
+
+    @classmethod
+    def build(cls, designs):
+        """builds the index from the libDESIGNs of a run. The tables of the sqlite store are used directly when
+        available, otherwise the libDESIGNs are streamed
+        designs: instance of LibDesignStore or PickledLibDesigns class
+        returns: instance of LibIndex class"""
+        if isinstance(designs, LibDesignStore):
+            rows = designs.con.execute('SELECT id, n_all FROM libdesigns ORDER BY id').fetchall()
+            reactions = designs.con.execute('SELECT reaction, id, multiplicity FROM reactions').fetchall()
+            deprotections = designs.con.execute('SELECT deprotection, id, multiplicity FROM deprotections').fetchall()
+        else:
+            rows = []
+            reactions = []
+            deprotections = []
+            for lib in designs:
+                rows.append((lib.id, lib.n_all))
+                reactions += [(reaction, lib.id, count) for reaction, count in Counter(lib.reactions).items()]
+                deprotections += [(deprotection, lib.id, count) for deprotection, count in
+                                  Counter(lib.deprotections).items()]
+            rows.sort()
+        ids = np.array([row[0] for row in rows], dtype='int64')
+        n_all = np.array([0 if row[1] is None else row[1] for row in rows], dtype='int64')
+        return cls(ids, n_all, postings(reactions), postings(deprotections))
+
+    def save(self, filename):
+        """saves the index in a npz file
+        filename: str: path to the file
+        returns: None"""
+        np.savez(filename, ids=self.ids, n_all=self.n_all,
+                 r_keys=self.reactions[0], r_pointers=self.reactions[1], r_ids=self.reactions[2],
+                 r_mult=self.reactions[3], d_keys=self.deprotections[0], d_pointers=self.deprotections[1],
+                 d_ids=self.deprotections[2], d_mult=self.deprotections[3])
+
+    @classmethod
+    def load(cls, filename):
+        """loads an index saved with the save method
+        filename: str: path to the file
+        returns: instance of LibIndex class"""
+        with np.load(filename) as data:
+            return cls(data['ids'], data['n_all'],
+                       (data['r_keys'], data['r_pointers'], data['r_ids'], data['r_mult']),
+                       (data['d_keys'], data['d_pointers'], data['d_ids'], data['d_mult']))
+
+    def posting(self, lists, key, multiplicity=1):
+        """gets the ids of the libraries containing a key at least multiplicity times
+        lists: tuple of numpy arrays: posting lists (self.reactions or self.deprotections)
+        key: int: reaction or deprotection index
+        multiplicity: int
+        returns: numpy array: sorted ids"""
+        keys, pointers, ids, mult = lists
+        i = np.searchsorted(keys, key)
+        if i == keys.shape[0] or keys[i] != key:
+            return np.zeros(0, dtype='int64')
+        start, stop = pointers[i], pointers[i + 1]
+        return ids[start:stop][mult[start:stop] >= multiplicity]
+
+    def query(self, reactions=None, deprotections=None, any_reactions=None, any_deprotections=None,
+              not_reactions=None, not_deprotections=None, min_n_all=None, max_n_all=None):
+        """selects the libraries meeting all the conditions passed and ranks them by number of compounds
+        reactions: list of int or None: reactions that must be present (repeated reactions must be present as many
+            times as repeated)
+        deprotections: list of int or None: deprotections that must be present (same as reactions)
+        any_reactions: list of int or None: at least one of these reactions must be present
+        any_deprotections: list of int or None: at least one of these deprotections must be present
+        not_reactions: list of int or None: none of these reactions can be present
+        not_deprotections: list of int or None: none of these deprotections can be present
+        min_n_all: int or None: minimum number of compounds of the library
+        max_n_all: int or None: maximum number of compounds of the library
+        returns: numpy array: ids of the selected libraries sorted by decreasing n_all"""
+        selected = self.ids
+        for lists, required in [(self.reactions, reactions), (self.deprotections, deprotections)]:
+            for key, multiplicity in Counter(required or []).items():
+                selected = np.intersect1d(selected, self.posting(lists, key, multiplicity), assume_unique=True)
+        for lists, options in [(self.reactions, any_reactions), (self.deprotections, any_deprotections)]:
+            if options:
+                union = np.unique(np.concatenate([self.posting(lists, key) for key in options]))
+                selected = np.intersect1d(selected, union, assume_unique=True)
+        for lists, excluded in [(self.reactions, not_reactions), (self.deprotections, not_deprotections)]:
+            for key in excluded or []:
+                selected = np.setdiff1d(selected, self.posting(lists, key), assume_unique=True)
+        n_all = self.n_all[np.searchsorted(self.ids, selected)]
+        mask = np.ones(selected.shape[0], dtype=bool)
+        if min_n_all is not None:
+            mask &= n_all >= min_n_all
+        if max_n_all is not None:
+            mask &= n_all <= max_n_all
+        selected = selected[mask]
+        n_all = n_all[mask]
+        return selected[np.argsort(-n_all, kind='stable')]
+
+
+def load_lib_index(folder, designs):
+    """loads the inverted index of an eDESIGNER run, building it (and saving it) if it does not exist or if it is
+    older than the libDESIGNs
+    folder: str: results folder of the eDESIGNER run
+    designs: instance of LibDesignStore or PickledLibDesigns class: libDESIGNs of the run
+    returns: instance of LibIndex class"""
+    index_file = os.path.join(folder, INDEX_FILE)
+    sources = [os.path.join(folder, file) for file in [STORE_FILE, PICKLE_FILE]
+               if os.path.isfile(os.path.join(folder, file))]
+    if os.path.isfile(index_file) and all([os.path.getmtime(index_file) >= os.path.getmtime(file) for file in sources]):
+        return LibIndex.load(index_file)
+    index = LibIndex.build(designs)
+    try:
+        index.save(index_file)
+    except OSError:
+        print(f'WARNING::: the library index could not be saved in {folder}')
+    return index
+
+
+if __name__ == '__main__':
+    print(__version__)
+    print(__author__)
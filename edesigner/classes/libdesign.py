@@ -6,6 +6,7 @@
 import sys
 # Local Modules
 from classes.bbt import BBT
+from classes.bbt_store import BBTStore
 # external modules
 import numpy as np
 
@@ -99,7 +100,7 @@ class LibDesign:
     def validate_lib(self, BBTs, par, deprotection, na_dist):
         """This method validates the library and marks it for elimination if it does not meet
         the appropriate criteria
-        BBTs : list of instances of BBT class
+        BBTs : list of instances of BBT class or instance of BBTStore class
         par: instance of Parameters class (par)
         deprotection: instance of Parameters class (deprotection)
         na_dist: numpy array with as many dimensions of cycles in the library (contains number of atoms in library in
@@ -121,8 +122,11 @@ class LibDesign:
         # Next creates a distribution of number of molecules based on atom count for each cycle, both for internal and
         # all BBs
         # first we sum all bbs coming from different BBTs in one single array by number of atoms for each cycle
-        all_ncomps = [np.array([BBTs[bbt].n_compounds for bbt in self.bbts[i]]) for i in range(self.n_cycles)]
-        all_ncomps = [item.sum(axis=0) for item in all_ncomps]
+        if isinstance(BBTs, BBTStore):  # the rows of the n_compounds matrix can be sliced directly
+            all_ncomps = [BBTs.n_compounds[self.bbts[i]].sum(axis=0) for i in range(self.n_cycles)]
+        else:
+            all_ncomps = [np.array([BBTs[bbt].n_compounds for bbt in self.bbts[i]]) for i in range(self.n_cycles)]
+            all_ncomps = [item.sum(axis=0) for item in all_ncomps]
         all_cum_ncomps = [item.cumsum() for item in all_ncomps]
 
         # next calculates the matrix distribution of number of compounds
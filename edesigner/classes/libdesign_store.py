@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+# libdesign_store
+# Jose Alfredo Martin
+
+__version__ = 'libdesign_store.v.12.0.0'
+__author__ = 'Alfredo Martin 2023'
+
+# Python modules
+import os
+import sqlite3
+from collections import Counter
+import _pickle as pic
+
+STORE_FILE = 'libDESIGNs.sqlite'
+PICKLE_FILE = 'libDESIGNs.pic'
+
+
+def lib_id_key(lib_id):
+    """converts a lib_id into the key used by the store (same format as the --lib_id argument of the scripts)
+    lib_id: tuple of int
+    returns: str"""
+    return '_'.join([str(item) for item in lib_id])
+
+
+def save_libdesigns(lib_list, filename):
+    """saves a list of libDESIGNs in an sqlite store. Each libDESIGN is stored pickled in one row keyed by its id and
+    lib_id, and the reactions, deprotections (with their multiplicity), headpiece and BBTs of each cycle are stored in
+    indexed tables so libraries can be selected without unpickling them
+    lib_list: list of instances of LibDesign class
+    filename: str: path to the sqlite file (it is overwritten)
+    returns: None"""
+    if os.path.isfile(filename):
+        os.remove(filename)
+    con = sqlite3.connect(filename)
+    con.executescript("""
+        CREATE TABLE libdesigns (id INTEGER PRIMARY KEY, lib_id TEXT UNIQUE NOT NULL, n_cycles INTEGER,
+                                 headpiece INTEGER, n_all INTEGER, data BLOB NOT NULL);
+        CREATE TABLE reactions (id INTEGER NOT NULL, reaction INTEGER NOT NULL, multiplicity INTEGER NOT NULL);
+        CREATE TABLE deprotections (id INTEGER NOT NULL, deprotection INTEGER NOT NULL, multiplicity INTEGER NOT NULL);
+        CREATE TABLE bbts (id INTEGER NOT NULL, cycle INTEGER NOT NULL, bbt INTEGER NOT NULL);
+        """)
+    with con:
+        for lib in lib_list:
+            con.execute('INSERT INTO libdesigns VALUES (?, ?, ?, ?, ?, ?)',
+                        (lib.id, lib_id_key(lib.lib_id), lib.n_cycles, lib.headpiece,
+                         None if lib.n_all is None else int(lib.n_all), pic.dumps(lib)))
+            con.executemany('INSERT INTO reactions VALUES (?, ?, ?)',
+                            [(lib.id, reaction, count) for reaction, count in Counter(lib.reactions).items()])
+            con.executemany('INSERT INTO deprotections VALUES (?, ?, ?)',
+                            [(lib.id, deprotection, count) for deprotection, count in Counter(lib.deprotections).items()])
+            con.executemany('INSERT INTO bbts VALUES (?, ?, ?)',
+                            [(lib.id, i + 1, bbt) for i in range(lib.n_cycles) for bbt in lib.bbts[i]])
+    con.executescript("""
+        CREATE INDEX reactions_index ON reactions (reaction, multiplicity, id);
+        CREATE INDEX deprotections_index ON deprotections (deprotection, multiplicity, id);
+        CREATE INDEX bbts_index ON bbts (bbt, id);
+        CREATE INDEX headpiece_index ON libdesigns (headpiece, id);
+        """)
+    con.close()
+
+
+def load_libdesigns(folder):
+    """opens the libDESIGNs of an eDESIGNER run. It uses the sqlite store if present and falls back to the stream of
+    pickled libDESIGNs created by previous versions
+    folder: str: results folder of the eDESIGNER run
+    returns: instance of LibDesignStore class or PickledLibDesigns class"""
+    if os.path.isfile(os.path.join(folder, STORE_FILE)):
+        return LibDesignStore(os.path.join(folder, STORE_FILE))
+    return PickledLibDesigns(os.path.join(folder, PICKLE_FILE))
+
+
+class LibDesignStore:
+    """LibDesignStore instances give access to the libDESIGNs of an eDESIGNER run stored by save_libdesigns. Single
+    libraries are loaded by id or lib_id without reading the others, iterating the store unpickles the libraries one at
+    a time and the ids of the libraries containing a reaction, deprotection, headpiece or BBT are taken from indexes"""
+
+    def __init__(self, filename):
+        """Opens the store in read only mode. The connection can be used from other threads (the query server), the
+        callers serialize its use
+        filename: str: path to the sqlite file
+        returns: None"""
+        self.filename = filename
+        self.con = sqlite3.connect(f'file:{filename}?mode=ro', uri=True, check_same_thread=False)
+
+    def __getstate__(self):
+        return {'filename': self.filename}
+
+    def __setstate__(self, state):
+        self.__init__(state['filename'])
+
+    def __len__(self):
+        return self.con.execute('SELECT COUNT(*) FROM libdesigns').fetchone()[0]
+
+    def __iter__(self):
+        for (data,) in self.con.execute('SELECT data FROM libdesigns ORDER BY id'):
+            yield pic.loads(data)
+
+    def get(self, lib_idx):
+        """gets a libDESIGN by its id
+        lib_idx: int: id of the library
+        returns: instance of LibDesign class or None if not found"""
+        row = self.con.execute('SELECT data FROM libdesigns WHERE id = ?', (lib_idx,)).fetchone()
+        return None if row is None else pic.loads(row[0])
+
+    def get_by_lib_id(self, lib_id):
+        """gets a libDESIGN by its lib_id
+        lib_id: tuple of int
+        returns: instance of LibDesign class or None if not found"""
+        row = self.con.execute('SELECT data FROM libdesigns WHERE lib_id = ?', (lib_id_key(lib_id),)).fetchone()
+        return None if row is None else pic.loads(row[0])
+
+    def lib_ids(self):
+        """iterates the ids, number of cycles and lib_ids of the libDESIGNs without unpickling them
+        returns: generator of tuples: id, n_cycles and lib_id (tuple of int)"""
+        for lib_idx, n_cycles, lib_id in self.con.execute('SELECT id, n_cycles, lib_id FROM libdesigns ORDER BY id'):
+            yield lib_idx, n_cycles, tuple([int(item) for item in lib_id.split('_')])
+
+    def ids_with_reaction(self, reaction, multiplicity=1):
+        """gets the ids of the libraries containing a reaction at least multiplicity times
+        reaction: int: enumeration reaction index
+        multiplicity: int
+        returns: list of int (sorted)"""
+        query = 'SELECT id FROM reactions WHERE reaction = ? AND multiplicity >= ? ORDER BY id'
+        return [row[0] for row in self.con.execute(query, (reaction, multiplicity))]
+
+    def ids_with_deprotection(self, deprotection, multiplicity=1):
+        """gets the ids of the libraries containing a deprotection at least multiplicity times
+        deprotection: int: enumeration deprotection index
+        multiplicity: int
+        returns: list of int (sorted)"""
+        query = 'SELECT id FROM deprotections WHERE deprotection = ? AND multiplicity >= ? ORDER BY id'
+        return [row[0] for row in self.con.execute(query, (deprotection, multiplicity))]
+
+    def ids_with_headpiece(self, headpiece):
+        """gets the ids of the libraries built on a headpiece
+        headpiece: int: index of the BBT of the headpiece
+        returns: list of int (sorted)"""
+        query = 'SELECT id FROM libdesigns WHERE headpiece = ? ORDER BY id'
+        return [row[0] for row in self.con.execute(query, (headpiece,))]
+
+    def ids_with_bbt(self, bbt):
+        """gets the ids of the libraries using a BBT in any cycle
+        bbt: int: index of the BBT
+        returns: list of int (sorted)"""
+        query = 'SELECT DISTINCT id FROM bbts WHERE bbt = ? ORDER BY id'
+        return [row[0] for row in self.con.execute(query, (bbt,))]
+
+
+class PickledLibDesigns:
+    """read only access to the stream of pickled libDESIGNs (libDESIGNs.pic) with the same interface than
+    LibDesignStore for the lookups. Lookups scan the stream until the library is found"""
+
+    def __init__(self, filename):
+        """Initiallizes the instance
+        filename: str: path to the pickle file
+        returns: None"""
+        self.filename = filename
+
+    def __iter__(self):
+        with open(self.filename, 'rb') as f:
+            while True:
+                try:
+                    lib = pic.load(f)
+                except:
+                    break
+                yield lib
+
+    def lib_ids(self):
+        for lib in self:
+            yield lib.id, lib.n_cycles, tuple(lib.lib_id)
+
+    def get(self, lib_idx):
+        for lib in self:
+            if lib.id == lib_idx:
+                return lib
+        return None
+
+    def get_by_lib_id(self, lib_id):
+        for lib in self:
+            if lib.lib_id == tuple(lib_id):
+                return lib
+        return None
+
+
+if __name__ == '__main__':
+    print(__version__)
+    print(__author__)
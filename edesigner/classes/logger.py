@@ -1,15 +1,41 @@
 # Module logger
-version = 'module_logger.v.1.2'
+version = 'module_logger.v.1.3'
 
 import time
 import os
+import json
+import atexit
+import threading
+
+LEVELS = ['DEBUG', 'INFO', 'WARNING', 'ERROR']
+
+
+def get_level(text):
+    """gets the level of a message from its prefix (ERROR:::, WARNING:::, INFO::: or DEBUG:::)
+    text : str
+    returns : str (INFO if the message has no prefix)"""
+    head = text.lstrip()[:10]
+    if ':::' not in head:
+        return 'INFO'
+    for level in LEVELS:
+        if head.startswith(level + ':::'):
+            return level
+    return 'INFO'
 
 
 class Logger:
-    def __init__(self, filename, prepend_timestamp=False, prepend_day_timestamp=False, vl=0):
-        """Initiallizes the logger instance
+    def __init__(self, filename, prepend_timestamp=False, prepend_day_timestamp=False, vl=0, buffer_size=1000,
+                 flush_interval=2.0, flush_level='WARNING', structured=False):
+        """Initiallizes the logger instance. Messages are kept in a buffer that is written to the file when it holds
+        buffer_size messages, every flush_interval seconds, when a message of flush_level or higher is received and
+        when the program ends
         filename : str (filename of the log file)
         vl: int: verbosity level
+        buffer_size : int (number of buffered messages that triggers a write)
+        flush_interval : float (seconds between writes of the buffer, 0 disables the timer)
+        flush_level : str (messages of this level or higher are written inmediately)
+        structured : bool (if True the messages are also written as json lines in a file with .jsonl extension
+            containing the time (seconds since epoch), elapsed seconds, level, stage, process, text and counters of each message)
         retunrs : None"""
         self.filename = filename
         self.strtimestamp = ''
@@ -22,22 +48,103 @@ class Logger:
             self.strtimestamp = time.strftime("%Y%m%d", time.gmtime())
             head, tail = os.path.split(self.filename)
             self.filename = os.path.join(head, self.strtimestamp + tail)
+        self.json_filename = os.path.splitext(self.filename)[0] + '.jsonl' if structured else None
+        self.buffer_size = buffer_size
+        self.flush_level = LEVELS.index(flush_level)
+        self.stage = None
+        self.start = time.time()
+        self.buffer = []
+        self.lock = threading.RLock()
+        self.queue = None
+        self.manager = None
+        self.listener = None
         with open(self.filename, 'w') as f:
             f.write('log file created on: ' + time.asctime() + '\n')
+        if self.json_filename is not None:
+            open(self.json_filename, 'w').close()
+        self.stop = threading.Event()
+        if flush_interval > 0:
+            timer = threading.Thread(target=self._flush_periodically, args=(flush_interval,), daemon=True)
+            timer.start()
+        atexit.register(self.close)
 
-    def update(self, text, to_file=True, to_screen=True, v=4):
+    def _flush_periodically(self, flush_interval):
+        while not self.stop.wait(flush_interval):
+            self.flush()
+
+    def update(self, text, to_file=True, to_screen=True, v=4, stage=None, counters=None, pid=None):
         """updates the file
         text : str (text to print)
         to_file : bool (whether to print the text to the instance file)
         to_screen : bool (whether to print the text to the screen)
         vl: int: verbosity (only if v > self.vl will do the reporting, default 4)
+        stage : str or None (stage of the program, it is kept for the following messages)
+        counters : dict or None (numbers reported in the structured log)
+        pid : int or None (process sending the message, the current process if None)
         returns : None"""
         if v > self.vl:
-            if to_file:
-                with open(self.filename, 'a') as f:
-                    f.write(text + '\n')
+            level = get_level(text)
+            with self.lock:
+                if stage is not None:
+                    self.stage = stage
+                if to_file:
+                    self.buffer.append((time.time(), level, self.stage, os.getpid() if pid is None else pid, text,
+                                        counters))
             if to_screen:
                 print(text)
+            if to_file and (len(self.buffer) >= self.buffer_size or LEVELS.index(level) >= self.flush_level):
+                self.flush()
+        return None
+
+    def flush(self):
+        """writes the buffered messages
+        returns : None"""
+        with self.lock:
+            if len(self.buffer) == 0:
+                return None
+            records, self.buffer = self.buffer, []
+            with open(self.filename, 'a') as f:
+                f.write('\n'.join([record[4] for record in records]) + '\n')
+            if self.json_filename is not None:
+                with open(self.json_filename, 'a') as f:
+                    for tic, level, stage, pid, text, counters in records:
+                        f.write(json.dumps({'time': round(tic, 3), 'elapsed': round(tic - self.start, 3), 'level': level, 'stage': stage,
+                                            'pid': pid, 'text': text, 'counters': counters}) + '\n')
+        return None
+
+    def worker_logger(self):
+        """gets a logger that can be passed to worker processes (for example through the args of
+        parallel.starmap_parallel). Its messages are sent through a queue and written by this instance
+        returns : instance of QueueLogger class"""
+        with self.lock:
+            if self.queue is None:
+                from multiprocessing import Manager
+                self.manager = Manager()
+                self.queue = self.manager.Queue()
+                self.listener = threading.Thread(target=self._listen, daemon=True)
+                self.listener.start()
+                # the manager is shut down at exit by multiprocessing, so close must be registered after it to run first
+                atexit.unregister(self.close)
+                atexit.register(self.close)
+        return QueueLogger(self.queue, self.vl)
+
+    def _listen(self):
+        while True:
+            message = self.queue.get()
+            if message is None:
+                break
+            self.update(**message)
+
+    def close(self):
+        """stops the worker queue and the timer and writes the buffered messages. It is called at exit
+        returns : None"""
+        if self.queue is not None:
+            self.queue.put(None)
+            self.listener.join()
+            self.manager.shutdown()
+            self.queue = None
+        self.stop.set()
+        self.flush()
         return None
 
     def insert_file_in_log(self, filename, caption):
@@ -55,5 +162,26 @@ class Logger:
         self.update('', to_screen=False)
 
 
+class QueueLogger:
+    """logger used in worker processes. It has the update method of the Logger class and sends the messages to the
+    Logger that created it (see Logger.worker_logger)"""
+
+    def __init__(self, queue, vl=0):
+        """Initiallizes the instance
+        queue : queue (Manager queue of the parent Logger)
+        vl: int: verbosity level
+        returns : None"""
+        self.queue = queue
+        self.vl = vl
+
+    def update(self, text, to_file=True, to_screen=True, v=4, stage=None, counters=None):
+        """sends a message to the parent Logger (see Logger.update)
+        returns : None"""
+        if v > self.vl:
+            self.queue.put({'text': text, 'to_file': to_file, 'to_screen': to_screen, 'v': v, 'stage': stage,
+                            'counters': counters, 'pid': os.getpid()})
+        return None
+
+
 if __name__ == '__main__':
     print(version)
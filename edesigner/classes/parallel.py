@@ -7,7 +7,8 @@ from multiprocessing import Pool
 from multiprocessing import cpu_count
 # External modules
 import numpy as np
-import pandas as pd
+# pandas is imported by the functions that concatenate dataframes so the processes that only split lists (expander)
+# do not pay its import time
 
 version = 'parallel.v.9.0.0'
 
@@ -34,6 +35,7 @@ def map_parallel(data, func, cores=-1, partitions=-1, n_threshold=1000, is_list=
         if is_list:
             out_data = list(np.concatenate(pool.map(func, data_split)))
         else:
+            import pandas as pd
             out_data = pd.concat(pool.map(func, data_split), sort=True)
         pool.close()
         pool.join()
@@ -63,6 +65,7 @@ def starmap_parallel(data, func, cores=-1, partitions=-1, is_list=False, args=No
     if is_list:
         out_data = list(np.concatenate(pool.starmap(func, data_split)))
     else:
+        import pandas as pd
         out_data = pd.concat(pool.starmap(func, data_split), sort=True)
     pool.close()
     pool.join()
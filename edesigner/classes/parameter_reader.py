@@ -5,7 +5,12 @@
 version = 'parameter_reader.v.9.0.0'
 
 #Python modules
+import os
 import copy
+import hashlib
+import _pickle as pic
+
+CACHE_VERSION = 1  # increase when the parser changes so existing caches are discarded
 
 ############ PARAMETERS CLASS #############
 
@@ -31,6 +36,8 @@ class Parameters:
             fourth column/row contains the list separator mark for lists for fsource dict/list
             fifth column/row contains an explanation of the data for fsource dict/list
             following columns/rows contain data (if empty should contain None or Null, cannot be blank) fsource dict/list
+        The parsed parameters are cached in a binary sidecar next to the file (see cache_file) and loaded from it while
+        the path, size and modification time (or content hash) of the file match the ones of the sidecar
         returns : None"""
         self.path = path
         self.errors = []
@@ -39,6 +46,10 @@ class Parameters:
         self.type = {}
         self.separator = {}
         self.description = {}
+        file_key = self.cache_key(fsource, how, multiple, content_hash=False)
+        if file_key is not None and self.load_cache(file_key, fsource, how, multiple):
+            return
+        file_key = self.cache_key(fsource, how, multiple)  # taken before parsing so a file changed meanwhile is not cached as fresh
         try:
             f = open(path, 'r')
         except:
@@ -147,6 +158,81 @@ class Parameters:
                     if not multiple: # if multiple is false we keep just one dict
                         for key in list(self.par.keys()):
                             self.par[key] = copy.deepcopy(self.par[key][0])
+        if self.success and file_key is not None:
+            self.save_cache(file_key, fsource, how, multiple)
+
+    def cache_file(self, fsource, how, multiple):
+        """gets the path of the sidecar caching the parameters read with a set of options
+        fsource : str
+        how : str
+        multiple : bool
+        returns : str"""
+        folder, name = os.path.split(self.path)
+        return os.path.join(folder, f'.{name}.{fsource}.{how}.{int(multiple)}.parcache')
+
+    def cache_key(self, fsource, how, multiple, content_hash=True):
+        """gets the key identifying the current content of the parameters file
+        fsource : str
+        how : str
+        multiple : bool
+        content_hash : bool (if False the hash of the content is not computed and set to None)
+        returns : dict or None if the file cannot be read"""
+        try:
+            stat = os.stat(self.path)
+            if content_hash:
+                with open(self.path, 'rb') as f:
+                    content_hash = hashlib.sha1(f.read()).hexdigest()
+            else:
+                content_hash = None
+        except OSError:
+            return None
+        return {'version': CACHE_VERSION, 'path': os.path.abspath(self.path), 'size': stat.st_size,
+                'mtime': stat.st_mtime_ns, 'hash': content_hash, 'options': (fsource, how, multiple)}
+
+    def load_cache(self, key, fsource, how, multiple):
+        """loads the parameters from the sidecar if it is fresh. The content hash is only computed when the
+        modification time changed, so a touched or copied back file does not invalidate the sidecar
+        key : dict (see cache_key, without content hash)
+        fsource : str
+        how : str
+        multiple : bool
+        returns : bool (True if the parameters were loaded)"""
+        try:
+            with open(self.cache_file(fsource, how, multiple), 'rb') as f:
+                cache = pic.load(f)
+        except Exception:
+            return False
+        cached_key = cache.get('key', {})
+        if any([cached_key.get(item) != key[item] for item in ['version', 'path', 'size', 'options']]):
+            return False
+        if cached_key['mtime'] != key['mtime']:
+            key = self.cache_key(fsource, how, multiple)
+            if key is None or cached_key['hash'] != key['hash']:
+                return False
+        self.par = cache['par']
+        self.type = cache['type']
+        self.separator = cache['separator']
+        self.description = cache['description']
+        return True
+
+    def save_cache(self, key, fsource, how, multiple):
+        """writes the sidecar. Failures (e.g. read only folders) are ignored since the cache is optional. The sidecar
+        is written in a temporary file and moved so concurrent processes never read a partial sidecar
+        key : dict (see cache_key)
+        fsource : str
+        how : str
+        multiple : bool
+        returns : None"""
+        cache_file = self.cache_file(fsource, how, multiple)
+        tmp_file = f'{cache_file}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_file, 'wb') as f:
+                pic.dump({'key': key, 'par': self.par, 'type': self.type, 'separator': self.separator,
+                          'description': self.description}, f)
+            os.replace(tmp_file, cache_file)
+        except Exception:
+            if os.path.isfile(tmp_file):
+                os.remove(tmp_file)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+# pipeline
+# Jose Alfredo Martin
+
+__version__ = 'pipeline.v.12.0.0'
+__author__ = 'Alfredo Martin 2023'
+
+# Python modules
+import subprocess
+import sys
+import threading
+
+
+def check_returncode(returncode, command):
+    """exits the program if a command did not finish properly
+    returncode: int: exit status of the command
+    command: list of str: command that was run
+    returns: None"""
+    if returncode != 0:
+        print(f'ERROR::: command exited with status {returncode}')
+        print('command:', ' '.join(command))
+        sys.exit(1)
+
+
+def run_command(command, stdout=None):
+    """runs a command, waits for it and checks its return code
+    command: list of str: command and arguments
+    stdout: file object or None: where the standard output of the command is sent
+    returns: None"""
+    proc = subprocess.run(command, stdout=stdout)
+    check_returncode(proc.returncode, command)
+
+
+class StreamedCommand:
+    """context manager that runs a command and exposes its standard output as a text stream that can be parsed
+    incrementally, so the output of LillyMol executables does not need to be written to disk. The standard input
+    of the command can be fed either from an iterable of lines (written from a separate thread to avoid dead locks)
+    or from the standard output of another StreamedCommand. The return code is checked on exit."""
+
+    def __init__(self, command, lines=None, stdin=None):
+        """
+        Initiallizes the instance
+        :param command: list of str: command and arguments
+        :param lines: iterable of str or None: lines (including end of line) to be written to the command stdin
+        :param stdin: file object or None: stream connected to the command stdin (ignored if lines is passed)
+        """
+        self.command = command
+        self.lines = lines
+        self.stdin = stdin
+        self.proc = None
+        self.feeder = None
+        self.feeder_error = None
+
+    def _feed(self):
+        """writes self.lines into the stdin of the command
+        returns: None"""
+        try:
+            for line in self.lines:
+                self.proc.stdin.write(line)
+        except BrokenPipeError:
+            pass  # the command finished early, its return code will tell what happened
+        except BaseException as e:
+            self.feeder_error = e
+        finally:
+            try:
+                self.proc.stdin.close()
+            except BrokenPipeError:
+                pass
+
+    def __enter__(self):
+        if self.lines is not None:
+            stdin = subprocess.PIPE
+        else:
+            stdin = self.stdin
+        self.proc = subprocess.Popen(self.command, stdin=stdin, stdout=subprocess.PIPE, text=True)
+        if self.lines is not None:
+            self.feeder = threading.Thread(target=self._feed, daemon=True)
+            self.feeder.start()
+        return self.proc.stdout
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.proc.kill()
+        self.proc.stdout.close()
+        returncode = self.proc.wait()
+        if self.feeder is not None:
+            self.feeder.join()
+        if exc_type is not None:
+            return False
+        if self.feeder_error is not None:
+            raise self.feeder_error
+        check_returncode(returncode, self.command)
+        return False
+
+
+if __name__ == '__main__':
+    print(__version__)
+    print(__author__)
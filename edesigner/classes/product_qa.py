@@ -0,0 +1,347 @@
+# -*- coding: utf-8 -*-
+# product_qa
+# Jose Alfredo Martin
+
+__version__ = 'product_qa.v.12.0.0'
+__author__ = 'Alfredo Martin 2023'
+
+# Python modules
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+import time
+from multiprocessing import Pool
+from multiprocessing import cpu_count
+# External modules
+import numpy as np
+# Local modules
+from classes.smi_io import find_smi, open_smi
+
+# tokens of a smiles string: bracket atoms, organic subset atoms, wildcard, bonds, branches and ring closures
+TOKEN = re.compile(rb'(\[[^\[\]]+\])|(Br|Cl|[BCNOPSFI]|[bcnops])|(\*)|([-=#$:/\\.])|([()])|(%\d\d|\d)')
+BRACKET_ELEMENT = re.compile(rb'\[\d*([A-Z][a-z]?|[a-z][a-z]?|\*)')
+
+
+def count_heavy_atoms(smiles):
+    """counts the heavy atoms of a smiles string without building the molecule. The smiles is only checked
+    syntactically (valid tokens, balanced branches and closed rings), so chemically wrong smiles are not detected
+    smiles: bytes: smiles string
+    returns: int: number of heavy atoms or -1 if the smiles cannot be parsed"""
+    nha = 0
+    depth = 0
+    position = 0
+    rings = set()
+    for match in TOKEN.finditer(smiles):
+        if match.start() != position:
+            return -1
+        position = match.end()
+        if match.lastindex == 1:
+            element = BRACKET_ELEMENT.match(match.group(1))
+            if element is None:
+                return -1
+            if element.group(1) not in (b'H', b'*'):
+                nha += 1
+        elif match.lastindex == 2:
+            nha += 1
+        elif match.lastindex == 5:
+            depth += 1 if match.group(5) == b'(' else -1
+            if depth < 0:
+                return -1
+        elif match.lastindex == 6:
+            rings ^= {match.group(6)}
+    if position != len(smiles) or depth != 0 or len(rings) > 0 or nha == 0:
+        return -1
+    return nha
+
+
+def qa_lines(lines, n_partitions):
+    """computes the heavy atom histogram, the parse failures and the hashes of the smiles of a batch of lines of a
+    smiles file
+    lines: list of bytes: lines of the file (smiles followed by the name)
+    n_partitions: int: number of partitions of the hashes
+    returns: tuple: heavy atom histogram (numpy array), number of parse failures and list of bytes with the 64 bit
+        hashes of the smiles of each partition. The smiles strings are hashed as written, so only textual duplicates
+        are found (the same molecule written with different smiles is not a duplicate)"""
+    smiles = [line.split(maxsplit=1)[0] for line in lines if line.strip() != b'']
+    nha = np.array([count_heavy_atoms(item) for item in smiles], dtype='int32')
+    failures = int((nha < 0).sum())
+    histogram = np.bincount(nha[nha >= 0])
+    digests = b''.join(hashlib.blake2b(item, digest_size=8).digest() for item in smiles)
+    hashes = np.frombuffer(digests, dtype='<u8')
+    partitions = (hashes % np.uint64(n_partitions)).astype('int64')
+    order = np.argsort(partitions, kind='stable')
+    bounds = np.searchsorted(partitions[order], np.arange(n_partitions + 1))
+    hashes = hashes[order]
+    return histogram, failures, [hashes[bounds[p]:bounds[p + 1]].tobytes() for p in range(n_partitions)]
+
+
+def qa_range(path, start, stop, n_partitions):
+    """runs qa_lines on a range of bytes of an uncompressed smiles file (the range must start and end at line
+    boundaries)
+    path: str: path to the smiles file
+    start: int: first byte of the range
+    stop: int: byte after the end of the range
+    n_partitions: int: number of partitions of the hashes
+    returns: tuple: see qa_lines"""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        lines = f.read(stop - start).splitlines()
+    return qa_lines(lines, n_partitions)
+
+
+def _starred_qa_lines(job):
+    return qa_lines(*job)
+
+
+def _starred_qa_range(job):
+    return qa_range(*job)
+
+
+def count_duplicates(partition_file):
+    """counts the duplicated hashes of a partition. Only this partition is held in memory
+    partition_file: str: path to the binary file containing the 64 bit hashes of the partition
+    returns: tuple of int: number of unique smiles strings, number of smiles strings found more than once and number
+        of products whose smiles string repeats the one of a previous product"""
+    hashes = np.fromfile(partition_file, dtype='<u8')
+    if hashes.shape[0] == 0:
+        return 0, 0, 0
+    _, counts = np.unique(hashes, return_counts=True)
+    return int(counts.shape[0]), int((counts > 1).sum()), int((counts - 1).sum())
+
+
+def line_ranges(path, chunk_bytes):
+    """splits an uncompressed file in ranges of bytes that start and end at line boundaries
+    path: str: path to the file
+    chunk_bytes: int: approximate size of each range
+    returns: list of tuples of int: start and stop of each range"""
+    size = os.path.getsize(path)
+    ranges = []
+    start = 0
+    with open(path, 'rb') as f:
+        while start < size:
+            f.seek(min(start + chunk_bytes, size))
+            f.readline()
+            stop = min(f.tell(), size)
+            ranges.append((start, stop))
+            start = stop
+    return ranges
+
+
+def predicted_nha_distribution(bbs_files, base_na):
+    """computes the predicted distribution of heavy atoms of a library from the building block files of each cycle.
+    The ids of the building blocks written by BBReader start by the effective number of atoms (nha:name), so the
+    prediction is the convolution of the distributions of each cycle shifted by the atoms that do not come from the
+    building blocks
+    bbs_files: list of str: paths to the building block files of each cycle
+    base_na: int: atoms of the products not coming from building blocks (headpiece and scaffolds)
+    returns: numpy array or None: number of products per number of heavy atoms (None if the ids do not contain the
+        number of atoms)"""
+    distribution = np.zeros(base_na + 1, dtype='float64')
+    distribution[base_na] = 1.0
+    for bbs_file in bbs_files:
+        nha = []
+        with open_smi(bbs_file, 'rt') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 2:
+                    continue
+                prefix = fields[1].split(':', 1)[0]
+                if not prefix.isdigit():
+                    return None
+                nha.append(int(prefix))
+        if len(nha) == 0:
+            return None
+        distribution = np.convolve(distribution, np.bincount(nha))
+    return distribution
+
+
+def histogram_stats(histogram, threshold):
+    """summarizes a histogram of heavy atoms
+    histogram: numpy array: counts per number of heavy atoms
+    threshold: int or None: number of atoms used to compute the fraction of products above it
+    returns: dict"""
+    total = histogram.sum()
+    if total == 0:
+        return {'n': 0}
+    present = np.nonzero(histogram)[0]
+    stats = {'n': int(round(total)),
+             'mean': round(float((np.arange(histogram.shape[0]) * histogram).sum() / total), 3),
+             'min': int(present[0]),
+             'max': int(present[-1]),
+             'histogram': {int(i): int(round(histogram[i])) for i in present}}
+    if threshold is not None:
+        stats['fraction_above_max_na_percentile'] = round(float(histogram[threshold + 1:].sum() / total), 4)
+    return stats
+
+
+class ProductQA:
+    """ProductQA instances check the products of an enumeration in a streaming fashion: the enumeration file is
+    processed in chunks by a pool of workers that count heavy atoms and parse failures and hash the smiles. Hashes are
+    partitioned to disk so duplicates are found one partition at a time with bounded memory. Duplicates are textual:
+    trxn writes the products with -o smi (not unique smiles), so the same molecule written with two different smiles
+    strings is not counted as a duplicate. The heavy atom
+    distribution is compared against the prediction of the libDESIGN and a json report is written in the enumeration
+    folder"""
+
+    def __init__(self, wfolder, lib=None, par=None, deprotection=None, cores=-1, n_partitions=64,
+                 chunk_bytes=1 << 26, nha_offset=None, verbose=False):
+        """Initiallizes the instance
+        wfolder: str: enumeration folder (containing enumeration.smi, C0.smi and C{cycle}.smi)
+        lib: instance of LibDesign class or None: libDESIGN of the enumeration (scaffold atoms are taken from it)
+        par: instance of Parameters class (par) or None: if None the prediction is not computed
+        deprotection: instance of Parameters class (deprotection) or None: required if lib is passed
+        cores: int: number of workers (-1 for all cores)
+        n_partitions: int: number of partitions used to find duplicates (each partition is loaded in memory)
+        chunk_bytes: int: approximate size of the chunks processed by each worker
+        nha_offset: int or None: heavy atoms of the headpiece in the products that are not accounted by headpiece_na.
+            If None it is computed from the headpiece smiles in C0.smi
+        verbose: bool: prints additional information
+        returns: None"""
+        self.wfolder = wfolder
+        self.lib = lib
+        self.par = par
+        self.deprotection = deprotection
+        self.cores = cpu_count() if cores == -1 else cores
+        self.n_partitions = n_partitions
+        self.chunk_bytes = chunk_bytes
+        self.nha_offset = nha_offset
+        self.verbose = verbose
+        self.enumeration_file = find_smi(os.path.join(wfolder, 'enumeration.smi'))
+        if self.enumeration_file is None:
+            print(f'ERROR::: enumeration file not found in {wfolder}')
+            sys.exit(1)
+        self.scratch = os.path.join(wfolder, 'qa_hashes')
+
+    def batches(self, f, batch_lines=100000):
+        """reads a file in batches of lines
+        f: file object opened in binary mode
+        batch_lines: int: number of lines per batch
+        returns: generator of tuples (batch of lines, number of partitions)"""
+        batch = []
+        for line in f:
+            batch.append(line)
+            if len(batch) == batch_lines:
+                yield batch, self.n_partitions
+                batch = []
+        if len(batch) > 0:
+            yield batch, self.n_partitions
+
+    def scan(self, pool):
+        """scans the enumeration file in parallel and writes the hashes of the smiles into the partition files
+        pool: instance of Pool class
+        returns: tuple: heavy atom histogram (numpy array), number of products and number of parse failures"""
+        histogram = np.zeros(0, dtype='int64')
+        failures = 0
+        partition_files = [open(os.path.join(self.scratch, f'{p}.bin'), 'wb') for p in range(self.n_partitions)]
+        try:
+            if self.enumeration_file.endswith('.smi'):
+                jobs = [(self.enumeration_file, start, stop, self.n_partitions)
+                        for start, stop in line_ranges(self.enumeration_file, self.chunk_bytes)]
+                results = pool.imap(_starred_qa_range, jobs)
+                f = None
+            else:  # compressed files cannot be seeked, so the lines are streamed to the workers
+                f = open_smi(self.enumeration_file, 'rb')
+                results = pool.imap(_starred_qa_lines, self.batches(f))
+            for chunk_histogram, chunk_failures, hashes in results:
+                if chunk_histogram.shape[0] > histogram.shape[0]:
+                    histogram = np.pad(histogram, (0, chunk_histogram.shape[0] - histogram.shape[0]))
+                histogram[:chunk_histogram.shape[0]] += chunk_histogram
+                failures += chunk_failures
+                for p in range(self.n_partitions):
+                    partition_files[p].write(hashes[p])
+            if f is not None:
+                f.close()
+        finally:
+            for partition_file in partition_files:
+                partition_file.close()
+        n_products = int(histogram.sum()) + failures
+        return histogram, n_products, failures
+
+    def find_duplicates(self, pool):
+        """counts textually duplicated smiles partition by partition
+        pool: instance of Pool class
+        returns: dict"""
+        partition_files = [os.path.join(self.scratch, f'{p}.bin') for p in range(self.n_partitions)]
+        results = pool.map(count_duplicates, partition_files)
+        return {'n_textually_unique_smiles': sum(item[0] for item in results),
+                'n_textually_duplicated_smiles': sum(item[1] for item in results),
+                'n_textual_duplicate_products': sum(item[2] for item in results)}
+
+    def get_offset(self):
+        """gets the heavy atoms of the headpiece present in the products but not accounted by headpiece_na
+        returns: int"""
+        if self.nha_offset is not None:
+            return self.nha_offset
+        with open(os.path.join(self.wfolder, 'C0.smi'), 'rb') as f:
+            hp_nha = count_heavy_atoms(f.readline().split()[0])
+        return max(hp_nha - self.par.par['headpiece_na'], 0)
+
+    def predict(self, histogram):
+        """compares the heavy atom distribution of the products with the one predicted for the library
+        histogram: numpy array: observed heavy atom histogram
+        returns: dict or None"""
+        if self.par is None or not os.path.isfile(os.path.join(self.wfolder, 'C0.smi')):
+            return None
+        bbs_files = []
+        cycle = 1
+        while os.path.isfile(os.path.join(self.wfolder, f'C{cycle}.smi')):
+            bbs_files.append(os.path.join(self.wfolder, f'C{cycle}.smi'))
+            cycle += 1
+        scaffolds_natoms = 0
+        if self.lib is not None and len(self.lib.scaffold_reactions) > 0:
+            scaffolds_natoms = sum([self.deprotection.par[item]['atom_dif'] for item in self.lib.scaffold_reactions])
+        predicted = predicted_nha_distribution(bbs_files, self.par.par['headpiece_na'] + scaffolds_natoms)
+        if predicted is None:
+            return None
+        offset = self.get_offset()
+        observed = histogram[offset:].astype('float64')  # observed products in the atom count used by eDESIGNER
+        length = max(observed.shape[0], predicted.shape[0])
+        observed = np.pad(observed, (0, length - observed.shape[0]))
+        predicted = np.pad(predicted, (0, length - predicted.shape[0]))
+        threshold = self.par.par['max_na_percentile']
+        tvd = None
+        if observed.sum() > 0:
+            tvd = round(float(np.abs(observed / observed.sum() - predicted / predicted.sum()).sum() / 2), 4)
+        return {'max_na_percentile': threshold,
+                'percentile': self.par.par['percentile'],
+                'scaffolds_natoms': scaffolds_natoms,
+                'headpiece_offset': offset,
+                'observed': histogram_stats(observed, threshold),
+                'predicted': histogram_stats(predicted, threshold),
+                'total_variation_distance': tvd}
+
+    def run(self):
+        """runs the quality check and writes enumeration_qa.json in the enumeration folder
+        returns: dict: report"""
+        tic = time.time()
+        if os.path.isdir(self.scratch):
+            shutil.rmtree(self.scratch)
+        os.mkdir(self.scratch)
+        with Pool(self.cores) as pool:
+            histogram, n_products, failures = self.scan(pool)
+            tac = time.time()
+            duplicates = self.find_duplicates(pool)
+        toc = time.time()
+        shutil.rmtree(self.scratch)
+        report = {'enumeration_file': self.enumeration_file,
+                  'n_products': n_products,
+                  'n_parse_failures': failures}
+        report.update(duplicates)
+        report['nha'] = histogram_stats(histogram, None)
+        report['prediction'] = self.predict(histogram)
+        report['timings'] = {'scan': round(tac - tic, 2),
+                             'duplicates': round(toc - tac, 2)}
+        with open(os.path.join(self.wfolder, 'enumeration_qa.json'), 'w') as f:
+            json.dump(report, f, indent=2)
+        if self.verbose:
+            print(f'INFO::: {n_products} products, {failures} parse failures, '
+                  f'{duplicates["n_textual_duplicate_products"]} textual duplicates')
+        return report
+
+
+if __name__ == '__main__':
+    print(__version__)
+    print(__author__)
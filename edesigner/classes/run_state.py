@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+# run_state
+# Jose Alfredo Martin
+
+__version__ = 'run_state.v.12.0.0'
+__author__ = 'Alfredo Martin 2023'
+
+# Python modules
+import os
+import io
+import sys
+import time
+import threading
+import subprocess
+from contextlib import redirect_stdout
+# Local modules
+from classes.parameter_reader import Parameters
+from classes.bbt_store import load_bbts
+from classes.libdesign_store import load_libdesigns
+from classes.lib_index import load_lib_index
+from classes.usage_stats import usage_stats
+
+_print_lock = threading.Lock()
+# files a run is loaded from (parameters, BBTs, libDESIGNs and library index). Other files, such as the sidecars of the
+# parameters (.parcache), temporary files (.tmp) or reports, do not make a run stale
+WATCHED_EXTENSIONS = ('.par', '.sqlite', '.pic', '.npz')
+
+
+def folder_signature(folders):
+    """gets the modification times of the files a run is loaded from (WATCHED_EXTENSIONS) in a set of folders (not
+    recursive). Any of these files written, replaced or deleted in the folders changes the signature
+    folders: list of str
+    returns: tuple"""
+    signature = []
+    for folder in folders:
+        if not os.path.isdir(folder):
+            signature.append((folder, None))
+            continue
+        with os.scandir(folder) as entries:
+            signature += sorted([(entry.path, entry.stat().st_mtime_ns) for entry in entries
+                                 if entry.is_file() and entry.name.endswith(WATCHED_EXTENSIONS)])
+    return tuple(signature)
+
+
+class RunState:
+    """RunState instances keep in memory the parameters, BBTs, libDESIGNs and library index of an eDESIGNER run so
+    find, describe and stats requests are answered without reloading them. The state is stale (and must be reloaded)
+    when any file of the resources folder, the results folder of the BBT creator run or the results folder of the
+    eDESIGNER run changes"""
+
+    def __init__(self, wfolder, run_id, ed_run_id):
+        """Loads the run
+        wfolder: str: working folder
+        run_id: str: BBT creator run id
+        ed_run_id: str: eDESIGNER run id
+        returns: None"""
+        self.wfolder = os.path.abspath(wfolder)
+        self.run_id = run_id
+        self.ed_run_id = ed_run_id
+        self.parfolder = os.path.join(self.wfolder, run_id, 'resources')
+        self.results_folder = os.path.join(self.wfolder, run_id, ed_run_id, 'results')
+        self.folders = [self.parfolder, os.path.join(self.wfolder, run_id, 'results'), self.results_folder]
+        self.par = Parameters(os.path.join(self.parfolder, 'par.par'), fsource='dict', how='to_dict', multiple=False)
+        self.enum_reaction = Parameters(os.path.join(self.parfolder, 'enum_reaction.par'),
+                                        fsource='list', how='to_list', multiple=True)
+        self.enum_deprotection = Parameters(os.path.join(self.parfolder, 'enum_deprotection.par'),
+                                            fsource='list', how='to_list', multiple=True)
+        self.BBTs = load_bbts(os.path.join(self.wfolder, run_id, 'results'))
+        self.designs = load_libdesigns(self.results_folder)
+        self.index = load_lib_index(self.results_folder, self.designs)
+        self.signature = folder_signature(self.folders)  # after the index is saved in the results folder
+        self.loaded = time.time()
+        self.usage = {}
+        self.lock = threading.Lock()
+        self.usage_lock = threading.Lock()
+
+    def is_stale(self):
+        """checks whether the files of the run changed since it was loaded
+        returns: bool"""
+        return folder_signature(self.folders) != self.signature
+
+    def get_design(self, lib_idx=None, lib_id=None):
+        """gets a libDESIGN by its id or lib_id. The lookups are serialized because the sqlite connection of the run is
+        shared by the threads of the server
+        lib_idx: int or None
+        lib_id: tuple of int or None
+        returns: instance of LibDesign class or None"""
+        with self.lock:
+            if lib_idx is not None:
+                return self.designs.get(lib_idx)
+            return self.designs.get_by_lib_id(lib_id)
+
+    def design_summary(self, design):
+        """gets a json serializable summary of a libDESIGN
+        design: instance of LibDesign class
+        returns: dict"""
+        return {'id': design.id,
+                'lib_id': '_'.join([str(item) for item in design.lib_id]),
+                'n_cycles': design.n_cycles,
+                'headpiece': int(design.headpiece),
+                'n_all': None if design.n_all is None else int(design.n_all),
+                'reactions': [self.enum_reaction.par[idx]['enum_name'] for idx in design.reactions],
+                'deprotections': [self.enum_deprotection.par[idx]['enum_name'] for idx in design.deprotections
+                                  if idx != 0],
+                'bbts': [[int(bbt) for bbt in item] for item in design.bbts]}
+
+    def find(self, n_libraries=0, **query):
+        """finds the libraries meeting a query (see LibIndex.query) ranked by decreasing number of compounds
+        n_libraries: int: maximum number of libraries reported (0 means all)
+        query: keyword arguments of LibIndex.query
+        returns: dict: number of libraries found and summaries of the reported libraries"""
+        lib_idxs = self.index.query(**query)
+        n_found = len(lib_idxs)
+        if n_libraries > 0:
+            lib_idxs = lib_idxs[:n_libraries]
+        return {'n_found': n_found,
+                'libraries': [self.design_summary(self.get_design(lib_idx=int(lib_idx))) for lib_idx in lib_idxs]}
+
+    def describe(self, lib_idx=None, lib_id=None):
+        """describes a library as print_summary_file does
+        lib_idx: int or None
+        lib_id: tuple of int or None
+        returns: dict or None if the library is not found: summary of the library and text of print_summary_file"""
+        design = self.get_design(lib_idx=lib_idx, lib_id=lib_id)
+        if design is None:
+            return None
+        text = io.StringIO()
+        with _print_lock, redirect_stdout(text):
+            design.print_summary_file(self.enum_reaction, self.enum_deprotection)
+        summary = self.design_summary(design)
+        summary['summary'] = text.getvalue()
+        return summary
+
+    def stats(self, weighted=False, cooccurrence=False, cores=-1):
+        """gets the usage statistics of the run (see usage_stats). They are computed once per set of options. The
+        computation has its own lock and its own connection to the libDESIGNs, so find and describe requests on the
+        run are not blocked meanwhile
+        weighted: bool
+        cooccurrence: bool
+        cores: int: number of workers used the first time
+        returns: dict: names and usage of reactions, deprotections and BBTs (plus co-occurrence matrices)"""
+        key = (weighted, cooccurrence)
+        with self.usage_lock:
+            if key not in self.usage:
+                self.usage[key] = self._compute_stats(weighted, cooccurrence, cores)
+        return self.usage[key]
+
+    def _compute_stats(self, weighted, cooccurrence, cores):
+        sizes = {'n_reactions': len(self.enum_reaction.par), 'n_deprotections': len(self.enum_deprotection.par),
+                 'n_bbts': len(self.BBTs), 'n_cycles': len(self.par.par['max_cycle_na'])}
+        usage = usage_stats(load_libdesigns(self.results_folder), sizes, weighted=weighted, cooccurrence=cooccurrence,
+                            cores=cores)
+        usage = {name: value.tolist() if weighted else value.astype('int64').tolist() for name, value in usage.items()}
+        usage['reaction_names'] = [rxn['enum_name'] for rxn in self.enum_reaction.par]
+        usage['deprotection_names'] = [depr['enum_name'] for depr in self.enum_deprotection.par]
+        usage['bbt_names'] = [':'.join(bbt.BBT_name) for bbt in self.BBTs]
+        return usage
+
+
+class RunCache:
+    """RunCache instances keep the RunState of the eDESIGNER runs requested to the server, reloading a run when its
+    files change"""
+
+    def __init__(self, verbose=False):
+        """Initiallizes the instance
+        verbose: bool
+        returns: None"""
+        self.runs = {}
+        self.lock = threading.Lock()
+        self.verbose = verbose
+
+    def get(self, wfolder, run_id, ed_run_id):
+        """gets the state of a run, loading it if it is not in memory or if it is stale
+        wfolder: str: working folder
+        run_id: str: BBT creator run id
+        ed_run_id: str: eDESIGNER run id
+        returns: instance of RunState class"""
+        key = (os.path.abspath(wfolder), run_id, ed_run_id)
+        with self.lock:
+            state = self.runs.get(key)
+            if state is None or state.is_stale():
+                if self.verbose:
+                    print(f'INFO::: {"loading" if state is None else "reloading"} {os.path.join(*key)}')
+                if not os.path.isdir(os.path.join(*key)):
+                    raise FileNotFoundError(f'{os.path.join(*key)} does not exist')
+                state = RunState(*key)
+                self.runs[key] = state
+            return state
+
+    def loaded(self):
+        """lists the runs in memory
+        returns: list of dict"""
+        return [{'wfolder': key[0], 'run_id': key[1], 'ed_run_id': key[2], 'loaded': state.loaded}
+                for key, state in self.runs.items()]
+
+
+class JobQueue:
+    """JobQueue instances run enumerate_library jobs in background processes and keep their status"""
+
+    def __init__(self, log_folder):
+        """Initiallizes the instance
+        log_folder: str: folder where the output of each job is written (job_{id}.log)
+        returns: None"""
+        self.log_folder = log_folder
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def submit(self, args):
+        """submits an enumeration
+        args: list of str: arguments of enumerate_library.py
+        returns: int: job id"""
+        script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'enumerate_library.py')
+        with self.lock:
+            job_id = len(self.jobs) + 1
+            log_file = os.path.join(self.log_folder, f'job_{job_id}.log')
+            with open(log_file, 'w') as f:
+                process = subprocess.Popen([sys.executable, script] + [str(arg) for arg in args],
+                                           stdout=f, stderr=subprocess.STDOUT, start_new_session=True)
+            self.jobs[job_id] = {'process': process, 'args': args, 'log': log_file, 'submitted': time.time()}
+        return job_id
+
+    def status(self, job_id):
+        """gets the status of a job
+        job_id: int
+        returns: dict or None if the job does not exist"""
+        job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        returncode = job['process'].poll()
+        if returncode is None:
+            status = 'running'
+        else:
+            status = 'done' if returncode == 0 else 'failed'
+        return {'job': job_id, 'status': status, 'returncode': returncode, 'args': [str(arg) for arg in job['args']],
+                'log': job['log'], 'submitted': job['submitted']}
+
+    def all(self):
+        """gets the status of all the jobs
+        returns: list of dict"""
+        return [self.status(job_id) for job_id in sorted(self.jobs.keys())]
+
+
+if __name__ == '__main__':
+    print(__version__)
+    print(__author__)
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+# smi_io
+# Jose Alfredo Martin
+
+__version__ = 'smi_io.v.12.0.0'
+__author__ = 'Alfredo Martin 2023'
+
+# Python modules
+import gzip
+import lzma
+import os
+import shutil
+# External modules
+import numpy as np
+
+# extension added to the smiles files for each compression method
+EXTENSIONS = {None: '', 'gzip': '.gz', 'lzma': '.xz'}
+
+
+def open_smi(path, mode='rt'):
+    """opens a smiles file that can be compressed (the compression is taken from the extension of the file: .gz for
+    gzip and .xz for lzma). gzip and lzma files can be appended (concatenated members are read as a single file)
+    path: str: path to the file
+    mode: str: mode as in the open function
+    returns: file object"""
+    if path.endswith('.gz'):
+        return gzip.open(path, mode, compresslevel=1)  # level 1 keeps compression from being the bottleneck
+    if path.endswith('.xz'):
+        return lzma.open(path, mode, preset=1 if 'r' not in mode else None)
+    return open(path, mode)
+
+
+def find_smi(path):
+    """finds a smiles file that can be stored compressed
+    path: str: path to the uncompressed smiles file
+    returns: str or None: path to the existing file (uncompressed first) or None if it does not exist"""
+    for extension in ['', '.gz', '.xz']:
+        if os.path.isfile(path + extension):
+            return path + extension
+    return None
+
+
+def count_lines(path):
+    """counts the number of lines in a smiles file that can be compressed, reading it in binary blocks
+    path: str: path to the file
+    returns: int"""
+    count = 0
+    with open_smi(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            count += block.count(b'\n')
+    return count
+
+
+def copy_smi(source, target, mode='wb'):
+    """copies a smiles file into another one, compressing or decompressing as required by their extensions
+    source: str: path to the source file
+    target: str: path to the target file
+    mode: str: 'wb' to overwrite the target or 'ab' to append to it
+    returns: None"""
+    with open_smi(source, 'rb') as f, open_smi(target, mode) as g:
+        shutil.copyfileobj(f, g, 1 << 20)
+
+
+def nha_index_file(smi_file):
+    """gets the path to the index of byte offsets by number of heavy atoms of a building blocks file
+    smi_file: str: path to the building blocks file (comps/{index}.smi)
+    returns: str: path to the index (comps/{index}.idx.npy)"""
+    return smi_file[:-len('.smi')] + '.idx.npy'
+
+
+def write_nha_index(smi_file, nha, maxna):
+    """writes the index of byte offsets of a building blocks file sorted by number of heavy atoms. Item k of the index
+    is the offset of the first building block with k or more heavy atoms, so the building blocks with up to k heavy
+    atoms are the first index[k + 1] bytes of the file
+    smi_file: str: path to the building blocks file (one line per building block)
+    nha: numpy array: number of heavy atoms of each building block in file order (sorted)
+    maxna: int: maximum number of heavy atoms of a building block
+    returns: None"""
+    with open(smi_file, 'rb') as f:
+        lengths = [len(line) for line in f]
+    offsets = np.concatenate([[0], np.cumsum(lengths, dtype='int64')])
+    index = offsets[np.searchsorted(nha, np.arange(maxna + 2), side='left')]
+    np.save(nha_index_file(smi_file), index.astype('int64'))
+
+
+def copy_range(source, f, stop):
+    """writes the first bytes of a file to an open file. The bytes are copied by the kernel (os.sendfile) when possible,
+    otherwise (for example files opened in append mode) they are copied in blocks
+    source: str: path to the source file
+    f: file object: target file opened in binary mode
+    stop: int: number of bytes to copy
+    returns: None"""
+    f.flush()
+    with open(source, 'rb') as g:
+        offset = 0
+        try:
+            while offset < stop:
+                sent = os.sendfile(f.fileno(), g.fileno(), offset, stop - offset)
+                if sent == 0:
+                    break
+                offset += sent
+        except OSError:
+            g.seek(offset)
+            while offset < stop:
+                block = g.read(min(1 << 20, stop - offset))
+                if block == b'':
+                    break
+                f.write(block)
+                offset += len(block)
+
+
+if __name__ == '__main__':
+    print(__version__)
+    print(__author__)
@@ -7,17 +7,71 @@ __author__ = 'Alfredo Martin 2023'
 
 # Python modules
 import copy
+import fcntl
+import hashlib
 import os
 import sys
 import json
+import random
+import re
 import shutil
+import subprocess
+import time
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+# Local modules
+from classes.smi_io import EXTENSIONS, open_smi, find_smi, count_lines, copy_smi
+
+# approximate number of products enumerated to calibrate the throughput of trxn
+CALIBRATION_PRODUCTS = 20000
+
+
+def decode_ordinal(ordinal, sizes):
+    """decodes an ordinal of the product space as a mixed radix number whose digits are the indexes of the building
+    block of each node (the last node is the least significant digit)
+    ordinal: int: ordinal of the product (0 based)
+    sizes: list of int: number of building blocks of each node
+    returns: tuple of int: index of the building block of each node"""
+    indexes = []
+    for size in reversed(sizes):
+        ordinal, index = divmod(ordinal, size)
+        indexes.append(index)
+    return tuple(reversed(indexes))
+
+
+def read_bb_ids(bbs_file):
+    """reads the ids of the building blocks of a smiles file (second column) in file order
+    bbs_file: str: path to the smiles file
+    returns: list of str"""
+    ids = []
+    with open(bbs_file, 'r') as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) > 1:
+                ids.append(fields[1])
+    return ids
+
+
+def fill_template(template, edges):
+    """fills the placeholders of a preparation reaction: ${EDESIGNER_TEST_FOLDER} is replaced everywhere and
+    $isotope_{j+1} is replaced by the isotope of the edge j (only the first instance in each line)
+    template: str: text of the reaction file
+    edges: list of int: isotopes of the edges of the preparation
+    returns: str"""
+    text = template.replace('${EDESIGNER_TEST_FOLDER}', os.environ['EDESIGNER_TEST_FOLDER'])
+    for j, edge in enumerate(edges):
+        text = ''.join([line.replace(f'$isotope_{j+1}', str(edge), 1) for line in text.splitlines(keepends=True)])
+    return text
+
 
 class SynthNode:
     """class that holds a node in the graph containing a set of builing blocks"""
 
-    def __init__(self, wfolder, node):
+    def __init__(self, wfolder, node, cache=None):
         """Constructor of the instance
         wfolder: str: path to the working folder to store working files
+        cache: str or None: path to a folder where prepared building block files are cached so the same preparations
+            of the same building blocks are run only once (shared by the enumerations of a batch)
         node: dict: contains the following keys:
             node: int: index of the node
             bbs_file: str: path to the bbs file
@@ -35,11 +89,11 @@ class SynthNode:
         self.cycle_bond_orders = [item for item in node['cycle_bond_orders']]
         self.preps = copy.deepcopy(node['preparations'])
         self.wfolder = wfolder
+        self.cache = cache
         filename = os.path.join(self.wfolder, "R" + str(self.node).rjust(2, "0")) + '.smi'
-        command = f'cp {node["bbs_file"]} {filename}'  # makes a copy of the input file to avoid loss by corruption
-        os.system(command)
-        command = f"sed -i '/^$/d' {filename}"
-        os.system(command)
+        # makes a copy of the input file (without empty lines) to avoid loss by corruption
+        with open(node["bbs_file"], 'rb') as f, open(filename, 'wb') as g:
+            g.writelines([line for line in f if line.strip(b'\r\n') != b''])
         self.bbsfile = filename
         if os.path.isdir(os.environ['LILLYMOL_EXECUTABLES']):
             self.trxn = os.path.join(os.environ['LILLYMOL_EXECUTABLES'], 'trxn')
@@ -60,29 +114,65 @@ class SynthNode:
                     count += 1
         return count
 
+    def preparation_key(self):
+        """computes the key of the prepared building blocks of this node in the cache, which is a hash of the
+        building blocks (so it depends on the BBTs and their atom limits) and of the reaction, edge isotopes and
+        keep_unprepared flag of each preparation
+        returns: str"""
+        key = hashlib.sha1()
+        with open(self.bbsfile, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                key.update(block)
+        for prep in self.preps:
+            with open(os.path.expandvars(prep['reaction']), 'rb') as f:
+                key.update(f.read())
+            key.update(json.dumps([prep['edges'], prep['keep_unprepared']]).encode())
+        return key.hexdigest()
+
     def add_preparations(self):
-        """ Adds all the deprotections and preparations for this node
+        """ Adds all the deprotections and preparations for this node, taking the prepared building blocks from the
+        cache if they are there. A lock per key ensures that each preparation is run once even when the enumerations
+        sharing the cache run in parallel
         """
+        if self.cache is None or len(self.preps) == 0:
+            self.run_preparations()
+            return
+        key = self.preparation_key()
+        cached_file = os.path.join(self.cache, key + '.smi')
+        with open(os.path.join(self.cache, key + '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if os.path.isfile(cached_file):
+                print(f'INFO::: using cached preparations for node {self.node} ({key})')
+                shutil.copy(cached_file, self.bbsfile)
+                if self.node == 0:
+                    shutil.copy(self.bbsfile, os.path.join(self.wfolder, "RP00.smi"))
+            else:
+                self.run_preparations()
+                shutil.copy(self.bbsfile, cached_file + '.tmp')
+                os.replace(cached_file + '.tmp', cached_file)
+
+    def run_preparations(self):
+        """ Runs all the deprotections and preparations for this node
+        """
+        # scratch files are named after the node so the preparations of different nodes can run concurrently
+        scratch = 'preparation_' + str(self.node).rjust(2, "0")
         for i, prep in enumerate(self.preps):
             if prep['reaction'].endswith('.rxn'):
-                preparation = os.path.join(self.wfolder, 'preparation.rxn')
+                preparation = os.path.join(self.wfolder, scratch + '.rxn')
                 preptype = '-r'
             elif prep['reaction'].endswith('.prxn'):
-                preparation = os.path.join(self.wfolder, 'preparation.proto')
+                preparation = os.path.join(self.wfolder, scratch + '.proto')
                 preptype = '-P'
             else:
                 preptype = None
                 print(f"ERROR::: {prep['reaction']} is not of a valid type to be used as a preparation")
                 self.success = False
                 sys.exit(1)
-            command = f'cp {prep["reaction"]} {preparation}'
-            os.system(command)
-            command = "sed -i s%'${EDESIGNER_TEST_FOLDER}'%" + os.environ['EDESIGNER_TEST_FOLDER'] + "%g " + preparation
-            os.system(command)
-            for j, edge in enumerate(prep['edges']):
-                command = f"sed -i s/'$isotope_{j+1}'/{edge}/ {preparation}"
-                os.system(command)
-            stem = os.path.join(self.wfolder, "preparation")
+            with open(os.path.expandvars(prep['reaction']), 'r') as f:
+                template = f.read()
+            with open(preparation, 'w') as f:
+                f.write(fill_template(template, prep['edges']))
+            stem = os.path.join(self.wfolder, scratch)
             outfile = stem + '.smi'
             if os.path.isfile(outfile):
                 os.remove(outfile)
@@ -117,8 +207,7 @@ class SynthNode:
                     print(f'WARNING::: There were {ini_lines - end_lines} compounds lost in this reaction')
                     print('command:', command)
                 print("*****")
-            command = f'mv {outfile} {self.bbsfile}'
-            os.system(command)
+            os.replace(outfile, self.bbsfile)
             if self.node == 0:
                 shutil.copy(self.bbsfile, os.path.join(self.wfolder, "RP00.smi"))
 
@@ -126,13 +215,31 @@ class SynthNode:
 class SynthGraph:
     """class that specifies the graph based enumeration"""
 
-    def __init__(self, wfolder, config_file, n=0, chunksize=400000):
+    def __init__(self, wfolder, config_file, n=0, chunksize=400000, local=False, cores=-1, retries=2, sampling=None,
+                 seed=None, cache=None, compression=None, fuse=False, autotune=False, target_seconds=900,
+                 memory_budget=1024):
         """constructor of the instance
         wfolder: str: path to a folder where files are stored
         config_file: str: path to the json config file
         n: int: number of compounds to enumerate from the graph. A negative number or 0 indicates enumerate
             all of them
-        chunksize: int: number of compounds enumerated in each core using hpc"""
+        chunksize: int: number of compounds enumerated in each core using hpc
+        local: bool: whether chunks are run in a local pool of workers instead of being submitted through qsub
+        cores: int: number of workers of the local pool (-1 means all cores)
+        retries: int: number of times a failed chunk is run again in the local pool
+        sampling: str or None: when n > 0 it defines how the n compounds are sampled before enumeration: 'uniform'
+            (uniform over the product space) or 'nha' (stratified by number of heavy atoms of the building blocks of
+            each node). If None the whole library is enumerated and the products are sampled afterwards
+        seed: int or None: seed of the random number generator used for sampling
+        cache: str or None: path to a folder to cache prepared building blocks files
+        compression: str or None: 'gzip' or 'lzma' to store the scaffolds, products and the enumeration compressed
+            (the building block files of the nodes are not compressed since they are read by LillyMol)
+        fuse: bool: whether consecutive joins that do not depend on each other are run in a single trxn call, so the
+            intermediate scaffolds are not written (not used when n > 0)
+        autotune: bool: whether the number of compounds per chunk is computed from a calibration run of each reaction
+            instead of using chunksize
+        target_seconds: int: wall time targeted for each chunk when autotune is True
+        memory_budget: int: maximum size (MB) of the products of each chunk when autotune is True"""
         self.nodes = []  # list of node instances
         self.edges = []  # list of edge dictionaries (edge_id, orig_node, dest_node, orig_isotope, dest_isotope and
         # bond_order are the keys)
@@ -144,6 +251,23 @@ class SynthGraph:
         self.wfolder = wfolder
         self.n = n
         self.chunksize = chunksize
+        self.local = local
+        if cores == -1:
+            cores = cpu_count()
+        self.cores = cores
+        self.retries = retries
+        self.sampling = sampling
+        self.seed = seed
+        self.cache = cache
+        if compression not in EXTENSIONS:
+            print(f'ERROR::: {compression} is not a valid compression method')
+            sys.exit(1)
+        self.compression = compression
+        self.ext = EXTENSIONS[compression]
+        self.fuse = fuse
+        self.autotune = autotune
+        self.target_seconds = target_seconds
+        self.memory_budget = memory_budget
         with open(config_file, 'r') as f:
             self.par = json.load(f)
         self.par_quality_control()
@@ -174,7 +298,7 @@ class SynthGraph:
                 reaction: str: path to the reaction file
 
         """
-        self.nodes.append(SynthNode(self.wfolder, node))
+        self.nodes.append(SynthNode(self.wfolder, node, cache=self.cache))
         if len(self.nodes) == 1:
             self.products = copy.deepcopy(self.nodes[0])
         # update the self.edges object
@@ -237,6 +361,31 @@ class SynthGraph:
             f.write(linea)
         return os.path.join(self.wfolder, reaction_file)
 
+    def create_fused_reaction(self, nodes):
+        """creates a trxn reaction that joins several nodes to the scaffold at once (one sidechain per node)
+        nodes: list of int: node indexes
+        returns: str: path to the reaction file"""
+        name = 'join_by_isotope_' + '_'.join([str(node).rjust(2, "0") for node in nodes])
+        reaction_file = name + '.rxn'
+        with open(os.path.join(self.wfolder, reaction_file), 'w') as f:
+            f.write('(0 Reaction\n')
+            f.write(f'  (A C Comment "{name}")\n')
+            f.write('  (0 Scaffold\n')
+            f.write(f'    (A  C smarts "{"...".join([f"[{node}*]" for node in nodes])}")\n')
+            for i, node in enumerate(nodes):
+                edge = self.edges[node-1]  # node 0 is not the origin or any edges
+                f.write(f'    (A I isotope ({i} {edge["values"]["dest_isotope"]}))\n')
+            f.write('  )\n')
+            for i, node in enumerate(nodes):
+                edge = self.edges[node-1]
+                f.write(f'  ({i + 1} Sidechain\n')
+                f.write(f'    (A C smarts "[{node}*]")\n')
+                f.write(f'    (A I isotope (0 {edge["values"]["orig_isotope"]}))\n')
+                f.write(f'    (A I join ({i} 0 {edge["values"]["bond_order"]}))\n')
+                f.write('  )\n')
+            f.write(')\n')
+        return os.path.join(self.wfolder, reaction_file)
+
     def create_cyclization(self, edge, cycle_bond_order):
         """creates a trxn reaction for cyclization at this speficic edge
         edge: int: edge number
@@ -298,31 +447,156 @@ class SynthGraph:
         return os.path.join(self.wfolder, reaction_file)
 
     def count_compounds(self, file1, file2=None, file3=None):
-        """counts the number of building blocks in one to three.
+        """counts the number of building blocks in one to three files (number of lines, files can be compressed).
         file1: str: path for file 1
         file2: str or None: path for file 2
-        returns: int or tuple of two ints"""
-        wc_file = os.path.join(self.wfolder, 'wc.txt')
-        command = f'wc {file1} '
-        if file2 is not None:
-            command += f'{file2} '
-        if file3 is not None:
-            command += f'{file3} '
-        command += f'> {wc_file}'
-        os.system(command)
-        with open(wc_file, 'r') as f:
-            lineas = f.readlines()
-        os.remove(wc_file)
-        wc1 = str(lineas[0].strip().split(' ')[0])
-        if file3 is not None and file2 is not None:
-            wc2 = str(lineas[1].strip().split(' ')[0])
-            wc3 = str(lineas[2].strip().split(' ')[0])
-            return int(wc1), int(wc2), int(wc3)
-        elif file2 is not None:
-            wc2 = str(lineas[1].strip().split(' ')[0])
-            return int(wc1), int(wc2)
+        file3: str or None: path for file 3
+        returns: int or tuple of two or three ints"""
+        counts = []
+        for file in [file1, file2, file3]:
+            if file is None:
+                continue
+            counts.append(count_lines(file))
+        if len(counts) == 1:
+            return counts[0]
+        return tuple(counts)
+
+    def partition_scaffolds(self, tag, min_tags, scaffolds_file, reactive_file, inert_file):
+        """reads the scaffolds file once and writes at the same time the scaffolds containing the isotope tag at least
+        min_tags times to the reactive file and the scaffolds not containing the tag to the inert file. Scaffolds
+        containing the tag less than min_tags times (but at least once) are discarded.
+        tag: int: isotope of the tag
+        min_tags: int: minimum number of instances of the tag in a reactive scaffold
+        scaffolds_file: str: path to the scaffolds file (can be compressed)
+        reactive_file: str: path to the reactive file (not compressed since it is read by trxn)
+        inert_file: str: path to the inert file (can be compressed)
+        returns: tuple of int: number of inert and reactive scaffolds"""
+        if tag < 10:
+            regex = re.compile(rb'\[' + str(tag).encode() + rb'[a-zA-Z]')
+        else:
+            regex = re.compile(rb'\[' + str(tag).encode())
+        prefilter = b'[' + str(tag).encode()  # cheap test before the regex
+        n_inert = 0
+        n_reactive = 0
+        with open_smi(scaffolds_file, 'rb') as f, open(reactive_file, 'wb') as r, open_smi(inert_file, 'wb') as i:
+            for line in f:
+                if prefilter not in line:
+                    n_tags = 0
+                else:
+                    n_tags = len(regex.findall(line))
+                if n_tags == 0:
+                    if line.strip():
+                        i.write(line)
+                        n_inert += 1
+                elif n_tags >= min_tags:
+                    r.write(line)
+                    n_reactive += 1
+        return n_inert, n_reactive
+
+    def partition_scaffolds_multi(self, tags, scaffolds_file, reactive_file, inert_file):
+        """reads the scaffolds file once and writes the scaffolds containing all the tags to the reactive file and the
+        scaffolds containing none of them to the inert file. Scaffolds containing only some of the tags are counted
+        but not written.
+        tags: list of int: isotopes of the tags
+        scaffolds_file: str: path to the scaffolds file (can be compressed)
+        reactive_file: str: path to the reactive file (not compressed since it is read by trxn)
+        inert_file: str: path to the inert file (can be compressed)
+        returns: tuple of int: number of inert, reactive and partially reactive scaffolds"""
+        regexes = []
+        for tag in tags:
+            if tag < 10:
+                regexes.append(re.compile(rb'\[' + str(tag).encode() + rb'[a-zA-Z]'))
+            else:
+                regexes.append(re.compile(rb'\[' + str(tag).encode()))
+        n_inert = 0
+        n_reactive = 0
+        n_partial = 0
+        with open_smi(scaffolds_file, 'rb') as f, open(reactive_file, 'wb') as r, open_smi(inert_file, 'wb') as i:
+            for line in f:
+                n_found = sum([1 for regex in regexes if regex.search(line) is not None])
+                if n_found == 0:
+                    if line.strip():
+                        i.write(line)
+                        n_inert += 1
+                elif n_found == len(regexes):
+                    r.write(line)
+                    n_reactive += 1
+                else:
+                    n_partial += 1
+        return n_inert, n_reactive, n_partial
+
+    def merge_products(self, products_file, inert_file, scaffolds_file, remove=()):
+        """appends the inert scaffolds to the products and makes the result the new scaffolds file (equivalent to
+        cat products_file inert_file > scaffolds_file but without copying the products). Compressed files are appended
+        as they are since concatenated gzip or lzma streams are a valid file
+        products_file: str: path to the products file
+        inert_file: str: path to the inert file
+        scaffolds_file: str: path to the scaffolds file
+        remove: iterable of str: paths of other files to remove
+        returns: None"""
+        if not os.path.isfile(products_file):
+            open(products_file, 'w').close()
+        with open(products_file, 'ab') as f, open(inert_file, 'rb') as g:
+            shutil.copyfileobj(g, f, 1 << 20)
+        os.replace(products_file, scaffolds_file)
+        os.remove(inert_file)
+        for file in remove:
+            os.remove(file)
+
+    def run_reaction(self, command, inputs, stem, products_file, n_reactive=0):
+        """runs a trxn command. If the products are compressed trxn writes them to the standard output and they are
+        compressed on the fly, otherwise trxn writes them to stem.smi. The enumeration stops if trxn fails or if it
+        does not make any product from the reactive scaffolds, so truncated products never become the scaffolds file
+        command: str: trxn command without output and input files
+        inputs: str: input files of the command
+        stem: str: stem of the output file
+        products_file: str: path to the products file
+        n_reactive: int: number of reactive scaffolds in the inputs
+        returns: None"""
+        if self.compression is None:
+            returncode = subprocess.run(f'{command} -S {stem} {inputs}', shell=True).returncode
         else:
-            return int(wc1)
+            with open_smi(products_file, 'wb') as f:
+                proc = subprocess.Popen(f'{command} -S - {inputs}', shell=True, stdout=subprocess.PIPE)
+                shutil.copyfileobj(proc.stdout, f, 1 << 20)
+                proc.stdout.close()
+                returncode = proc.wait()
+        if returncode != 0:
+            print(f'ERROR::: trxn exited with status {returncode}')
+            print('command:', command)
+            self.success = False
+            sys.exit(1)
+        if n_reactive > 0:
+            empty = True
+            if os.path.isfile(products_file):
+                with open_smi(products_file, 'rb') as f:
+                    empty = f.readline().strip() == b''
+            if empty:
+                print(f'ERROR::: no products were obtained from {n_reactive} reactive scaffolds')
+                print('command:', command)
+                self.success = False
+                sys.exit(1)
+
+    def sample_scaffolds(self, scaffolds_file, n):
+        """keeps a random sample of n lines of a (compressed) scaffolds file (reservoir sampling, so the file is read
+        only once)
+        scaffolds_file: str: path to the scaffolds file
+        n: int: number of lines to keep
+        returns: None"""
+        rng = random.Random(self.seed)
+        sample = []
+        with open_smi(scaffolds_file, 'rb') as f:
+            for i, line in enumerate(f):
+                if i < n:
+                    sample.append(line)
+                else:
+                    j = rng.randrange(i + 1)
+                    if j < n:
+                        sample[j] = line
+        rng.shuffle(sample)
+        with open_smi(scaffolds_file + '.tmp' + self.ext, 'wb') as f:
+            f.writelines(sample)
+        os.replace(scaffolds_file + '.tmp' + self.ext, scaffolds_file)
 
     def create_sge_script(self):
         """creates a sge script in the working folder
@@ -357,6 +631,274 @@ class SynthGraph:
         os.system(command)
         return qsub_script
 
+    def split_reactive_file(self, reactive_file, nlines):
+        """splits the reactive file in chunks of nlines lines
+        reactive_file: str: path to the reactive file
+        nlines: int: number of lines of each chunk
+        returns: tuple of three lists of str: reactive files, stems and products files of the chunks (in chunk
+            order)"""
+        command = f'split -l {nlines} -a 4 {reactive_file} {reactive_file}.'
+        os.system(command)
+        # rename the split products and create the lists files
+        oldfiles = os.listdir(self.wfolder)
+        oldfiles = sorted([file for file in oldfiles if file.startswith('R00reactive.smi.')])
+        products_files = [file[-4:] + 'PRD.smi' for file in oldfiles]
+        reactive_files = [file[-4:] + 'R00reactive.smi' for file in oldfiles]
+        stems = [file.replace('.smi', '') for file in products_files]
+        oldfiles = [os.path.join(self.wfolder, file) for file in oldfiles]
+        products_files = [os.path.join(self.wfolder, file) for file in products_files]
+        reactive_files = [os.path.join(self.wfolder, file) for file in reactive_files]
+        stems = [os.path.join(self.wfolder, file) for file in stems]
+        for oldfile, file in zip(oldfiles, reactive_files):
+            os.rename(oldfile, file)
+        return reactive_files, stems, products_files
+
+    def split_bbs_file(self, bbs_file, nlines):
+        """splits a building blocks file in chunks of nlines lines
+        bbs_file: str: path to the building blocks file
+        nlines: int: number of lines of each chunk
+        returns: list of str: paths to the chunks (in chunk order)"""
+        folder, name = os.path.split(bbs_file)
+        chunks = []
+        g = None
+        with open(bbs_file, 'rb') as f:
+            for i, line in enumerate(f):
+                if i % nlines == 0:
+                    if g is not None:
+                        g.close()
+                    chunks.append(os.path.join(folder, f'B{str(len(chunks)).rjust(4, "0")}{name}'))
+                    g = open(chunks[-1], 'wb')
+                g.write(line)
+        if g is not None:
+            g.close()
+        return chunks
+
+    def calibrate(self, command, reactive_file, bbs_files):
+        """runs a reaction on a small sample of the scaffolds and building blocks to measure the throughput of trxn.
+        The sample is taken from the head of the files and sized to give about CALIBRATION_PRODUCTS products, so the
+        start up time of trxn is included in the measure and the throughput is slightly underestimated
+        command: str: trxn command without output and input files
+        reactive_file: str: path to the reactive scaffolds file
+        bbs_files: list of str: paths to the building block files of the reaction (empty for cyclizations)
+        returns: tuple of float or None: products per second and bytes per product (None if no products were made)"""
+        sizes = [self.count_compounds(file) for file in bbs_files]
+        per_file = max(int(CALIBRATION_PRODUCTS ** (1 / (len(bbs_files) + 1))), 1)
+        sizes = [min(size, per_file) for size in sizes]
+        n_bbs = 1
+        for size in sizes:
+            n_bbs *= size
+        sizes = [max(CALIBRATION_PRODUCTS // n_bbs, 1)] + sizes
+        samples = []
+        for i, (file, size) in enumerate(zip([reactive_file] + bbs_files, sizes)):
+            samples.append(os.path.join(self.wfolder, f'CAL{i}.smi'))
+            with open(file, 'rb') as f, open(samples[-1], 'wb') as g:
+                for j, line in enumerate(f):
+                    if j == size:
+                        break
+                    g.write(line)
+        stem = os.path.join(self.wfolder, 'CALPRD')
+        tic = time.time()
+        subprocess.run(f'{command} -S {stem} {" ".join(samples)}', shell=True, stdout=subprocess.DEVNULL)
+        elapsed = max(time.time() - tic, 1e-3)
+        for file in samples:
+            os.remove(file)
+        if not os.path.isfile(stem + '.smi'):
+            return None
+        n_products = count_lines(stem + '.smi')
+        size = os.path.getsize(stem + '.smi')
+        os.remove(stem + '.smi')
+        if n_products == 0:
+            return None
+        return n_products / elapsed, size / n_products
+
+    def chunk_capacity(self, command, reactive_file, bbs_files, n_products):
+        """computes the number of products enumerated in each chunk. If autotune is set the reaction is calibrated and
+        the capacity is the number of products that meets both the target wall time and the memory budget of a chunk,
+        otherwise it is the chunksize
+        command: str: trxn command without output and input files
+        reactive_file: str: path to the reactive scaffolds file
+        bbs_files: list of str: paths to the building block files of the reaction
+        n_products: int: number of products of the reaction
+        returns: int"""
+        if not self.autotune or n_products <= CALIBRATION_PRODUCTS:
+            return self.chunksize
+        calibration = self.calibrate(command, reactive_file, bbs_files)
+        if calibration is None:
+            print('WARNING::: calibration of the reaction failed, chunksize is used')
+            return self.chunksize
+        products_per_second, bytes_per_product = calibration
+        capacity = int(min(products_per_second * self.target_seconds,
+                           self.memory_budget * (1 << 20) / bytes_per_product))
+        print(f'INFO::: calibration: {int(products_per_second)} products/s, {int(bytes_per_product)} bytes/product, '
+              f'{max(capacity, 1)} products per chunk')
+        return max(capacity, 1)
+
+    def plan_chunks(self, n_scaffolds, n_bbs, capacity):
+        """computes the number of scaffolds and of building blocks of each chunk so a chunk makes at most capacity
+        products. The building blocks file is split as well when it contains more building blocks than the capacity
+        n_scaffolds: int: number of reactive scaffolds
+        n_bbs: int: number of building blocks
+        capacity: int: number of products of each chunk
+        returns: tuple of int: number of scaffolds and of building blocks of each chunk"""
+        bbs_chunk = min(n_bbs, capacity)
+        n_bbs_chunks = -(-n_bbs // bbs_chunk)
+        bbs_chunk = -(-n_bbs // n_bbs_chunks)  # balances the chunks of building blocks
+        scaffolds_chunk = min(max(capacity // bbs_chunk, 1), n_scaffolds)
+        return scaffolds_chunk, bbs_chunk
+
+    def run_local_chunk(self, command, products_file):
+        """runs the command of a chunk checking its return code and its output, and runs it again if it fails
+        command: str: command to run
+        products_file: str: path to the file the command must create
+        returns: int: return code of the last attempt"""
+        for attempt in range(self.retries + 1):
+            if os.path.isfile(products_file):
+                os.remove(products_file)
+            returncode = subprocess.run(command, shell=True).returncode
+            if returncode == 0 and os.path.isfile(products_file):
+                return 0
+            print(f'WARNING::: chunk failed with status {returncode} (attempt {attempt + 1} of {self.retries + 1})')
+            print('command:', command)
+        return returncode if returncode != 0 else 1
+
+    def run_chunks(self, commands, products_files, reactive_files, products_file):
+        """runs the commands of all the chunks either through qsub or in a local pool of workers and merges the
+        products of the chunks in products_file in chunk order
+        commands: list of str: command for each chunk
+        products_files: list of str: path to the products file of each chunk
+        reactive_files: list of str: path to the input files of the chunks (reactive scaffolds and split building
+            blocks), removed at the end
+        products_file: str: path to the merged products file
+        returns: None"""
+        if self.local:
+            print(f'INFO::: Running {len(commands)} chunks in a local pool of {self.cores} workers')
+            print('')
+            with ThreadPool(min(self.cores, len(commands))) as pool:
+                returncodes = pool.starmap(self.run_local_chunk, zip(commands, products_files))
+            failed = [command for command, returncode in zip(commands, returncodes) if returncode != 0]
+            if len(failed) > 0:
+                print(f'ERROR::: {len(failed)} chunks failed')
+                for command in failed:
+                    print('command:', command)
+                self.success = False
+                sys.exit(1)
+        else:
+            # run reaction in multiple nodes through qsub
+            print('INFO::: Running job in the HPC')
+            print('')
+            # create the qsub config file
+            config_file = os.path.join(self.wfolder, 'qsub.config')
+            with open(config_file, 'w') as f:
+                for command in commands:
+                    f.write(command + '\n')
+            # create the sge script
+            sge_script = self.create_sge_script()
+            # create the qsub script
+            numjobs = len(commands)
+            qsub_script = self.create_qsub_script(numjobs, sge_script)
+            # run the qsub
+            command = f'{qsub_script} {config_file}'
+            os.system(command)
+            for file in products_files:
+                if not os.path.isfile(file):
+                    print(f'ERROR::: {file} was not created')
+                    self.success = False
+                    sys.exit(1)
+        # combine all the files in a single file (compressing it if required) and remove the files
+        with open_smi(products_file, 'wb') as f:
+            for file in products_files:
+                with open(file, 'rb') as g:
+                    shutil.copyfileobj(g, f, 1 << 20)
+                os.remove(file)
+        for file in reactive_files:
+            os.remove(file)
+
+    def bb_tuples(self, start, stop=None):
+        """maps a range of ordinals of the library to the ids of their building blocks. The ordinal is decoded as a
+        mixed radix number over the prepared building block files of the nodes (in file order), so ordinals are stable
+        as long as the building block files and preparations do not change
+        start: int: first ordinal (0 based)
+        stop: int or None: ordinal after the last one (if None only start is mapped)
+        returns: list of tuples of str: ids of the building blocks of each node for each ordinal"""
+        ids = [read_bb_ids(node.bbsfile) for node in self.nodes]
+        sizes = [len(item) for item in ids]
+        n_products = 1
+        for size in sizes:
+            n_products *= size
+        if stop is None:
+            stop = start + 1
+        if start < 0 or start >= n_products:
+            print(f'ERROR::: ordinal {start} is out of the range of the library (0 to {n_products - 1})')
+            self.success = False
+            sys.exit(1)
+        if stop > n_products:
+            print(f'WARNING::: the library contains {n_products} compounds, the range is truncated')
+            stop = n_products
+        tuples = []
+        for ordinal in range(start, stop):
+            indexes = decode_ordinal(ordinal, sizes)
+            tuples.append(tuple([node_ids[i] for node_ids, i in zip(ids, indexes)]))
+        return tuples
+
+    def ordinals_target_file(self, start, stop=None):
+        """writes a target file with the building blocks of a range of ordinals of the library
+        start: int: first ordinal (0 based)
+        stop: int or None: ordinal after the last one (if None only start is written)
+        returns: str: path to the target file"""
+        target_file = os.path.join(self.wfolder, 'target.txt')
+        with open(target_file, 'w') as f:
+            for bb_ids in self.bb_tuples(start, stop):
+                f.write(' '.join(bb_ids) + '\n')
+        return target_file
+
+    def sample_target_file(self):
+        """samples self.n building block tuples (one building block per node) without repetition and writes them in a
+        target file. With uniform sampling the tuples are drawn uniformly from the product space. With nha sampling
+        for each node first a number of heavy atoms (taken from the nha:id building block ids) is drawn uniformly and
+        then a building block with that number of heavy atoms, so all sizes of building blocks are equally represented
+        returns: str or None: path to the target file, or None if the whole library is smaller than self.n"""
+        ids = [read_bb_ids(node.bbsfile) for node in self.nodes]
+        sizes = [len(item) for item in ids]
+        n_products = 1
+        for size in sizes:
+            n_products *= size
+        if n_products <= self.n:
+            print(f'INFO::: the library contains {n_products} compounds, sampling is not required')
+            return None
+        rng = random.Random(self.seed)
+        if self.sampling == 'uniform':
+            if n_products < sys.maxsize:
+                ordinals = rng.sample(range(n_products), self.n)
+            else:  # range objects larger than sys.maxsize can not be sampled
+                ordinals = set()
+                while len(ordinals) < self.n:
+                    ordinals.add(rng.randrange(n_products))
+            tuples = [decode_ordinal(ordinal, sizes) for ordinal in sorted(ordinals)]
+        elif self.sampling == 'nha':
+            strata = []  # for each node a list of lists of building block indexes with the same nha
+            for node_ids in ids:
+                groups = dict()
+                for i, bb_id in enumerate(node_ids):
+                    nha = bb_id.split(':')[0] if ':' in bb_id else ''
+                    groups.setdefault(nha, []).append(i)
+                strata.append(list(groups.values()))
+            tuples = set()
+            attempts = 0
+            while len(tuples) < self.n and attempts < 100 * self.n:
+                tuples.add(tuple(rng.choice(rng.choice(node_strata)) for node_strata in strata))
+                attempts += 1
+            tuples = sorted(tuples)
+        else:
+            print(f'ERROR::: {self.sampling} is not a valid sampling method')
+            self.success = False
+            sys.exit(1)
+        target_file = os.path.join(self.wfolder, 'target.txt')
+        with open(target_file, 'w') as f:
+            for indexes in tuples:
+                f.write(' '.join([node_ids[i] for node_ids, i in zip(ids, indexes)]) + '\n')
+        print(f'INFO::: {len(tuples)} building block tuples sampled ({self.sampling}) from {n_products} compounds')
+        return target_file
+
     def enumerate_target_file(self, target_file):
         """enumerates a predefined set of compounds given in a target file. The target file is a text file
         with columns separated by spaces and no header containing ids of the building blocks to add. The columns are
@@ -371,7 +913,7 @@ class SynthGraph:
         reactions = [self.create_reaction(i+1) for i, node in enumerate(self.nodes[1:])]
         bb_files = " ".join([os.path.join(self.wfolder, "R" + str(i).rjust(2, "0") + ".smi") for i in range(len(self.nodes))])
         command = f'{self.make_these_molecules}'
-        command = f' -R {" -R ".join([reaction for reaction in reactions])}'
+        command += f' -R {" -R ".join([reaction for reaction in reactions])}'
         command += f' -M {target_file}'
         command += f' -S {os.path.join(self.wfolder, "products")}'
         command += f' -z f -z i -W "+" -l -i smi -g all -A D'
@@ -379,8 +921,13 @@ class SynthGraph:
         print(command)
         os.system(command)
 
-        command = f'mv {os.path.join(self.wfolder, "products.smi")} {os.path.join(self.wfolder, "R00.smi")}'
-        os.system(command)
+        if self.compression is None:
+            command = f'mv {os.path.join(self.wfolder, "products.smi")} {os.path.join(self.wfolder, "R00.smi")}'
+            os.system(command)
+        else:
+            copy_smi(os.path.join(self.wfolder, "products.smi"), os.path.join(self.wfolder, "R00.smi" + self.ext))
+            os.remove(os.path.join(self.wfolder, "products.smi"))
+            os.remove(os.path.join(self.wfolder, "R00.smi"))
 
     def join_node(self, node):
         """conducts enumeration using the edge joining a node and products
@@ -389,24 +936,18 @@ class SynthGraph:
         print('')
         print(f'INFO::: Joining node {node}')
         # set file names
-        scaffolds_file = os.path.join(self.wfolder, 'R00.smi')
+        in_scaffolds_file = find_smi(os.path.join(self.wfolder, 'R00.smi'))
+        scaffolds_file = os.path.join(self.wfolder, 'R00.smi' + self.ext)
         reactive_file = os.path.join(self.wfolder, 'R00reactive.smi')
-        inert_file = os.path.join(self.wfolder, 'R00inert.smi')
+        inert_file = os.path.join(self.wfolder, 'R00inert.smi' + self.ext)
         intermediate_file = os.path.join(self.wfolder, 'R00int.smi')
-        products_file = os.path.join(self.wfolder, 'PRD.smi')
+        products_file = os.path.join(self.wfolder, 'PRD.smi' + self.ext)
         stem = os.path.join(self.wfolder, 'PRD')
         # create reactive and inert files and also create reaction file
-        if node < 10:
-            pattern = f'"\[{node}[a-z,A-Z]"'
-        else:
-            pattern = f'"\[{node}"'
-        command = f'grep {pattern} {scaffolds_file} > {reactive_file}'
-        os.system(command)
-        command = f'grep -v {pattern} {scaffolds_file} > {inert_file}'
-        os.system(command)
+        n1, n2 = self.partition_scaffolds(node, 1, in_scaffolds_file, reactive_file, inert_file)
         reaction = self.create_reaction(node)
         # compute number of compounds to enumerate
-        n1, n2, n3 = self.count_compounds(inert_file, reactive_file, self.nodes[node].bbsfile)
+        n3 = self.count_compounds(self.nodes[node].bbsfile)
         n2t = n2
         # reduce input scaffold file if required
         reduce_output = False
@@ -419,69 +960,124 @@ class SynthGraph:
             if n1 + n2t * n3 > self.n:
                 reduce_output = True
         # determine if the reaction must be performed in parallel through qsub and eventually run it
-        if n2t * n3 > self.chunksize:
-            # run reaction in multiple nodes through qsub
-            print('INFO::: Running job in the HPC')
-            print('')
-            if n3 >= self.chunksize:  # assumes that n3 must be always less than self.chunksize
-                print(f'there are more building blocks in node {node} than the required number of compounds to ')
-                print(f'enumerate {self.chunksize}. Please increase the required number of compounds to enumerate')
-                sys.exit(1)
-            n2chunk = self.chunksize // n3
-            command = f'split -l {n2chunk} -a 4 {reactive_file} {reactive_file}.'
-            os.system(command)
-            # rename the split products and create the lists files
-            oldfiles = os.listdir(self.wfolder)
-            oldfiles = [file for file in oldfiles if file.startswith('R00reactive.smi.')]
-            products_files = [file[-4:] + 'PRD.smi' for file in oldfiles]
-            reactive_files = [file[-4:] + 'R00reactive.smi' for file in oldfiles]
-            stems = [file.replace('.smi', '') for file in products_files]
-            oldfiles = [os.path.join(self.wfolder, file) for file in oldfiles]
-            products_files = [os.path.join(self.wfolder, file) for file in products_files]
-            reactive_files = [os.path.join(self.wfolder, file) for file in reactive_files]
-            stems = [os.path.join(self.wfolder, file) for file in stems]
-            for oldfile, file in zip(oldfiles, reactive_files):
-                os.rename(oldfile, file)
-            # create the qsub config file
-            config_file = os.path.join(self.wfolder, 'qsub.config')
-            with open(config_file, 'w') as f:
-                for qstem, qreactive_file in zip(stems, reactive_files):
-                    command = f'{self.trxn}'
-                    command += f' -r {reaction} -z i -m RMX -M RMX -W "+" -L -i smi -o smi'
-                    command += f' -S {qstem} {qreactive_file} {self.nodes[node].bbsfile}\n'
-                    f.write(command)
-            # create the sge script
-            sge_script = self.create_sge_script()
-            # create the qsub script
-            numjobs = len(stems)
-            qsub_script = self.create_qsub_script(numjobs, sge_script)
-            # run the qsub
-            command = f'{qsub_script} {config_file}'
-            os.system(command)
-            # combine all the files in a single file and remove the files
-            command = f'cat {" ".join([file for file in products_files])} > {products_file}'
-            os.system(command)
-            command = f'rm {" ".join([file for file in products_files])}'
-            os.system(command)
-            command = f'rm {" ".join([file for file in reactive_files])}'
-            os.system(command)
+        command = f'{self.trxn}'
+        command += f' -r {reaction} -z i -m RMX -M RMX -W "+" -L -i smi -o smi'
+        capacity = self.chunk_capacity(command, reactive_file, [self.nodes[node].bbsfile], n2t * n3)
+        if n2t * n3 > capacity:
+            # run reaction in chunks, either in multiple nodes through qsub or in a local pool. Chunks are split along
+            # the scaffolds and, if there are more building blocks than the capacity, along the building blocks too
+            n2chunk, n3chunk = self.plan_chunks(n2t, n3, capacity)
+            reactive_files, stems, products_files = self.split_reactive_file(reactive_file, n2chunk)
+            if n3chunk < n3:
+                bbs_files = self.split_bbs_file(self.nodes[node].bbsfile, n3chunk)
+            else:
+                bbs_files = [self.nodes[node].bbsfile]
+            commands = []
+            chunk_products_files = []
+            for qstem, qreactive_file in zip(stems, reactive_files):
+                for i, bbs_file in enumerate(bbs_files):
+                    qstem_bbs = qstem if len(bbs_files) == 1 else f'{qstem}{str(i).rjust(4, "0")}'
+                    commands.append(f'{command} -S {qstem_bbs} {qreactive_file} {bbs_file}')
+                    chunk_products_files.append(qstem_bbs + '.smi')
+            input_files = reactive_files + (bbs_files if len(bbs_files) > 1 else [])
+            self.run_chunks(commands, chunk_products_files, input_files, products_file)
         else:
             # run reaction in a single core
             print('')
-            command = f'{self.trxn}'
-            command += f' -r {reaction} -z i -m RMX -M RMX -W "+" -L -i smi -o smi'
-            command += f' -S {stem} {reactive_file} {self.nodes[node].bbsfile}'
-            os.system(command)
+            self.run_reaction(command, f'{reactive_file} {self.nodes[node].bbsfile}', stem, products_file,
+                              n_reactive=n2t)
         # combine products_file and inert file and remove unnecesary files
-        command = f'cat {products_file} {inert_file} > {scaffolds_file} && '
-        command += f'rm {reactive_file} {inert_file} {products_file}'
-        os.system(command)
+        self.merge_products(products_file, inert_file, scaffolds_file, remove=[reactive_file])
+        if in_scaffolds_file != scaffolds_file:
+            os.remove(in_scaffolds_file)
         # reduce the size of the produts_file if required
-        if reduce_output:
+        if reduce_output and self.compression is not None:
+            self.sample_scaffolds(scaffolds_file, self.n)
+        elif reduce_output:
             command = f'shuf -n {self.n} {scaffolds_file} > {intermediate_file} '
             command += f'&& mv {intermediate_file} {scaffolds_file}'
             os.system(command)
 
+    def fusable(self, group, node):
+        """checks whether a node can be joined in the same trxn call than a group of consecutive nodes. It requires
+        that the edges of all the nodes are attached to the scaffold obtained before the group (not to building blocks
+        of the group) and that the isotopes set by the joins are not used by other joins of the group
+        group: list of int: indexes of the nodes in the group
+        node: int: index of the node
+        returns: bool"""
+        tags = group + [node]
+        for tag in tags:
+            values = self.edges[tag-1]['values']
+            if values['dest_node'] >= group[0]:
+                return False
+            if values['orig_isotope'] in tags or values['dest_isotope'] in tags:
+                return False
+        return True
+
+    def fused_groups(self):
+        """groups consecutive nodes that can be joined in a single trxn call. The product of the number of building
+        blocks of the nodes in a group must not exceed the chunksize, since scaffolds are split in chunks
+        returns: list of lists of int: node indexes of each group"""
+        groups = []
+        n_bbs = 1
+        for node_index in range(1, len(self.nodes)):
+            size = self.count_compounds(self.nodes[node_index].bbsfile)
+            if len(groups) > 0 and self.fusable(groups[-1], node_index) and n_bbs * size < self.chunksize:
+                groups[-1].append(node_index)
+                n_bbs *= size
+            else:
+                groups.append([node_index])
+                n_bbs = size
+        return groups
+
+    def join_nodes(self, nodes):
+        """conducts the enumeration joining several nodes to the products in a single trxn call, so the intermediate
+        scaffolds are not written. If some scaffolds contain only some of the tags of the nodes the nodes are joined
+        one by one
+        nodes: list of int: indexes of the nodes to join
+        """
+        if len(nodes) == 1:
+            self.join_node(nodes[0])
+            return
+        print('')
+        print(f'INFO::: Joining nodes {nodes} in a single reaction')
+        # set file names
+        in_scaffolds_file = find_smi(os.path.join(self.wfolder, 'R00.smi'))
+        scaffolds_file = os.path.join(self.wfolder, 'R00.smi' + self.ext)
+        reactive_file = os.path.join(self.wfolder, 'R00reactive.smi')
+        inert_file = os.path.join(self.wfolder, 'R00inert.smi' + self.ext)
+        products_file = os.path.join(self.wfolder, 'PRD.smi' + self.ext)
+        stem = os.path.join(self.wfolder, 'PRD')
+        n1, n2, n_partial = self.partition_scaffolds_multi(nodes, in_scaffolds_file, reactive_file, inert_file)
+        if n_partial > 0:
+            print(f'INFO::: {n_partial} scaffolds contain only some of the tags, nodes are joined one by one')
+            os.remove(reactive_file)
+            os.remove(inert_file)
+            for node in nodes:
+                self.join_node(node)
+            return
+        reaction = self.create_fused_reaction(nodes)
+        n_bbs = 1
+        for node in nodes:
+            n_bbs *= self.count_compounds(self.nodes[node].bbsfile)
+        bbs_files = ' '.join([self.nodes[node].bbsfile for node in nodes])
+        command = f'{self.trxn}'
+        command += f' -r {reaction} -z i -m RMX -M RMX -W "+" -L -i smi -o smi'
+        capacity = self.chunk_capacity(command, reactive_file, [self.nodes[node].bbsfile for node in nodes], n2 * n_bbs)
+        if n2 * n_bbs > capacity:
+            # run reaction in chunks, either in multiple nodes through qsub or in a local pool
+            reactive_files, stems, products_files = self.split_reactive_file(reactive_file, max(capacity // n_bbs, 1))
+            commands = [f'{command} -S {qstem} {qreactive_file} {bbs_files}'
+                        for qstem, qreactive_file in zip(stems, reactive_files)]
+            self.run_chunks(commands, products_files, reactive_files, products_file)
+        else:
+            print('')
+            self.run_reaction(command, f'{reactive_file} {bbs_files}', stem, products_file, n_reactive=n2)
+        # combine products_file and inert file and remove unnecesary files
+        self.merge_products(products_file, inert_file, scaffolds_file, remove=[reactive_file])
+        if in_scaffolds_file != scaffolds_file:
+            os.remove(in_scaffolds_file)
+
     def cycle_node(self, edge, cycle_bond_order):
         """conducts a cyclization reaction for the specified edge
         edge: int: index for this edge
@@ -489,76 +1085,31 @@ class SynthGraph:
         print('')
         print(f'INFO::: cycling edge {edge}')
         # set file names
-        scaffolds_file = os.path.join(self.wfolder, 'R00.smi')
+        in_scaffolds_file = find_smi(os.path.join(self.wfolder, 'R00.smi'))
+        scaffolds_file = os.path.join(self.wfolder, 'R00.smi' + self.ext)
         reactive_file = os.path.join(self.wfolder, 'R00reactive.smi')
-        inert_file = os.path.join(self.wfolder, 'R00inert.smi')
-        products_file = os.path.join(self.wfolder, 'PRD.smi')
+        inert_file = os.path.join(self.wfolder, 'R00inert.smi' + self.ext)
+        products_file = os.path.join(self.wfolder, 'PRD.smi' + self.ext)
         stem = os.path.join(self.wfolder, 'PRD')
         # keep only the lines that contain either 0 or 2 instances of the cycle_edge tag
-        if edge < 10:
-            pattern_reactive = f'"\[{edge}[a-z,A-Z].*\[{edge}[a-z,A-Z]"'
-            pattern_inert = f'"\[{edge}[a-z,A-Z]"'
-        else:
-            pattern_reactive = f'"\[{edge}.*\[{edge}"'
-            pattern_inert = f'"\[{edge}"'
-        command = f'grep {pattern_reactive} {scaffolds_file} > {reactive_file}'
-        os.system(command)
-        command = f'grep -v {pattern_inert} {scaffolds_file} > {inert_file}'
-        os.system(command)
+        _, n1 = self.partition_scaffolds(edge, 2, in_scaffolds_file, reactive_file, inert_file)
         reaction = self.create_cyclization(edge, cycle_bond_order)
+        command = f'{self.trxn}'
+        command += f' -r {reaction} -z i -m RMX -M RMX -W "+" -i smi -o smi'
         # determine if the reaction must be performed in parallel through qsub and eventually run it
-        n1 = self.count_compounds(reactive_file)
-        if n1 > self.chunksize:
-            # run reaction in multiple nodes through qsub
-            print('INFO::: Running job in the HPC')
-            print('')
-            n1chunk = self.chunksize // n1
-            command = f'split -l {n1chunk} -a 4 {reactive_file} {reactive_file}.'
-            os.system(command)
-            # rename the split products and create the lists files
-            oldfiles = os.listdir(self.wfolder)
-            oldfiles = [file for file in oldfiles if file.startswith('R00.smi.')]
-            reactive_files = [file[-4:] + 'R00reactive.smi' for file in oldfiles]
-            products_files = [file[-4:] + 'PRD.smi' for file in oldfiles]
-            stems = [file.replace('.smi', '') for file in products_files]
-            oldfiles = [os.path.join(self.wfolder, file) for file in oldfiles]
-            reactive_files = [os.path.join(self.wfolder, file) for file in reactive_files]
-            products_files = [os.path.join(self.wfolder, file) for file in products_files]
-            stems = [os.path.join(self.wfolder, file) for file in stems]
-            for oldfile, file in zip(oldfiles, reactive_files):
-                os.rename(oldfile, file)
-            # create the qsub config file
-            config_file = os.path.join(self.wfolder, 'qsub.config')
-            with open(config_file, 'w') as f:
-                for qstem, qreactive_file in zip(stems, reactive_files):
-                    command = f'{self.trxn}'
-                    command += f' -r {reaction} -z i -m RMX -M RMX -W "+" -i smi -o smi'
-                    command += f' -S {qstem} {qreactive_file}'
-                    f.write(command)
-            # create the sge script
-            sge_script = self.create_sge_script()
-            # create the qsub script
-            numjobs = len(stems)
-            qsub_script = self.create_qsub_script(numjobs, sge_script)
-            # run the qsub
-            command = f'{qsub_script} {config_file}'
-            os.system(command)
-            # combine all the files in a single file and remove the files
-            command = f'cat {" ".join([file for file in products_files])} > {products_file}'
-            os.system(command)
-            command = f'rm {" ".join([file for file in products_files])}'
-            os.system(command)
-            command = f'rm {" ".join([file for file in reactive_files])}'
-            os.system(command)
+        capacity = self.chunk_capacity(command, reactive_file, [], n1)
+        if n1 > capacity:
+            # run reaction in chunks, either in multiple nodes through qsub or in a local pool
+            # each scaffold gives one product so chunks contain capacity scaffolds
+            reactive_files, stems, products_files = self.split_reactive_file(reactive_file, capacity)
+            commands = [f'{command} -S {qstem} {qreactive_file}' for qstem, qreactive_file in zip(stems, reactive_files)]
+            self.run_chunks(commands, products_files, reactive_files, products_file)
         else:
             print('')
-            command = f'{self.trxn}'
-            command += f' -r {reaction} -z i -m RMX -M RMX -W "+" -i smi -o smi'
-            command += f' -S {stem} {reactive_file}'
-            os.system(command)
-        command = f'cat {products_file} {inert_file} > {scaffolds_file} && '
-        command += f'rm {reactive_file} {inert_file} {products_file}'
-        os.system(command)
+            self.run_reaction(command, reactive_file, stem, products_file, n_reactive=n1)
+        self.merge_products(products_file, inert_file, scaffolds_file, remove=[reactive_file])
+        if in_scaffolds_file != scaffolds_file:
+            os.remove(in_scaffolds_file)
 
     def par_quality_control(self):
         """runs quality control of par"""
@@ -686,24 +1237,57 @@ class SynthGraph:
                     print(f'node {i}, preparation {j}: reaction file {preparation["reaction"]} does not exist. Exiting.')
                     sys.exit(1)
 
-    def run_graph(self, target_file=None):
+    def prepare_node(self, node):
+        """runs the preparations of a node (it runs in a worker thread, so errors are returned instead of exiting)
+        node: instance of SynthNode class
+        returns: bool: whether the preparations succeeded"""
+        try:
+            node.add_preparations()
+        except SystemExit:  # the node reports the error before exiting
+            return False
+        return node.success
+
+    def prepare_nodes(self):
+        """runs the preparations of all the nodes concurrently. Nodes are independent of each other and their scratch
+        files have different names, so only the trxn calls of each node are run in sequence
+        returns: None"""
+        nodes = [node for node in self.nodes if len(node.preps) > 0]
+        if len(nodes) == 0:
+            return
+        with ThreadPool(min(self.cores, len(nodes))) as pool:
+            results = pool.map(self.prepare_node, nodes)
+        self.success = self.success and all(results)
+        if not all(results):
+            failed = [node.node for node, result in zip(nodes, results) if not result]
+            print(f'ERROR::: preparations failed for nodes {failed}')
+            sys.exit(1)
+
+    def run_graph(self, target_file=None, ordinals=None):
         """Runs all the reactions specified in the graph
         target_file: str: path to a target file, The target file is a text file
             with columns separated by spaces and no header containing ids of the building blocks to add.
             The columns are not headed. If not passed then the enumeration goes node by node
+        ordinals: tuple of two int or None: start and stop of a range of ordinals of the library. If passed only the
+            products in that range are enumerated (overrides target_file)
         """
         # generate the node objects and append them in the node list, then prepare bbs if required
         for node in self.par:
             self.add_node(node)
-            self.nodes[-1].add_preparations()
-            self.success = self.success and self.nodes[-1].success
+        self.prepare_nodes()
         # conduct enumeration of the main graph
+        if ordinals is not None:
+            target_file = self.ordinals_target_file(*ordinals)
+        elif target_file is None and self.n > 0 and self.sampling is not None:
+            target_file = self.sample_target_file()
         if target_file is not None:
             self.enumerate_target_file(target_file)
-            return
-        for node_index in range(len(self.nodes)):
-            if node_index != 0:
-                self.join_node(node_index)
+        elif self.fuse and self.n <= 0:
+            for nodes in self.fused_groups():
+                self.join_nodes(nodes)
+        else:
+            for node_index in range(len(self.nodes)):
+                if node_index != 0:
+                    self.join_node(node_index)
         # conduct cyclizations
         cycles = []
         for node_index, node in enumerate(self.nodes):
@@ -712,7 +1296,9 @@ class SynthGraph:
                     if cycle_edge not in cycles:
                         cycles.append(cycle_edge)
                         self.cycle_node(cycle_edge, cycle_bond_order)
-        os.rename(os.path.join(self.wfolder, "R00.smi"), os.path.join(self.wfolder, "enumeration.smi"))
+        scaffolds_file = find_smi(os.path.join(self.wfolder, "R00.smi"))
+        extension = scaffolds_file[len(os.path.join(self.wfolder, "R00.smi")):]
+        os.rename(scaffolds_file, os.path.join(self.wfolder, "enumeration.smi" + extension))
         os.rename(os.path.join(self.wfolder, "RP00.smi"), os.path.join(self.wfolder, "R00.smi"))
 
 
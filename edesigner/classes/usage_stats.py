@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+# usage_stats
+# Jose Alfredo Martin
+
+__version__ = 'usage_stats.v.12.0.0'
+__author__ = 'Alfredo Martin 2023'
+
+# Python modules
+from multiprocessing import Pool
+from multiprocessing import cpu_count
+# External modules
+import numpy as np
+# Local modules
+from classes.libdesign_store import LibDesignStore
+
+CHUNK_LIBS = 4096
+
+
+def encode_libs(libs):
+    """encodes a list of libDESIGNs into index arrays (one row per library, reaction, deprotection and BBT)
+    libs: list of instances of LibDesign class
+    returns: dict of numpy arrays: n_all (per library), reactions and deprotections (rows of library position, index
+        and multiplicity), bbts (rows of library position, cycle and BBT index)"""
+    reactions = [(i, reaction, 1) for i, lib in enumerate(libs) for reaction in lib.reactions]
+    deprotections = [(i, deprotection, 1) for i, lib in enumerate(libs) for deprotection in lib.deprotections]
+    bbts = [(i, cycle + 1, bbt) for i, lib in enumerate(libs) for cycle in range(lib.n_cycles)
+            for bbt in lib.bbts[cycle]]
+    return {'n_all': np.array([0 if lib.n_all is None else lib.n_all for lib in libs], dtype='float64'),
+            'reactions': np.array(reactions, dtype='int64').reshape(-1, 3),
+            'deprotections': np.array(deprotections, dtype='int64').reshape(-1, 3),
+            'bbts': np.array(bbts, dtype='int64').reshape(-1, 3)}
+
+
+def encode_store_range(filename, start, stop):
+    """encodes the libDESIGNs of a sqlite store with ids in [start, stop) into index arrays reading the tables of the
+    store (the libDESIGNs are not unpickled)
+    filename: str: path to the sqlite store
+    start: int: first id
+    stop: int: last id (excluded)
+    returns: dict of numpy arrays (see encode_libs)"""
+    store = LibDesignStore(filename)
+    rows = store.con.execute('SELECT id, n_all FROM libdesigns WHERE id >= ? AND id < ? ORDER BY id',
+                             (start, stop)).fetchall()
+    ids = np.array([row[0] for row in rows], dtype='int64')
+    encoded = {'n_all': np.array([0 if row[1] is None else row[1] for row in rows], dtype='float64')}
+    for table, field in [('reactions', 'reaction'), ('deprotections', 'deprotection'), ('bbts', 'cycle, bbt')]:
+        query = f'SELECT id, {field}{", multiplicity" if table != "bbts" else ""} FROM {table} WHERE id >= ? AND id < ?'
+        arr = np.array(store.con.execute(query, (start, stop)).fetchall(), dtype='int64').reshape(-1, 3)
+        arr[:, 0] = np.searchsorted(ids, arr[:, 0])
+        encoded[table] = arr
+    store.con.close()
+    return encoded
+
+
+def reduce_usage(encoded, sizes, weighted=False, cooccurrence=False):
+    """computes the usage counts of a set of encoded libDESIGNs
+    encoded: dict of numpy arrays (see encode_libs)
+    sizes: dict: number of reactions (n_reactions), deprotections (n_deprotections), BBTs (n_bbts) and maximum number
+        of cycles (n_cycles)
+    weighted: bool: if True each library counts as many times as its number of compounds
+    cooccurrence: bool: if True the reaction x reaction and BBT x cycle matrices are computed
+    returns: dict of numpy arrays: reactions, deprotections, bbts and (if cooccurrence) reaction_reaction, bbt_cycle"""
+    n_all = encoded['n_all'] if weighted else np.ones(encoded['n_all'].shape[0], dtype='float64')
+    reactions = encoded['reactions']
+    deprotections = encoded['deprotections'][encoded['deprotections'][:, 1] != 0]
+    bbts = encoded['bbts']
+    usage = {'reactions': np.bincount(reactions[:, 1], weights=n_all[reactions[:, 0]] * reactions[:, 2],
+                                      minlength=sizes['n_reactions']),
+             'deprotections': np.bincount(deprotections[:, 1], weights=n_all[deprotections[:, 0]] * deprotections[:, 2],
+                                          minlength=sizes['n_deprotections']),
+             'bbts': np.bincount(bbts[:, 2], weights=n_all[bbts[:, 0]], minlength=sizes['n_bbts'])}
+    if cooccurrence:
+        usage['bbt_cycle'] = np.bincount(bbts[:, 2] * sizes['n_cycles'] + bbts[:, 1] - 1, weights=n_all[bbts[:, 0]],
+                                         minlength=sizes['n_bbts'] * sizes['n_cycles']
+                                         ).reshape(sizes['n_bbts'], sizes['n_cycles'])
+        matrix = np.zeros((sizes['n_reactions'], sizes['n_reactions']), dtype='float64')
+        for start in range(0, n_all.shape[0], CHUNK_LIBS):
+            rows = reactions[(reactions[:, 0] >= start) & (reactions[:, 0] < start + CHUNK_LIBS)]
+            incidence = np.zeros((min(CHUNK_LIBS, n_all.shape[0] - start), sizes['n_reactions']), dtype='float64')
+            incidence[rows[:, 0] - start, rows[:, 1]] = 1
+            matrix += incidence.T @ (incidence * n_all[start:start + CHUNK_LIBS, None])
+        usage['reaction_reaction'] = matrix
+    return usage
+
+
+def _store_partition_usage(job):
+    """unpacks the arguments of the reduction of a partition of the store (Pool.imap passes a single argument)
+    job: tuple: filename, start, stop, sizes, weighted and cooccurrence
+    returns: dict of numpy arrays (see reduce_usage)"""
+    filename, start, stop, sizes, weighted, cooccurrence = job
+    return reduce_usage(encode_store_range(filename, start, stop), sizes, weighted, cooccurrence)
+
+
+def _accumulate(total, usage):
+    if total is None:
+        return usage
+    for key in total.keys():
+        total[key] += usage[key]
+    return total
+
+
+def usage_stats(designs, sizes, weighted=False, cooccurrence=False, cores=-1, verbose=False):
+    """computes the usage counts of the reactions, deprotections and BBTs of the libDESIGNs of an eDESIGNER run in a
+    single streaming pass. Partitions of the sqlite store (ranges of ids) are reduced in parallel, while the stream of
+    pickled libDESIGNs is reduced in chunks of CHUNK_LIBS libraries
+    designs: instance of LibDesignStore or PickledLibDesigns class
+    sizes: dict: see reduce_usage
+    weighted: bool: if True each library counts as many times as its number of compounds
+    cooccurrence: bool: if True the reaction x reaction and BBT x cycle matrices are computed
+    cores: int: number of workers (-1 means all cores)
+    verbose: bool: prints the progress
+    returns: dict of numpy arrays (see reduce_usage)"""
+    total = None
+    if isinstance(designs, LibDesignStore):
+        min_id, max_id = designs.con.execute('SELECT MIN(id), MAX(id) FROM libdesigns').fetchone()
+        if min_id is not None:
+            cores = cpu_count() if cores == -1 else cores
+            bounds = np.unique(np.linspace(min_id, max_id + 1, 4 * cores + 1).astype('int64'))
+            jobs = [(designs.filename, int(bounds[i]), int(bounds[i + 1]), sizes, weighted, cooccurrence)
+                    for i in range(bounds.shape[0] - 1)]
+            with Pool(max(min(cores, len(jobs)), 1)) as pool:
+                for i, usage in enumerate(pool.imap_unordered(_store_partition_usage, jobs)):
+                    total = _accumulate(total, usage)
+                    if verbose:
+                        print(f'INFO::: partition {i + 1} of {len(jobs)} reduced')
+    else:
+        chunk = []
+        for lib in designs:
+            chunk.append(lib)
+            if len(chunk) == CHUNK_LIBS:
+                total = _accumulate(total, reduce_usage(encode_libs(chunk), sizes, weighted, cooccurrence))
+                chunk = []
+        if len(chunk) > 0 or total is None:
+            total = _accumulate(total, reduce_usage(encode_libs(chunk), sizes, weighted, cooccurrence))
+    if total is None:
+        total = reduce_usage(encode_libs([]), sizes, weighted, cooccurrence)
+    return total
+
+
+if __name__ == '__main__':
+    print(__version__)
+    print(__author__)
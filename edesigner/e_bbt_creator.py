@@ -13,7 +13,7 @@ import _pickle as pic
 import time
 import argparse
 # External modules
-from classes.bbt import BBT
+from classes.bbt import BBT, compatible
 from classes.logger import Logger
 from classes.parameter_reader import Parameters
 from classes.bb_reader import BBReader
@@ -56,9 +56,28 @@ def parse_args():
                         building blocks.""",
                         type=str,
                         default=None)
+    parser.add_argument('-sF', '--scratch_folder',
+                        help="""folder used to store temporary files while reading building blocks (for example a 
+                        tmpfs folder). If not passed the results folder of the run is used.""",
+                        type=str,
+                        default=None)
+    parser.add_argument('-cs', '--chunksize',
+                        help="""When passed, building blocks are annotated and filtered by functional groups in blocks 
+                        of this number of compounds, so memory usage does not grow with the size of the catalogues.""",
+                        type=int,
+                        default=None)
+    parser.add_argument('-lz', '--lazy_bbts',
+                        help="""When invoked, BBTs are not generated by comprehension of all compatible combinations 
+                        of FGs. Instead, they are derived from the FG vectors found in the building blocks (plus the 
+                        BBTs of the headpieces), so BBTs without building blocks are not created.""",
+                        action='store_true')
     parser.add_argument('-ots', '--override_time_stamp',
                         help="""When invoked, the run folder will be set to R000000. This is used only for testing""",
                         action='store_true')
+    parser.add_argument('-jl', '--json_log',
+                        help="""When invoked the log is also written as json lines (.jsonl file next to the log) with 
+                        the stage, elapsed time and counters of each message""",
+                        action='store_true')
     parser.add_argument('-v', '--verbose',
                         help="""When invoked additional information is printed in the console.""",
                         action='store_true')
@@ -66,22 +85,11 @@ def parse_args():
     if args.wfolder is None:
         args.wfolder = os.path.abspath(os.getcwd())
     assert os.path.isdir(args.wfolder), f'{args.wfolder} does not exist'
+    if args.scratch_folder is not None:
+        assert os.path.isdir(args.scratch_folder), f'{args.scratch_folder} does not exist'
     return args
 
 
-def compatible(A, fg):
-    """Function compatible has as argument a list with three indexes corresponding to FGs for one BBT
-    and returns a bool indicating whether these FGs are compatible in the same BBT
-    A : BBT (list of three int corresponding to a BBT)
-    fg : instance of the Parameters class (functional group parameters)
-    returns : resultado (bool)"""
-    resultado = True
-    for i in range(3):
-        for j in range(i+1, 3):
-            if A[j] != 0 and A[i] != 0 and A[j] in fg.par[A[i]]['self_incompatibility']:
-                resultado=False
-    return resultado
-
 def intialization(wfolder):
     """The initiallization function establishes the folder structure for this run. Creates the run name which
     will be used in all the other scritps. Reads the required parameters and creates the log file
@@ -116,7 +124,7 @@ def intialization(wfolder):
                 shutil.copy(os.path.join(os.environ['EDESIGNER_FOLDER'], 'resources', file),
                             os.path.join(RESOURCESFOLDER, file))
         PARFOLDER = RESOURCESFOLDER  # in this case the function is not imported
-    log = Logger(os.path.join(LOGFOLDER, 'e_bbt_creator.log'), prepend_timestamp=True)
+    log = Logger(os.path.join(LOGFOLDER, 'e_bbt_creator.log'), prepend_timestamp=True, structured=args.json_log)
     dbpar = Parameters(os.path.join(PARFOLDER, 'db.par'), fsource='list', how='to_list', multiple=True)
     for i in range(len(dbpar.par)):
         dbpar.par[i]['filename'] = os.path.expandvars(dbpar.par[i]['filename'])
@@ -141,7 +149,7 @@ def generate_bbts(fg, headpieces, bblim, log):
     log: instance of Logger class
     teturn: BBTs: list of instances of BBT class"""
     # Generates the list of all BBTs by comprehension ignoring incompatible BBTs but including [0, 0, 0]
-    log.update('Generating BB types...')
+    log.update('Generating BB types...', stage='bbts')
     BBT_list = [[i, j, k] for i in range(len(fg.par)) for j in range(i, len(fg.par)) for k in range(j, len(fg.par)) if
                 compatible([i, j, k], fg)]
     BBTs = [BBT(BBT=BBT_list[i], fg=fg, headpieces=headpieces, index=i, maxna=bblim.par['max_bb_na']) for i in range(len(BBT_list))]
@@ -154,12 +162,18 @@ if __name__ == '__main__':
     tic, log, dbpar, bblim, par, fg, calcfg, antifg, headpieces, RUNFOLDER, RUNNAME, RESULTSFOLDER = intialization(args.wfolder)
     log.update(__version__)
     log.update(__author__)
-    BBTs = generate_bbts(fg, headpieces, bblim, log)
+    if args.lazy_bbts:
+        BBTs = None  # BBTs are derived from the building blocks by BBReader
+    else:
+        BBTs = generate_bbts(fg, headpieces, bblim, log)
 
     # read compound sets and get valid compounds within valid BBTs
     reader = BBReader(RESULTSFOLDER, RUNFOLDER, BBTs, dbpar, fg, antifg, calcfg, bblim, log,
-                      smi=args.smiles_file, verbose=args.verbose, debug=False)
+                      smi=args.smiles_file, scratch=args.scratch_folder, chunksize=args.chunksize,
+                      headpieces=headpieces,
+                      verbose=args.verbose, debug=False)
     reader.run()
+    log.update('BB types and building blocks generated', stage='end')
 
     # time and end the program
     tac = time.time()
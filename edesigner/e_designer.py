@@ -16,9 +16,11 @@ import numpy as np
 # Local modules
 from classes.parameter_reader import Parameters
 from classes.bbt import BBT
+from classes.bbt_store import load_bbts
 from classes.logger import Logger
 from classes.design import Design
 from classes.libdesign import LibDesign
+from classes.libdesign_store import save_libdesigns, STORE_FILE
 from tqdm import tqdm
 
 
@@ -60,6 +62,10 @@ def parse_args():
                         from the paramenters folder corresponding to this run""",
                         type=str,
                         default=None)
+    parser.add_argument('-jl', '--json_log',
+                        help="""When invoked the log is also written as json lines (.jsonl file next to the log) with 
+                        the stage, elapsed time and counters of each message""",
+                        action='store_true')
 
     args = parser.parse_args()
     assert os.path.isdir(args.wfolder), f'{args.wfolder} does not exist'
@@ -192,7 +198,8 @@ def create_designs(par, BBTs, reaction, deprotection, fg, log, RUNFOLDER, curren
                 commands = f.readlines()
             commands = [command.strip() for command in commands]
             for i, command in enumerate(commands):
-                log.update(f'    cycle {cycle +1}: expandig file {i+1} out of {len(commands)}')
+                log.update(f'    cycle {cycle +1}: expandig file {i+1} out of {len(commands)}',
+                           counters={'cycle': cycle + 1, 'file': i + 1, 'n_files': len(commands)})
                 os.system(command)
 
 def get_all_indexes(par, bblim, ndim):
@@ -233,7 +240,7 @@ def create_libdesigns(args, na_dist, par, deprotection, BBTs, reaction, log, RUN
             if design.lib_id not in lib_dict.keys():
                 lib_dict[design.lib_id] = LibDesign(par)
             lib_dict[design.lib_id].update_lib(design, reaction, deprotection, args.run_id, RUNNAME)
-    log.update(f'{n_designs} eDESIGNs were generated')
+    log.update(f'{n_designs} eDESIGNs were generated', counters={'n_designs': n_designs})
     log.update('**** Curating libDESIGNs ****')
     lib_list = []
     count = -1
@@ -244,11 +251,13 @@ def create_libdesigns(args, na_dist, par, deprotection, BBTs, reaction, log, RUN
                 count += 1
                 lib_dict[key].id = count
                 lib_list.append(lib_dict[key])
-    log.update(f'{len(lib_list)} libDESIGNs remaining after removing those that do not fulfill the criteria')
+    log.update(f'{len(lib_list)} libDESIGNs remaining after removing those that do not fulfill the criteria',
+               counters={'n_libdesigns': len(lib_list)})
     log.update('Saving libraries to disk...')
     with open(os.path.join(RESULTSFOLDER, 'libDESIGNs.pic'), 'wb') as f:
         for item in lib_list:
             pic.dump(item, f)
+    save_libdesigns(lib_list, os.path.join(RESULTSFOLDER, STORE_FILE))
 
 
 if __name__ == '__main__':
@@ -264,10 +273,10 @@ if __name__ == '__main__':
         RUNNAME = 'ED000000'
     else:
         RUNNAME = 'ED' + timestamp
-    log = Logger(os.path.join(args.wfolder, args.run_id, 'logs', RUNNAME + '.log'))
+    log = Logger(os.path.join(args.wfolder, args.run_id, 'logs', RUNNAME + '.log'), structured=args.json_log)
     log.update(__version__)
     log.update(__author__)
-    log.update('**** CREATING FOLDER SYSTEM ****')
+    log.update('**** CREATING FOLDER SYSTEM ****', stage='folders')
     RUNFOLDER = os.path.abspath(os.path.join(args.wfolder, args.run_id, RUNNAME))
     os.mkdir(RUNFOLDER)
     PARFOLDER = os.path.abspath(os.path.join(RUNFOLDER, 'resources'))
@@ -278,7 +287,7 @@ if __name__ == '__main__':
         shutil.copy(os.path.join(RESOURCESFOLDER, 'par.par'), os.path.join(PARFOLDER, 'par.par'))
     else:
         shutil.copy(args.par_file, os.path.join(PARFOLDER, 'par.par'))
-    log.update('**** READING PARAMETERS ****')
+    log.update('**** READING PARAMETERS ****', stage='parameters')
     bblim = Parameters(os.path.join(RESOURCESFOLDER, 'bblim.par'), fsource='dict', how='to_dict', multiple=False)
     par = Parameters(os.path.join(PARFOLDER, 'par.par'), fsource='dict', how='to_dict', multiple=False)
     fg = Parameters(os.path.join(RESOURCESFOLDER, 'fg.par'), fsource='list', how='to_list', multiple=True)
@@ -296,15 +305,14 @@ if __name__ == '__main__':
 
     if not error_found:
         # load BBTs object (list of BBT class instances)
-        log.update('**** LOADING BBTs ****')
-        with open(os.path.join(args.wfolder, args.run_id, 'results', 'BBTs.pic'), 'rb') as f:
-            BBTs = pic.load(f)
+        log.update('**** LOADING BBTs ****', stage='bbts')
+        BBTs = load_bbts(os.path.join(args.wfolder, args.run_id, 'results'))
 
     # Create designs
-    log.update('**** CREATING eDESIGNs ****')
+    log.update('**** CREATING eDESIGNs ****', stage='edesigns')
     create_designs(par, BBTs, reaction, deprotection, fg, log, RUNFOLDER, current)
     # Create lib_designs
-    log.update('**** CREATING libDESIGNs ****')
+    log.update('**** CREATING libDESIGNs ****', stage='libdesigns')
     n_cycles = len(par.par['max_cycle_na'])
     na_dist = get_all_indexes(par, bblim, n_cycles)
     create_libdesigns(args, na_dist, par, deprotection, BBTs, reaction, log, RUNFOLDER)
@@ -317,7 +325,7 @@ if __name__ == '__main__':
     if os.path.isfile(os.path.join(RUNFOLDER, 'results', 'sge_script.sh')):
         os.remove(os.path.join(RUNFOLDER, 'results', 'sge_script.sh'))
     tac = time.time()
-    log.update(f'Running time: {round((tac - tic) /60, 1)} min.')
+    log.update(f'Running time: {round((tac - tic) /60, 1)} min.', stage='end', counters={'seconds': round(tac - tic, 1)})
     log.update(f'the run ID for this run is {args.run_id}')
     log.update(f'the eDESIGNER run name is {RUNNAME}')
     log.update('OK')
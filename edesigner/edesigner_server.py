@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+# eDESIGNER
+# Jose Alfredo Martin
+
+__version__ = 'edesigner_server.v.12.0.0'
+__author__ = 'Alfredo Martin 2023'
+
+# Python modules
+import os
+import json
+import socketserver
+import argparse
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+# Local modules
+from classes.run_state import RunCache, JobQueue
+
+
+def parse_args():
+    # Arg parser
+    parser = argparse.ArgumentParser(description="""edesigner_server keeps eDESIGNER runs loaded in memory and answers
+    find, describe, stats and enumeration requests over http (localhost or a Unix socket). Runs are loaded the first
+    time they are requested and reloaded when any file of their resources or results folders changes. Endpoints (all
+    of them accept wfolder, run_id and ed_run_id, which default to the values passed to the server):
+    GET /find (reaction, deprotection, any_reaction, any_deprotection, not_reaction, not_deprotection, can be
+    repeated; min_n_all, max_n_all, n_libraries), GET /describe (lib_idx or lib_id), GET /stats (weighted,
+    cooccurrence), POST /enumerate (json body with lib_idx and args, a list of extra arguments of enumerate_library),
+    GET /jobs, GET /jobs/{job}, GET /runs. Responses are json.""")
+    parser.add_argument('-H', '--host',
+                        help="""Host. Default: 127.0.0.1""",
+                        type=str,
+                        default='127.0.0.1')
+    parser.add_argument('-p', '--port',
+                        help="""Port. Default: 8765""",
+                        type=int,
+                        default=8765)
+    parser.add_argument('-s', '--socket',
+                        help="""Path to a Unix socket. When passed the server listens on the socket instead of the
+                        port""",
+                        type=str,
+                        default=None)
+    parser.add_argument('-wF', '--wfolder',
+                        help="""Default working folder""",
+                        type=str,
+                        default=None)
+    parser.add_argument('-run', '--run_id',
+                        help="""Default run id. When --ed_run_id is passed too the run is loaded at start""",
+                        type=str,
+                        default=None)
+    parser.add_argument('-erun', '--ed_run_id',
+                        help="""Default eDESIGNER run id""",
+                        type=str,
+                        default=None)
+    parser.add_argument('-jF', '--jobs_folder',
+                        help="""Folder where the output of the enumeration jobs is written. Default: edesigner_jobs in
+                        the current folder""",
+                        type=str,
+                        default='edesigner_jobs')
+    parser.add_argument('-c', '--cores',
+                        help="""Number of workers used to compute statistics. Default: -1 (all cores)""",
+                        type=int,
+                        default=-1)
+    parser.add_argument('-v', '--verbose',
+                        help="""When invoked every request is printed in the standard output""",
+                        action='store_true')
+    args = parser.parse_args()
+    if args.wfolder is not None:
+        assert os.path.isdir(args.wfolder), f'{args.wfolder} does not exist'
+        args.wfolder = os.path.abspath(args.wfolder)
+    os.makedirs(args.jobs_folder, exist_ok=True)
+    args.jobs_folder = os.path.abspath(args.jobs_folder)
+    return args
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class RequestError(Exception):
+    """error in the parameters of a request (answered with status 400)"""
+    pass
+
+
+def make_handler(cache, jobs, defaults, cores, verbose):
+    """creates the request handler class of the server
+    cache: instance of RunCache class
+    jobs: instance of JobQueue class
+    defaults: dict: default wfolder, run_id and ed_run_id
+    cores: int: number of workers used to compute statistics
+    verbose: bool
+    returns: subclass of BaseHTTPRequestHandler"""
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def log_message(self, format, *args):
+            if verbose:
+                print('INFO::: ' + format % args)
+
+        def send_json(self, status, content):
+            body = json.dumps(content).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def get_int(self, query, name, default=None):
+            if name not in query:
+                return default
+            try:
+                return int(query[name][-1])
+            except ValueError:
+                raise RequestError(f'{name} must be an integer')
+
+        def get_ints(self, query, name):
+            try:
+                return [int(item) for item in query[name]] if name in query else None
+            except ValueError:
+                raise RequestError(f'{name} must be an integer')
+
+        def get_flag(self, query, name):
+            return name in query and query[name][-1].lower() not in ['0', 'false', 'no']
+
+        def get_state(self, query):
+            run = {key: query[key][-1] if key in query else defaults[key] for key in ['wfolder', 'run_id', 'ed_run_id']}
+            missing = [key for key, value in run.items() if value is None]
+            if len(missing) > 0:
+                raise RequestError(f'{", ".join(missing)} not passed and without default')
+            return cache.get(run['wfolder'], run['run_id'], run['ed_run_id'])
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            try:
+                if url.path == '/find':
+                    state = self.get_state(query)
+                    content = state.find(n_libraries=self.get_int(query, 'n_libraries', 0),
+                                         reactions=self.get_ints(query, 'reaction'),
+                                         deprotections=self.get_ints(query, 'deprotection'),
+                                         any_reactions=self.get_ints(query, 'any_reaction'),
+                                         any_deprotections=self.get_ints(query, 'any_deprotection'),
+                                         not_reactions=self.get_ints(query, 'not_reaction'),
+                                         not_deprotections=self.get_ints(query, 'not_deprotection'),
+                                         min_n_all=self.get_int(query, 'min_n_all'),
+                                         max_n_all=self.get_int(query, 'max_n_all'))
+                elif url.path == '/describe':
+                    state = self.get_state(query)
+                    if 'lib_id' in query:
+                        lib_id = tuple([int(item) for item in query['lib_id'][-1].split('_')])
+                        content = state.describe(lib_id=lib_id)
+                    else:
+                        lib_idx = self.get_int(query, 'lib_idx')
+                        if lib_idx is None:
+                            raise RequestError('lib_idx or lib_id must be passed')
+                        content = state.describe(lib_idx=lib_idx)
+                    if content is None:
+                        self.send_json(404, {'error': 'library not found'})
+                        return
+                elif url.path == '/stats':
+                    state = self.get_state(query)
+                    content = state.stats(weighted=self.get_flag(query, 'weighted'),
+                                          cooccurrence=self.get_flag(query, 'cooccurrence'), cores=cores)
+                elif url.path == '/runs':
+                    content = cache.loaded()
+                elif url.path == '/jobs':
+                    content = jobs.all()
+                elif url.path.startswith('/jobs/'):
+                    content = jobs.status(int(url.path.split('/')[-1]))
+                    if content is None:
+                        self.send_json(404, {'error': 'job not found'})
+                        return
+                else:
+                    self.send_json(404, {'error': f'unknown endpoint {url.path}'})
+                    return
+            except (RequestError, ValueError, FileNotFoundError) as e:
+                self.send_json(400, {'error': str(e)})
+                return
+            except Exception as e:
+                traceback.print_exc()
+                self.send_json(500, {'error': f'{type(e).__name__}: {e}'})
+                return
+            self.send_json(200, content)
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            if url.path != '/enumerate':
+                self.send_json(404, {'error': f'unknown endpoint {url.path}'})
+                return
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                if not isinstance(body, dict):
+                    raise RequestError('the body must be a json object')
+                extra_args = body.get('args', [])
+                if not isinstance(extra_args, list) or not all([isinstance(arg, str) for arg in extra_args]):
+                    raise RequestError('args must be a list of strings')
+                query = {key: [value] for key, value in body.items() if key in ['wfolder', 'run_id', 'ed_run_id']}
+                state = self.get_state(query)
+                if 'lib_idx' not in body:
+                    raise RequestError('lib_idx must be passed')
+                if state.get_design(lib_idx=int(body['lib_idx'])) is None:
+                    raise RequestError(f'lib_idx {body["lib_idx"]} not found')
+                args = ['-wF', state.wfolder, '-run', state.run_id, '-erun', state.ed_run_id,
+                        '-lidx', int(body['lib_idx'])] + extra_args
+                job_id = jobs.submit(args)
+            except (RequestError, ValueError, TypeError, FileNotFoundError) as e:
+                self.send_json(400, {'error': str(e)})
+                return
+            except Exception as e:
+                traceback.print_exc()
+                self.send_json(500, {'error': f'{type(e).__name__}: {e}'})
+                return
+            self.send_json(202, jobs.status(job_id))
+
+    return Handler
+
+
+def main():
+    args = parse_args()
+    cache = RunCache(verbose=args.verbose)
+    jobs = JobQueue(args.jobs_folder)
+    defaults = {'wfolder': args.wfolder, 'run_id': args.run_id, 'ed_run_id': args.ed_run_id}
+    if all([value is not None for value in defaults.values()]):
+        cache.get(args.wfolder, args.run_id, args.ed_run_id)
+    handler = make_handler(cache, jobs, defaults, args.cores, args.verbose)
+    if args.socket is not None:
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        server = UnixHTTPServer(args.socket, handler)
+        print(f'INFO::: listening on {args.socket}')
+    else:
+        server = ThreadingHTTPServer((args.host, args.port), handler)
+        print(f'INFO::: listening on http://{args.host}:{args.port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket is not None and os.path.exists(args.socket):
+            os.remove(args.socket)
+
+
+if __name__ == '__main__':
+    print(__version__)
+    print(__author__)
+    main()
@@ -11,10 +11,15 @@ import shutil
 import sys
 import argparse
 import time
+import traceback
+from multiprocessing import Pool
+from multiprocessing import cpu_count
 # Local modules
 from classes.parameter_reader import Parameters
 from classes.libdesign import LibDesign
+from classes.libdesign_store import load_libdesigns
 from classes.enumerator import Enumerator
+from classes.product_qa import ProductQA
 from classes.bbt import BBT
 import _pickle as pic
 
@@ -73,6 +78,19 @@ def parse_args():
                         help="""library index. This overrides --lib_id""",
                         type=int,
                         default=None)
+    parser.add_argument('-blidx', '--batch_lib_idx',
+                        help="""list of library indexes to enumerate in a single run. This overrides --lib_idx and 
+                        --lib_id. The libraries are enumerated in parallel and the prepared building blocks are 
+                        cached so each preparation is run only once in the batch. --ordinals is applied to each 
+                        library and --product_qa checks each library once the batch is enumerated.""",
+                        type=int,
+                        nargs='+',
+                        default=None)
+    parser.add_argument('-bw', '--batch_workers',
+                        help="""Number of libraries enumerated in parallel when --batch_lib_idx is passed. 
+                        Default: -1 (all cores)""",
+                        type=int,
+                        default=-1)
 
     # common
     parser.add_argument('-n', '--nmols',
@@ -84,6 +102,64 @@ def parse_args():
                         Default: 400000""",
                         type=int,
                         default=400000)
+    parser.add_argument('-ord', '--ordinals',
+                        help="""When passed, only the library members in this range of ordinals are enumerated. 
+                        Format: start or start:stop (0 based, stop not included). The ordinal of a member is decoded 
+                        as a mixed radix number over the prepared building block files of each cycle. It cannot be 
+                        combined with --product_qa.""",
+                        type=str,
+                        default=None)
+    parser.add_argument('-sm', '--sampling',
+                        help="""When --nmols is set, building block tuples are sampled before the enumeration so only 
+                        the sampled compounds are enumerated. uniform: uniform sampling of the library. nha: sampling 
+                        stratified by the number of heavy atoms of the building blocks of each cycle. If not passed 
+                        the products are sampled after each reaction.""",
+                        type=str,
+                        choices=['uniform', 'nha'],
+                        default=None)
+    parser.add_argument('-sd', '--seed',
+                        help="""seed for sampling""",
+                        type=int,
+                        default=None)
+    parser.add_argument('-cmp', '--compression',
+                        help="""When passed, scaffolds, products and the final enumeration are written compressed 
+                        with this method (gzip: enumeration.smi.gz, lzma: enumeration.smi.xz).""",
+                        type=str,
+                        choices=['gzip', 'lzma'],
+                        default=None)
+    parser.add_argument('-fu', '--fuse_joins',
+                        help="""When invoked, consecutive cycles attached to the scaffold independently of each other 
+                        are joined in a single trxn call, so the intermediate scaffolds are not written. It is not used 
+                        when --nmols is set.""",
+                        action='store_true')
+    parser.add_argument('-at', '--autotune',
+                        help="""When invoked, the number of compounds enumerated in each chunk is not --nc_per_run. 
+                        Instead, each reaction is calibrated with a small run of trxn and the chunks are sized to meet 
+                        --target_seconds and --memory_budget. Building block files are split as well when they are too 
+                        large for a chunk.""",
+                        action='store_true')
+    parser.add_argument('-ts', '--target_seconds',
+                        help="""Wall time targeted for each chunk when --autotune is invoked. Default: 900""",
+                        type=int,
+                        default=900)
+    parser.add_argument('-mb', '--memory_budget',
+                        help="""Maximum size (MB) of the products of each chunk when --autotune is invoked. 
+                        Default: 1024""",
+                        type=int,
+                        default=1024)
+    parser.add_argument('-lp', '--local_parallel',
+                        help="""When invoked, enumeration chunks are run in a pool of workers in the local machine 
+                        instead of being submitted to the HPC through qsub.""",
+                        action='store_true')
+    parser.add_argument('-nw', '--n_workers',
+                        help="""Number of workers used when --local_parallel is invoked. Default: -1 (all cores)""",
+                        type=int,
+                        default=-1)
+    parser.add_argument('-qa', '--product_qa',
+                        help="""When invoked, the products are checked after the enumeration (heavy atom distribution 
+                        against the prediction of the libDESIGN, textually duplicated smiles and parse failures) and a report is 
+                        written in enumeration_qa.json. See enumeration_qa.py to check existing enumerations.""",
+                        action='store_true')
     parser.add_argument('-wj', '--write_json',
                         help="""When invoked the script will create the json config file for enumeration and gather 
                         building blocks but it will not conduct the actual enumeration.""",
@@ -93,6 +169,8 @@ def parse_args():
                         action='store_true')
 
     args = parser.parse_args()
+    assert args.ordinals is None or not args.product_qa, \
+        '--product_qa checks whole enumerations, it cannot be combined with --ordinals'
     if args.user:
         assert args.efolder is not None, f'--efolder must be passed'
         assert os.path.isdir(args.efolder), f'{args.efolder} does not exist'
@@ -111,9 +189,148 @@ def parse_args():
         assert (os.path.isdir(
             os.path.join(args.wfolder, args.run_id, args.ed_run_id))), f'{os.path.join(args.wfolder, args.run_id, args.ed_run_id)} does not exist'
         assert os.path.isdir(args.wfolder), f'{args.wfolder} does not exist'
-        assert args.lib_idx is not None or args.lib_id is not None, 'either lib_id or lib_idx must be provided'
+        assert args.lib_idx is not None or args.lib_id is not None or args.batch_lib_idx is not None, \
+            'either lib_id, lib_idx or batch_lib_idx must be provided'
     return args
 
+
+def create_enum_folder(bwfolder, prefix):
+    """creates a new enumeration folder
+    bwfolder: str: folder containing the enumerations
+    prefix: str: prefix of the enumeration id
+    returns: str: path to the enumeration folder"""
+    increment = 1
+    enum_id = prefix + str(increment)
+    while True:
+        if os.path.isdir(os.path.join(bwfolder, enum_id)):
+            increment += 1
+            enum_id = prefix + str(increment)
+        else:
+            break
+    wfolder = os.path.abspath(os.path.join(bwfolder, enum_id))
+    os.mkdir(wfolder)
+    return wfolder
+
+
+def get_hp_smiles(headpieces, lib_id):
+    """gets the smiles of the headpiece of a library
+    headpieces: instance of Parameters class
+    lib_id: tuple: library id
+    returns: str: smiles of the headpiece"""
+    for headpiece in headpieces.par:
+        if headpiece['bbt'][-1] == lib_id[-1]:
+            return headpiece['smiles']
+    print('ERROR::: could not detect headpiede from lib_id')
+    sys.exit(1)
+
+
+def read_parameters(PARFOLDER):
+    """reads the parameters required for enumeration
+    PARFOLDER: str: folder containing the parameters
+    returns: tuple of instances of Parameters class: multireaction, preparations, enum_deprotection, enum_reaction
+        and headpieces"""
+    multireaction = Parameters(os.path.join(PARFOLDER, 'multireaction.par'), fsource='list', how='to_list', multiple=True)
+    preparations = Parameters(os.path.join(PARFOLDER, 'preparations.par'), fsource='list', how='to_list', multiple=True)
+    enum_deprotection = Parameters(os.path.join(PARFOLDER, 'enum_deprotection.par'), fsource='list', how='to_list', multiple=True)
+    enum_reaction = Parameters(os.path.join(PARFOLDER, 'enum_reaction.par'), fsource='list', how='to_list',multiple=True)
+    headpieces = Parameters(os.path.join(PARFOLDER, 'headpieces.par'), fsource='list', how='to_list', multiple=True)
+    return multireaction, preparations, enum_deprotection, enum_reaction, headpieces
+
+
+def parse_ordinals(ordinals):
+    """parses the --ordinals argument
+    ordinals: str: start or start:stop
+    returns: tuple: start (int) and stop (int or None)"""
+    start, _, stop = ordinals.partition(':')
+    return int(start), int(stop) if stop != '' else None
+
+
+def run_product_qa(wfolder, lib, PARFOLDER, args):
+    """checks the products of an enumeration and writes enumeration_qa.json in the enumeration folder
+    wfolder: str: enumeration folder
+    lib: instance of LibDesign class or None (user enumerations)
+    PARFOLDER: str: folder containing the parameters
+    args: argparse Namespace: arguments of the script
+    returns: None"""
+    par = Parameters(os.path.join(PARFOLDER, 'par.par'), fsource='dict', how='to_dict', multiple=False)
+    deprotection = Parameters(os.path.join(PARFOLDER, 'deprotection.par'), fsource='list', how='to_list',
+                              multiple=True)
+    qa = ProductQA(wfolder, lib=lib, par=par, deprotection=deprotection, cores=args.n_workers, verbose=args.verbose)
+    qa.run()
+
+
+def enumerate_batch_member(lib, wfolder, args, parameters, cache):
+    """enumerates one library of a batch (it runs in a worker process)
+    lib: instance of LibDesign class
+    wfolder: str: enumeration folder for this library
+    args: argparse Namespace: arguments of the script
+    parameters: tuple of instances of Parameters class returned by read_parameters
+    cache: str: folder where prepared building blocks are cached
+    returns: tuple of int, bool: library index and whether the enumeration finished"""
+    multireaction, preparations, enum_deprotection, enum_reaction, headpieces = parameters
+    try:
+        hp_smiles = get_hp_smiles(headpieces, lib.lib_id)
+        enumerator = Enumerator(wfolder, lib.lib_id, hp_smiles, args.user, lib=lib, base_folder=args.wfolder,
+                                verbose=args.verbose)
+        if args.ordinals is not None:
+            start, stop = parse_ordinals(args.ordinals)
+            enumerator.enumerate_members(multireaction, preparations, enum_deprotection, enum_reaction, start, stop,
+                                         verbose=args.verbose, cache=cache)
+            return lib.id, True
+        enumerator.run_graph_enumeration(multireaction, preparations, enum_deprotection, enum_reaction,
+                                         n=args.nmols, chunksize=args.nc_per_run, just_json=args.write_json,
+                                         local=args.local_parallel, cores=args.n_workers, sampling=args.sampling,
+                                         seed=args.seed, cache=cache, compression=args.compression,
+                                         fuse=args.fuse_joins, autotune=args.autotune,
+                                         target_seconds=args.target_seconds, memory_budget=args.memory_budget)
+    except SystemExit:  # errors are reported by the enumerator, the batch goes on with the other libraries
+        return lib.id, False
+    except Exception:  # unexpected errors are reported here so they do not abort the whole batch
+        print(f'ERROR::: enumeration of library {lib.id} failed')
+        traceback.print_exc()
+        return lib.id, False
+    return lib.id, True
+
+
+def enumerate_batch(args, ld, PARFOLDER, bwfolder):
+    """enumerates a batch of libraries in parallel sharing a cache of prepared building blocks. When --product_qa is
+    passed the products of each library are checked after the batch (the check runs its own pool of workers, which
+    cannot be started from the workers of the batch)
+    args: argparse Namespace: arguments of the script
+    ld: instance of LibDesignStore or PickledLibDesigns class
+    PARFOLDER: str: folder containing the parameters
+    bwfolder: str: folder containing the enumerations
+    returns: None"""
+    libs = {lib_idx: ld.get(lib_idx) for lib_idx in set(args.batch_lib_idx)}
+    libs = {lib_idx: lib for lib_idx, lib in libs.items() if lib is not None}
+    missing = [lib_idx for lib_idx in args.batch_lib_idx if lib_idx not in libs]
+    if len(missing) > 0:
+        print(f'Could not find lib_idx {missing} in eDESIGNER.')
+        sys.exit(1)
+    cache = os.path.join(bwfolder, 'prep_cache')
+    if not os.path.isdir(cache):
+        os.mkdir(cache)
+    parameters = read_parameters(PARFOLDER)
+    jobs = []
+    for lib_idx in args.batch_lib_idx:
+        wfolder = create_enum_folder(bwfolder, "EN" + str(lib_idx) + '_')
+        jobs.append((libs[lib_idx], wfolder, args, parameters, cache))
+        print(f'INFO::: library {lib_idx} will be enumerated in {wfolder}')
+    cores = cpu_count() if args.batch_workers == -1 else args.batch_workers
+    with Pool(min(cores, len(jobs))) as pool:
+        results = pool.starmap(enumerate_batch_member, jobs)
+    failed = [lib_idx for lib_idx, success in results if not success]
+    print(f'INFO::: {len(results) - len(failed)} libraries enumerated')
+    if args.product_qa and not args.write_json:
+        for (lib_idx, success), (lib, wfolder, _, _, _) in zip(results, jobs):
+            if success:
+                print(f'INFO::: checking the products of library {lib_idx}')
+                run_product_qa(wfolder, lib, PARFOLDER, args)
+    if len(failed) > 0:
+        print(f'ERROR::: enumeration failed for libraries {failed}')
+        sys.exit(1)
+
+
 def main():
     """
     runs the enumerator
@@ -122,46 +339,29 @@ def main():
     args = parse_args()
     if not args.user:
         print('eDESIGNER enumeration')
-        ld_file = os.path.join(args.wfolder, args.run_id, args.ed_run_id, "results", "libDESIGNs.pic")
-        ld = []
-        with open(ld_file, 'rb') as f:
-            while True:
-                try:
-                    ld.append(pic.load(f))
-                except:
-                    break
+        ld = load_libdesigns(os.path.join(args.wfolder, args.run_id, args.ed_run_id, "results"))
         PARFOLDER = os.path.abspath(os.path.join(args.wfolder, args.run_id, "resources"))
+        bwfolder = os.path.join(args.wfolder, args.run_id, args.ed_run_id, "enumerations")
+        if not os.path.isdir(bwfolder):
+            os.mkdir(bwfolder)
+        if args.batch_lib_idx is not None:
+            enumerate_batch(args, ld, PARFOLDER, bwfolder)
+            return
         if args.lib_idx:
-            for lib in ld:
-                if lib.id == args.lib_idx:
-                    lib_id = lib.lib_id
-                    lib_idx = args.lib_idx
-                    break
-            else:
+            lib = ld.get(args.lib_idx)
+            if lib is None:
                 print(f'Could not find lib_idx {args.lib_idx} in eDESIGNER.')
                 sys.exit(1)
+            lib_id = lib.lib_id
+            lib_idx = args.lib_idx
         else:
             lib_id = tuple([int(item) for item in args.lib_id.split('_')])
-            for lib in ld:
-                if lib.lib_id == lib_id:
-                    lib_idx = lib.id
-                    break
-            else:
+            lib = ld.get_by_lib_id(lib_id)
+            if lib is None:
                 print(f'Could not find lib_id {args.lib_id} in eDESIGNER.')
                 sys.exit(1)
-        bwfolder = os.path.join(args.wfolder, args.run_id, args.ed_run_id, "enumerations")
-        if not os.path.isdir(bwfolder):
-            os.mkdir(bwfolder)
-        increment = 1
-        enum_id = "EN" + str(lib_idx) + '_' + str(increment)
-        while True:
-            if os.path.isdir(os.path.join(bwfolder, enum_id)):
-                increment += 1
-                enum_id = "EN" + str(lib_idx) + '_' + str(increment)
-            else:
-                break
-        wfolder = os.path.abspath(os.path.join(bwfolder, enum_id))
-        os.mkdir(wfolder)
+            lib_idx = lib.id
+        wfolder = create_enum_folder(bwfolder, "EN" + str(lib_idx) + '_')
     else:
         print('User enumeration')
         lib_idx = None
@@ -172,36 +372,27 @@ def main():
         else:
             PARFOLDER = os.path.abspath(os.environ['EDESIGNER_PARFOLDER'])
             print(f'INFO::: PARFOLDER has been set to {PARFOLDER}')
-        increment = 1
-        enum_id = "ENUSER_" + str(increment)
-        while True:
-            if os.path.isdir(os.path.join(args.efolder, enum_id)):
-                increment += 1
-                enum_id = "ENUSER_" + str(increment)
-            else:
-                break
-        wfolder = os.path.abspath(os.path.join(args.efolder, enum_id))
-        os.mkdir(wfolder)
+        wfolder = create_enum_folder(args.efolder, "ENUSER_")
     # read parameters
-    multireaction = Parameters(os.path.join(PARFOLDER, 'multireaction.par'), fsource='list', how='to_list', multiple=True)
-    preparations = Parameters(os.path.join(PARFOLDER, 'preparations.par'), fsource='list', how='to_list', multiple=True)
-    enum_deprotection = Parameters(os.path.join(PARFOLDER, 'enum_deprotection.par'), fsource='list', how='to_list', multiple=True)
-    enum_reaction = Parameters(os.path.join(PARFOLDER, 'enum_reaction.par'), fsource='list', how='to_list',multiple=True)
-    headpieces = Parameters(os.path.join(PARFOLDER, 'headpieces.par'), fsource='list', how='to_list', multiple=True)
-    for headpiece in headpieces.par:
-        if headpiece['bbt'][-1] == lib_id[-1]:
-            hp_smiles = headpiece['smiles']
-            break
-    else:
-        print('ERROR::: could not detect headpiede from lib_id')
-        sys.exit(1)
-
+    multireaction, preparations, enum_deprotection, enum_reaction, headpieces = read_parameters(PARFOLDER)
+    hp_smiles = get_hp_smiles(headpieces, lib_id)
 
     enumerator = Enumerator(wfolder, lib_id, hp_smiles, args.user, bbs=args.bbs_file, lib=lib, base_folder=args.wfolder,
                             verbose=args.verbose)
     enumerator.print_summary_file(enum_reaction, enum_deprotection)
+    if args.ordinals is not None:
+        start, stop = parse_ordinals(args.ordinals)
+        enumerator.enumerate_members(multireaction, preparations, enum_deprotection, enum_reaction, start, stop,
+                                     verbose=args.verbose)
+        return
     enumerator.run_graph_enumeration(multireaction, preparations, enum_deprotection, enum_reaction,
-                                     n=args.nmols, chunksize=args.nc_per_run, just_json=args.write_json)
+                                     n=args.nmols, chunksize=args.nc_per_run, just_json=args.write_json,
+                                     local=args.local_parallel, cores=args.n_workers, sampling=args.sampling,
+                                     seed=args.seed, compression=args.compression, fuse=args.fuse_joins,
+                                     autotune=args.autotune, target_seconds=args.target_seconds,
+                                     memory_budget=args.memory_budget)
+    if args.product_qa and not args.write_json:
+        run_product_qa(wfolder, lib, PARFOLDER, args)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+# eDESIGNER
+# Jose Alfredo Martin
+
+__version__ = 'enumeration_qa.v.12.0.0'
+__author__ = 'Alfredo Martin'
+
+# Python modules
+import os
+import argparse
+# Local modules
+from classes.parameter_reader import Parameters
+from classes.libdesign import LibDesign
+from classes.libdesign_store import load_libdesigns, STORE_FILE, PICKLE_FILE
+from classes.product_qa import ProductQA
+
+
+def parse_args():
+    # Arg parser
+    parser = argparse.ArgumentParser(description="""enumeration_qa checks the products of an enumeration without
+    loading them in memory. The enumeration file is processed in chunks in parallel to compute the distribution of
+    heavy atoms of the products (compared against the distribution predicted for the libDESIGN), the number of
+    textually duplicated smiles (found with a hash set partitioned to disk; the smiles are not canonicalized, so the
+    same molecule written with two different smiles is not counted) and the number of smiles that cannot be parsed. A
+    json report (enumeration_qa.json) is written in the enumeration folder.
+    """)
+    parser.add_argument('-eF', '--enumeration_folder',
+                        help="""enumeration folder (containing enumeration.smi). If it is an eDESIGNER enumeration
+                        (wfolder/run_id/ed_run_id/enumerations/EN{lib_idx}_{n}) the libDESIGN and the parameters of the
+                        run are used to predict the distribution of heavy atoms.""",
+                        type=str,
+                        required=True)
+    parser.add_argument('-pF', '--parfolder',
+                        help="""folder containing eDESIGNER parameters. Used for user enumerations to predict the
+                        distribution of heavy atoms. If not passed for a user enumeration the prediction is skipped""",
+                        type=str,
+                        default=None)
+    parser.add_argument('-c', '--cores',
+                        help="""Number of workers. Default: -1 (all cores)""",
+                        type=int,
+                        default=-1)
+    parser.add_argument('-np', '--n_partitions',
+                        help="""Number of partitions of the hashes of the smiles. Each partition is loaded in memory
+                        separately to find duplicates (8 bytes per product). Default: 64""",
+                        type=int,
+                        default=64)
+    parser.add_argument('-off', '--nha_offset',
+                        help="""Number of heavy atoms of the headpiece present in the products and not accounted by
+                        the headpiece_na parameter. If not passed it is computed from the headpiece smiles.""",
+                        type=int,
+                        default=None)
+    parser.add_argument('-v', '--verbose',
+                        help="""When invoked the script will provide additional information in the standart output.""",
+                        action='store_true')
+    args = parser.parse_args()
+    assert os.path.isdir(args.enumeration_folder), f'{args.enumeration_folder} does not exist'
+    if args.parfolder is not None:
+        assert os.path.isdir(args.parfolder), f'{args.parfolder} does not exist'
+    return args
+
+
+def get_context(enumeration_folder, parfolder):
+    """gets the libDESIGN and the parameters of an enumeration from the structure of the enumeration folder
+    enumeration_folder: str: path to the enumeration folder
+    parfolder: str or None: folder containing the parameters (used when the enumeration is not from eDESIGNER)
+    returns: tuple: instance of LibDesign class or None, instances of Parameters class (par and deprotection) or None"""
+    enumeration_folder = os.path.abspath(enumeration_folder)
+    bwfolder, enum_id = os.path.split(enumeration_folder)
+    ed_run_folder = os.path.dirname(bwfolder)
+    results_folder = os.path.join(ed_run_folder, 'results')
+    lib = None
+    if enum_id.startswith('EN') and not enum_id.startswith('ENUSER_') and \
+            any([os.path.isfile(os.path.join(results_folder, file)) for file in [STORE_FILE, PICKLE_FILE]]):
+        lib = load_libdesigns(results_folder).get(int(enum_id[2:].split('_')[0]))
+        parfolder = os.path.join(os.path.dirname(ed_run_folder), 'resources')
+    if parfolder is None:
+        return lib, None, None
+    par = Parameters(os.path.join(parfolder, 'par.par'), fsource='dict', how='to_dict', multiple=False)
+    deprotection = Parameters(os.path.join(parfolder, 'deprotection.par'), fsource='list', how='to_list', multiple=True)
+    return lib, par, deprotection
+
+
+def main():
+    """
+    runs the quality check of an enumeration
+    returns: None
+    """
+    args = parse_args()
+    lib, par, deprotection = get_context(args.enumeration_folder, args.parfolder)
+    if par is None:
+        print('INFO::: parameters not available, the distribution of heavy atoms will not be predicted')
+    qa = ProductQA(os.path.abspath(args.enumeration_folder), lib=lib, par=par, deprotection=deprotection,
+                   cores=args.cores, n_partitions=args.n_partitions, nha_offset=args.nha_offset, verbose=args.verbose)
+    report = qa.run()
+    print(f'INFO::: {report["n_products"]} products checked ({report["n_textually_unique_smiles"]} unique smiles, '
+          f'{report["n_textual_duplicate_products"]} textual duplicates, {report["n_parse_failures"]} parse failures)')
+    if report['prediction'] is not None:
+        print(f'INFO::: total variation distance to the predicted heavy atom distribution: '
+              f'{report["prediction"]["total_variation_distance"]}')
+
+
+if __name__ == '__main__':
+    print(__version__)
+    print(__author__)
+    main()
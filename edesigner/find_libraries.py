@@ -5,10 +5,11 @@
 
 import os
 from classes.libdesign import LibDesign
-import _pickle as pic
+from classes.libdesign_store import load_libdesigns
+from classes.lib_index import load_lib_index
 from classes.parameter_reader import Parameters
+from classes.bbt_store import load_bbts
 import argparse
-import copy
 
 __author__ = 'Alfredo Martin 2023'
 __version__ = 'find_libraries.v.12.0.0'
@@ -17,7 +18,9 @@ __version__ = 'find_libraries.v.12.0.0'
 def parse_args():
     # Arg parser
     parser = argparse.ArgumentParser(description="""finds all libraries containing one or more reactions and / or 
-    deprotections. Alternatively searches for a library with a specific design id.""")
+    deprotections. Alternatively searches for a library with a specific design id. Libraries are found with an inverted 
+    index of reactions and deprotections (built the first time the eDESIGNER run is searched) and they are reported by 
+    decreasing number of compounds.""")
     parser.add_argument('-wF', '--wfolder',
                         help="""Working Folder""",
                         type=str,
@@ -42,6 +45,34 @@ def parse_args():
                         deprotection repeated as many times as entered.""",
                         type=int,
                         action='append')
+    parser.add_argument('-ro', '--any_reaction',
+                        help="""index of a reaction. You can repeat this argument. At least one of these reactions 
+                        would be required.""",
+                        type=int,
+                        action='append')
+    parser.add_argument('-do', '--any_deprotection',
+                        help="""index of a deprotection. You can repeat this argument. At least one of these 
+                        deprotections would be required.""",
+                        type=int,
+                        action='append')
+    parser.add_argument('-nr', '--not_reaction',
+                        help="""index of an excluded reaction. You can repeat this argument. Libraries containing any 
+                        of these reactions are not reported.""",
+                        type=int,
+                        action='append')
+    parser.add_argument('-nd', '--not_deprotection',
+                        help="""index of an excluded deprotection. You can repeat this argument. Libraries containing 
+                        any of these deprotections are not reported.""",
+                        type=int,
+                        action='append')
+    parser.add_argument('-min', '--min_n_all',
+                        help="""minimum number of compounds of the library""",
+                        type=int,
+                        default=None)
+    parser.add_argument('-max', '--max_n_all',
+                        help="""maximum number of compounds of the library""",
+                        type=int,
+                        default=None)
     parser.add_argument('-lid', '--lib_id',
                         help="""library_id (numbers separated by underscores). It overrides --reactions and 
                         --deprotections.""",
@@ -77,71 +108,43 @@ def print_design(design, enum_reaction, enum_deprotection):
 def main():
     args = parse_args()
     PARFOLDER = os.path.join(args.wfolder, args.run_id, 'resources')
-    bbts_file = os.path.join(args.wfolder, args.run_id, 'results', 'BBTs.pic')
-    libdesigns_file = os.path.join(args.wfolder, args.run_id, args.ed_run_id, 'results', 'libDESIGNs.pic')
     multireaction = Parameters(os.path.join(PARFOLDER, 'multireaction.par'), fsource='list', how='to_list', multiple=True)
     preparations = Parameters(os.path.join(PARFOLDER, 'preparations.par'), fsource='list', how='to_list', multiple=True)
     enum_deprotection = Parameters(os.path.join(PARFOLDER, 'enum_deprotection.par'), fsource='list', how='to_list', multiple=True)
     enum_reaction = Parameters(os.path.join(PARFOLDER, 'enum_reaction.par'), fsource='list', how='to_list',multiple=True)
     headpieces = Parameters(os.path.join(PARFOLDER, 'headpieces.par'), fsource='list', how='to_list', multiple=True)
-    with open(bbts_file, 'rb') as f:
-        BBTs = pic.load(f)
+    BBTs = load_bbts(os.path.join(args.wfolder, args.run_id, 'results'))
     headpieces_dict = {}
     for headpiece in headpieces.par:
         headpieces_dict[[BBT.BBT for BBT in BBTs].index(headpiece['bbt'])] = headpiece['smiles']
-    designs = []
-    with open(libdesigns_file, 'rb') as f:
-        while True:
-            try:
-                design = pic.load(f)
-                designs.append(design)
-            except:
-                break
+    designs = load_libdesigns(os.path.join(args.wfolder, args.run_id, args.ed_run_id, 'results'))
     # search for lib_idx
-    if args.lib_idx is not None and args.lib_idx < len(designs) and designs[args.lib_idx].id == args.lib_idx:
-        print_design(designs[args.lib_idx], enum_reaction, enum_deprotection)
-        return
-    elif args.lib_idx is not None and args.lib_idx >= len(designs):
-        print(f"ERROR::: --lib_idx {args.lib_idx} is out of range")
-        return
-    elif args.lib_idx is not None and designs[args.lib_idx].id != args.lib_idx:
-        print(f"ERROR::: --lib_idx {args.lib_idx} does not match library id")
+    if args.lib_idx is not None:
+        design = designs.get(args.lib_idx)
+        if design is None:
+            print(f"ERROR::: --lib_idx {args.lib_idx} is out of range")
+        else:
+            print_design(design, enum_reaction, enum_deprotection)
         return
     #search for lib_id
     if args.lib_id is not None:
-        for design in designs:
-            if args.lib_id == design.lib_id:
-                print_design(design, enum_reaction, enum_deprotection)
-                break
-        else:
+        design = designs.get_by_lib_id(args.lib_id)
+        if design is None:
             print(f"ERROR::: --lib_id {args.lib_id} not found")
+        else:
+            print_design(design, enum_reaction, enum_deprotection)
         return
     # search for reactions and deprotections ocurrence
-    counter = 0
-    for design in designs:
-        reactions = copy.deepcopy(design.reactions)
-        deprotections = copy.deepcopy(design.deprotections)
-        keep = True
-        if args.reaction is not None:
-            for reaction in args.reaction:
-                if reaction in reactions:
-                    reactions.pop(reactions.index(reaction))
-                else:
-                    keep = False
-                    break
-        if args.deprotection is not None and keep:
-            for deprotection in args.deprotection:
-                if deprotection in deprotections:
-                    deprotections.pop(deprotections.index(deprotection))
-                else:
-                    keep = False
-                    break
-        if keep:
-            counter += 1
-        if args.n_libraries > 0 and counter > args.n_libraries:
-            keep = False
-        if keep:
-            print_design(design, enum_reaction, enum_deprotection)
+    index = load_lib_index(os.path.join(args.wfolder, args.run_id, args.ed_run_id, 'results'), designs)
+    lib_idxs = index.query(reactions=args.reaction, deprotections=args.deprotection,
+                           any_reactions=args.any_reaction, any_deprotections=args.any_deprotection,
+                           not_reactions=args.not_reaction, not_deprotections=args.not_deprotection,
+                           min_n_all=args.min_n_all, max_n_all=args.max_n_all)
+    print(f'INFO::: {len(lib_idxs)} libraries found')
+    if args.n_libraries > 0:
+        lib_idxs = lib_idxs[:args.n_libraries]
+    for lib_idx in lib_idxs:
+        print_design(designs.get(int(lib_idx)), enum_reaction, enum_deprotection)
 
 if __name__ == '__main__':
     print(__version__)
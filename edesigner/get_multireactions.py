@@ -6,12 +6,13 @@
 import os
 import sys
 from classes.libdesign import LibDesign
-from classes.enumerator import Enumerator
-from tqdm import tqdm
-import _pickle as pic
+from classes.libdesign_store import load_libdesigns
 from classes.parameter_reader import Parameters
+from classes.bbt_store import load_bbts
 import argparse
-import copy
+from types import SimpleNamespace
+from multiprocessing import Pool
+from multiprocessing import cpu_count
 
 __author__ = 'Alfredo Martin 2023'
 __version__ = 'get_multireactions.v.12.0.0'
@@ -134,6 +135,70 @@ class MultiReactionFinder:
         return c_nodes, c_s_reactions
 
 
+def topology_signature(n_cycles, lib_id):
+    """gets the part of the lib_id that determines the sub-syntheses of a libDESIGN (number of cycles, deprotections,
+    reactions and topology, i.e. the lib_id without the headpiece)
+    n_cycles: int: number of cycles of the libDESIGN
+    lib_id: tuple of int
+    returns: tuple: n_cycles and the topology part of the lib_id"""
+    return n_cycles, tuple(lib_id[:1 + 4 * n_cycles])
+
+
+def find_sub_syntheses(signature):
+    """finds the sub-syntheses (sequences of reactions with the leading deprotections removed) of a topology
+    signature: tuple: see topology_signature
+    returns: list of tuples of str"""
+    n_cycles, lib_id = signature
+    finder = MultiReactionFinder(SimpleNamespace(n_cycles=n_cycles, lib_id=lib_id))
+    _, this_sub_synthesis_list = finder.find_s_reactions_and_nodes()
+    sub_syntheses = []
+    for item in this_sub_synthesis_list:
+        while True:
+            if len(item) == 0:
+                print(f'ERROR::: found a multireaction containing only deprotections {this_sub_synthesis_list}')
+                break
+            if item[0].startswith('d'):
+                item.pop(0)
+            else:
+                sub_syntheses.append(tuple(item))
+                break
+    return sub_syntheses
+
+
+def design_sub_syntheses(designs, cores=1, verbose=False):
+    """finds the sub-syntheses of each libDESIGN. Libraries sharing the topology share the sub-syntheses, so each
+    distinct topology is analysed once
+    designs: instance of LibDesignStore or PickledLibDesigns class (see load_libdesigns)
+    cores: int: number of workers
+    verbose: bool: prints additional information
+    returns: tuple: list of tuples (lib_idx, topology signature) in the order of the libDESIGNs and dict of topology
+        signature: list of sub-syntheses"""
+    design_signatures = [(lib_idx, topology_signature(n_cycles, lib_id))
+                         for lib_idx, n_cycles, lib_id in designs.lib_ids()]
+    signatures = list(dict.fromkeys([signature for _, signature in design_signatures]))
+    from tqdm import tqdm
+    with Pool(max(min(cores, len(signatures)), 1)) as pool:
+        sub_syntheses = dict(zip(signatures, tqdm(pool.imap(find_sub_syntheses, signatures, chunksize=64),
+                                                  total=len(signatures))))
+    if verbose:
+        print(f'INFO::: {len(design_signatures)} libDESIGNs share {len(signatures)} topologies')
+    return design_signatures, sub_syntheses
+
+
+def first_designs(design_signatures, sub_syntheses):
+    """finds the first libDESIGN containing each sub-synthesis
+    design_signatures: list of tuples: lib_idx and topology signature of each libDESIGN (see design_sub_syntheses)
+    sub_syntheses: dict: topology signature: list of sub-syntheses
+    returns: dict: sub-synthesis: lib_idx of the first libDESIGN containing it (in the order the sub-syntheses are
+        first found)"""
+    first_design = {}
+    for lib_idx, signature in design_signatures:
+        for item in sub_syntheses[signature]:
+            if item not in first_design:
+                first_design[item] = lib_idx
+    return first_design
+
+
 def parse_args():
     # Arg parser
     parser = argparse.ArgumentParser(description="""finds all the multireacion sequences generated by an eDESIGNER run 
@@ -152,6 +217,10 @@ def parse_args():
                         help="""name of the eDESIGNER run""",
                         type=str,
                         default=None)
+    parser.add_argument('-c', '--cores',
+                        help="""Number of workers used to analyse the distinct topologies. Default: -1 (all cores)""",
+                        type=int,
+                        default=-1)
     parser.add_argument('-v', '--verbose',
                         help="""verbose output""",
                         action='store_true')
@@ -166,8 +235,6 @@ def parse_args():
 def main():
     args = parse_args()
     PARFOLDER = os.path.join(args.wfolder, args.run_id, 'resources')
-    bbts_file = os.path.join(args.wfolder, args.run_id, 'results', 'BBTs.pic')
-    libdesigns_file = os.path.join(args.wfolder, args.run_id, args.ed_run_id, 'results', 'libDESIGNs.pic')
     multireaction = Parameters(os.path.join(PARFOLDER, 'multireaction.par'),
                                fsource='list', how='to_list', multiple=True)
     preparations = Parameters(os.path.join(PARFOLDER, 'preparations.par'),
@@ -178,47 +245,26 @@ def main():
                                fsource='list', how='to_list',multiple=True)
     headpieces = Parameters(os.path.join(PARFOLDER, 'headpieces.par'),
                             fsource='list', how='to_list', multiple=True)
-    with open(bbts_file, 'rb') as f:
-        BBTs = pic.load(f)
+    BBTs = load_bbts(os.path.join(args.wfolder, args.run_id, 'results'))
     headpieces_dict = {}
     for headpiece in headpieces.par:
         headpieces_dict[[BBT.BBT for BBT in BBTs].index(headpiece['bbt'])] = headpiece['smiles']
-    designs = []
-    with open(libdesigns_file, 'rb') as f:
-        while True:
-            try:
-                design = pic.load(f)
-                designs.append(design)
-            except:
-                break
-    sub_synthesis_list = []
-    design_idx_list = []
-    for design in tqdm(designs):
-        finder = MultiReactionFinder(design, verbose=args.verbose)
-        _, this_sub_synthesis_list = finder.find_s_reactions_and_nodes()
-
-        for item in this_sub_synthesis_list:
-            while True:
-                if len(item) == 0:
-                    print(f'ERROR::: found a multireaction containing only deprotections {this_sub_synthesis_list}')
-                    break
-                if item[0].startswith('d'):
-                    item.pop(0)
-                else:
-                    if tuple(item) not in sub_synthesis_list:
-                        sub_synthesis_list.append(tuple(item))
-                        design_idx_list.append(design.id)
-                    break
+    designs = load_libdesigns(os.path.join(args.wfolder, args.run_id, args.ed_run_id, 'results'))
+    cores = cpu_count() if args.cores == -1 else args.cores
+    design_signatures, sub_syntheses = design_sub_syntheses(designs, cores=cores, verbose=args.verbose)
+    first_design = first_designs(design_signatures, sub_syntheses)
+    sub_synthesis_list = list(first_design.keys())
+    design_idx_list = list(first_design.values())
     if args.verbose:
         print()
         print('Not_found_multireacton : design_idx (Code these before enumerating the associaed designs)')
-    not_found = []
-    mrd_list = []
+    not_found = set()
+    mrd_set = set()
     for mrd in multireaction.par:  # mrd is the multi-reaction dictionary that matches the esr
-        mrd_list.append(tuple(mrd['s_reactions']))
+        mrd_set.add(tuple(mrd['s_reactions']))
     for item, design_idx in zip(sub_synthesis_list, design_idx_list):
-        if item not in mrd_list:
-            not_found.append(item)
+        if item not in mrd_set:
+            not_found.add(item)
             if args.verbose:
                 print(';'.join(list(item)), ':', design_idx)
     if args.verbose and len(not_found) == 0:
@@ -234,6 +280,15 @@ def main():
                 f.write(';'.join(list(item)) + ',' + str(design_idx) + ',' + 'TRUE\n')
     print(f' multireaction_report: {out_file}')
 
+    out_file = os.path.join(args.wfolder, args.run_id, args.ed_run_id, 'results', 'design_multireaction_report.csv')
+    with open(out_file, 'w') as f:
+        f.write('design_idx,multireactions,found\n')
+        for lib_idx, signature in design_signatures:
+            items = sub_syntheses[signature]
+            found = 'FALSE' if any([item in not_found for item in items]) else 'TRUE'
+            f.write(str(lib_idx) + ',' + '|'.join([';'.join(list(item)) for item in items]) + ',' + found + '\n')
+    print(f' design multireaction report: {out_file}')
+
     if args.verbose:
         print()
         print('Recommended test set of desings indexes for enumeration:')
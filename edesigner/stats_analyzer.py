@@ -6,16 +6,19 @@ __version__ = 'stats_analyzer.v.12.0.0'
 __author__ = 'Alfredo Martin 2023'
 
 import os
-from tqdm import tqdm
-import _pickle as pic
+import time
 from classes.parameter_reader import Parameters
+from classes.bbt_store import load_bbts
+from classes.libdesign_store import load_libdesigns
+from classes.usage_stats import usage_stats
 import argparse
-import pandas as pd
 
 
 def parse_args():
     # Arg parser
-    parser = argparse.ArgumentParser(description="""writes statistics of usage for bbts, reactons and deprotections""")
+    parser = argparse.ArgumentParser(description="""writes statistics of usage for bbts, reactons and deprotections. 
+    The statistics are computed in a single streaming pass over the libDESIGNs (partitions of the libDESIGN store are 
+    reduced in parallel). Optionally the reaction x reaction and BBT x cycle co-occurrence matrices are written""")
     parser.add_argument('-wF', '--wfolder',
                         help="""Working Folder""",
                         type=str,
@@ -28,6 +31,17 @@ def parse_args():
                         help="""name of the eDESIGNER run""",
                         type=str,
                         default=None)
+    parser.add_argument('-w', '--weighted',
+                        help="""When invoked each library counts as many times as its number of compounds (n_all)""",
+                        action='store_true')
+    parser.add_argument('-co', '--cooccurrence',
+                        help="""When invoked the reaction x reaction (number of libraries containing both reactions) 
+                        and BBT x cycle co-occurrence matrices are also written""",
+                        action='store_true')
+    parser.add_argument('-c', '--cores',
+                        help="""Number of workers. Default: -1 (all cores)""",
+                        type=int,
+                        default=-1)
     parser.add_argument('-v', '--verbose',
                         help="""verbose output""",
                         action='store_true')
@@ -41,34 +55,29 @@ def parse_args():
 def main():
     args = parse_args()
     PARFOLDER = os.path.join(args.wfolder, args.run_id, 'resources')
-    libdesigns_file = os.path.join(args.wfolder, args.run_id, args.ed_run_id, 'results', 'libDESIGNs.pic')
     enum_deprotection = Parameters(os.path.join(PARFOLDER, 'enum_deprotection.par'),
                                    fsource='list', how='to_list', multiple=True)
     enum_reaction = Parameters(os.path.join(PARFOLDER, 'enum_reaction.par'),
                                fsource='list', how='to_list',multiple=True)
-    bbts_file = os.path.join(args.wfolder, args.run_id, 'results', 'BBTs.pic')
-    with open(bbts_file, 'rb') as f:
-        BBTs = pic.load(f)
-    designs = []
-    with open(libdesigns_file, 'rb') as f:
-        while True:
-            try:
-                design = pic.load(f)
-                designs.append(design)
-            except:
-                break
-    reaction_usage=[{'name': rxn['enum_name'], 'usage': 0} for rxn in enum_reaction.par]
-    deprotection_usage=[{'name': rxn['enum_name'], 'usage': 0} for rxn in enum_reaction.par]
-    bbts_usage=[{'name': ':'.join(bbt.BBT_name), 'usage': 0} for bbt in BBTs]
-    for design in tqdm(designs):
-        for idx in design.reactions:
-            reaction_usage[idx]['usage'] += 1
-        for idx in design.deprotections:
-            if idx != 0:
-                deprotection_usage[idx]['usage'] += 1
-        for item in design.bbts:
-            for idx in item:
-                bbts_usage[idx]['usage'] += 1
+    par = Parameters(os.path.join(PARFOLDER, 'par.par'), fsource='dict', how='to_dict', multiple=False)
+    BBTs = load_bbts(os.path.join(args.wfolder, args.run_id, 'results'))
+    designs = load_libdesigns(os.path.join(args.wfolder, args.run_id, args.ed_run_id, 'results'))
+    reaction_names = [rxn['enum_name'] for rxn in enum_reaction.par]
+    bbt_names = [':'.join(bbt.BBT_name) for bbt in BBTs]
+    sizes = {'n_reactions': len(enum_reaction.par), 'n_deprotections': len(enum_deprotection.par),
+             'n_bbts': len(bbt_names), 'n_cycles': len(par.par['max_cycle_na'])}
+    tic = time.time()
+    usage = usage_stats(designs, sizes, weighted=args.weighted, cooccurrence=args.cooccurrence, cores=args.cores,
+                        verbose=args.verbose)
+    if args.verbose:
+        print(f'INFO::: usage computed in {round(time.time() - tic, 2)} seconds')
+    import pandas as pd  # imported after the arguments are parsed so -h and argument errors are fast
+    if not args.weighted:
+        usage = {key: value.astype('int64') for key, value in usage.items()}
+    reaction_usage = [{'name': name, 'usage': usage['reactions'][i]} for i, name in enumerate(reaction_names)]
+    deprotection_usage = [{'name': depr['enum_name'], 'usage': usage['deprotections'][i]}
+                          for i, depr in enumerate(enum_deprotection.par)]
+    bbts_usage = [{'name': name, 'usage': usage['bbts'][i]} for i, name in enumerate(bbt_names)]
     df = pd.DataFrame(reaction_usage)
     df.to_csv(os.path.join(args.wfolder, args.run_id, args.ed_run_id, 'results', 'rxn_usage_report.csv'), index=False)
     print(f"rxn usage report: {os.path.join(args.wfolder, args.run_id, args.ed_run_id, 'results', 'rxn_usage_report.csv')}")
@@ -78,6 +87,14 @@ def main():
     df = pd.DataFrame(bbts_usage)
     df.to_csv(os.path.join(args.wfolder, args.run_id, args.ed_run_id, 'results', 'bbt_usage_report.csv'), index=False)
     print(f"bbt usage report: {os.path.join(args.wfolder, args.run_id, args.ed_run_id, 'results', 'bbt_usage_report.csv')}")
+    if args.cooccurrence:
+        df = pd.DataFrame(usage['reaction_reaction'], index=reaction_names, columns=reaction_names)
+        df.to_csv(os.path.join(args.wfolder, args.run_id, args.ed_run_id, 'results', 'rxn_cooccurrence_report.csv'))
+        print(f"rxn co-occurrence report: {os.path.join(args.wfolder, args.run_id, args.ed_run_id, 'results', 'rxn_cooccurrence_report.csv')}")
+        df = pd.DataFrame(usage['bbt_cycle'], index=bbt_names,
+                          columns=[f'cycle_{i + 1}' for i in range(sizes['n_cycles'])])
+        df.to_csv(os.path.join(args.wfolder, args.run_id, args.ed_run_id, 'results', 'bbt_cycle_report.csv'))
+        print(f"bbt cycle report: {os.path.join(args.wfolder, args.run_id, args.ed_run_id, 'results', 'bbt_cycle_report.csv')}")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+# benchmark_imports.v.12.0.0
+# Jose Alfredo Martin 2023
+
+__version__ = 'benchmark_imports.v.12.0.0'
+__author__ = 'Alfredo Martin 2023'
+
+# Python modules
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+SCRIPTS = ['expander', 'find_libraries', 'get_multireactions', 'enumerate_library', 'enumeration_qa', 'stats_analyzer',
+           'e_designer', 'e_bbt_creator', 'edesigner_server']
+HEAVY = ['pandas', 'numpy', 'tqdm', 'scipy']
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="""Measures the cold start of the eDESIGNER scripts: the time needed to
+    import each script in a fresh interpreter (best of several runs) and the heavy modules (pandas, numpy, tqdm)
+    imported at start together with their cumulative import time (python -X importtime).
+        """)
+    parser.add_argument('-s', '--scripts',
+                        help="""scripts to benchmark (module names without .py). Default: all the entry scripts""",
+                        type=str,
+                        nargs='+',
+                        default=SCRIPTS)
+    parser.add_argument('-r', '--repeats',
+                        help="""Number of runs per script. Default: 5""",
+                        type=int,
+                        default=5)
+    parser.add_argument('-o', '--out_file',
+                        help="""tsv file where the results are written. Default: None (not written)""",
+                        type=str,
+                        default=None)
+    return parser.parse_args()
+
+
+def import_profile(script, folder):
+    """imports a script in a fresh interpreter with -X importtime
+    script: str: module name
+    folder: str: folder containing the scripts (edesigner folder)
+    returns: tuple: wall time in seconds and dict of cumulative import time (seconds) of the heavy modules imported"""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([folder, os.path.join(folder, 'classes'), env.get('PYTHONPATH', '')])
+    tic = time.time()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {script}'], cwd=folder, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    seconds = time.time() - tic
+    if result.returncode != 0:
+        print(f'ERROR::: {script} could not be imported')
+        print(result.stderr.strip().split('\n')[-1])
+        return seconds, None
+    heavy = {}
+    for line in result.stderr.split('\n'):
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        fields = [field.strip() for field in line[len('import time:'):].split('|')]
+        if fields[2] in HEAVY:
+            heavy[fields[2]] = int(fields[1]) / 1e6
+    return seconds, heavy
+
+
+def main():
+    args = parse_args()
+    folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    rows = []
+    for script in args.scripts:
+        runs = [import_profile(script, folder) for _ in range(args.repeats)]
+        if any([heavy is None for _, heavy in runs]):
+            continue
+        best = min([seconds for seconds, _ in runs])
+        heavy = runs[-1][1]
+        rows.append([script, round(best, 3), ','.join([f'{name}:{round(value, 3)}' for name, value in heavy.items()])])
+        print(f'{script:<20} {rows[-1][1]:>7} s   heavy imports: {rows[-1][2] if len(heavy) > 0 else "none"}')
+    if args.out_file is not None:
+        with open(args.out_file, 'w') as f:
+            f.write('script\tseconds\theavy_imports\n')
+            for row in rows:
+                f.write('\t'.join([str(item) for item in row]) + '\n')
+
+
+if __name__ == '__main__':
+    print(__version__)
+    print(__author__)
+    main()
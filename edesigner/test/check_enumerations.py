@@ -8,12 +8,18 @@ __author__ = 'Alfredo Martin 20203'
 # Python modules
 import os
 import argparse
+import time
+from multiprocessing import Pool
+from multiprocessing import cpu_count
 from tqdm import tqdm
+# Local modules
+from classes.smi_io import find_smi, count_lines
 
 
 def parse_args():
-    parser = argparse.ArgumentParser(description="""Checks for quality of enumerations by ensuring that all the 
-    compounds have been enumerated
+    parser = argparse.ArgumentParser(description="""Checks for quality of enumerations by ensuring that all the
+    compounds have been enumerated. Enumeration folders are checked in parallel and a table with the expected and
+    actual number of compounds of each folder is written in enumeration_check.tsv
         """)
     parser.add_argument('-eF', '--enumeration_folder',
                         help="""folder where the enumerations are stored""",
@@ -23,6 +29,10 @@ def parse_args():
                         help="""folder where the output files will be stored""",
                         type=str,
                         required=True)
+    parser.add_argument('-c', '--cores',
+                        help="""Number of enumeration folders checked in parallel. Default: -1 (all cores)""",
+                        type=int,
+                        default=-1)
     parser.add_argument('-v', '--verbose',
                         help="""When invoked additional information is printed in the console.""",
                         action='store_true')
@@ -32,31 +42,74 @@ def parse_args():
     return args
 
 
+def check_folder(enumeration_folder, folder):
+    """checks that an enumeration folder contains all the compounds of the library (the product of the number of
+    building blocks of each node)
+    enumeration_folder: str: folder where the enumerations are stored
+    folder: str: name of the enumeration folder
+    returns: dict: folder, status (ok, incomplete or failed), expected and actual number of compounds, seconds and
+        reason of the failure"""
+    tic = time.time()
+    path = os.path.join(enumeration_folder, folder)
+    result = {'folder': folder, 'status': 'failed', 'expected': None, 'actual': None, 'seconds': None, 'reason': ''}
+    try:
+        enumeration_file = find_smi(os.path.join(path, 'enumeration.smi'))
+        if enumeration_file is None:
+            if os.path.isfile(os.path.join(path, 'error.txt')):
+                with open(os.path.join(path, 'error.txt'), 'r') as f:
+                    result['reason'] = f.readline().strip()
+            else:
+                result['reason'] = 'enumeration file not found'
+        else:
+            ncomps = 1
+            for file in os.listdir(path):
+                if file.startswith('R0'):
+                    ncomps *= count_lines(os.path.join(path, file))
+            result['expected'] = ncomps
+            result['actual'] = count_lines(enumeration_file)
+            if result['expected'] == result['actual']:
+                result['status'] = 'ok'
+            else:
+                result['status'] = 'incomplete'
+                result['reason'] = f'{result["expected"] - result["actual"]} compounds missing'
+    except OSError as e:
+        result['reason'] = f'{type(e).__name__}: {e}'
+    result['seconds'] = round(time.time() - tic, 3)
+    return result
+
+
+def _starred_check_folder(job):
+    return check_folder(*job)
+
+
 def main():
     args = parse_args()
-    dirlist = os.listdir(args.enumeration_folder)
-    failed = []
-    incomplete = []
-    for folder in tqdm(dirlist):
-        file_list = os.listdir(os.path.join(args.enumeration_folder, folder))
-        if not 'enumeration.smi' in file_list:
-            failed.append(folder)
-            continue
-        file_list = [os.path.join(args.enumeration_folder, folder, file) for file in file_list if file.startswith('R0')]
-        ncomps = 1
-        for file in file_list:
-            with open(file, 'r') as f:
-                ncomps *= len(f.readlines())
-        with open(os.path.join(args.enumeration_folder, folder, 'enumeration.smi'), 'r') as f:
-            enum_comps = len(f.readlines())
-        if ncomps != enum_comps:
-            incomplete.append(folder)
+    dirlist = [folder for folder in os.listdir(args.enumeration_folder)
+               if folder.startswith('EN') and os.path.isdir(os.path.join(args.enumeration_folder, folder))]
+    cores = cpu_count() if args.cores == -1 else args.cores
+    jobs = [(args.enumeration_folder, folder) for folder in dirlist]
+    with Pool(max(min(cores, len(jobs)), 1)) as pool:
+        results = list(tqdm(pool.imap_unordered(_starred_check_folder, jobs), total=len(jobs)))
+    results.sort(key=lambda item: item['folder'])
+    failed = [item['folder'] for item in results if item['status'] == 'failed']
+    incomplete = [item['folder'] for item in results if item['status'] == 'incomplete']
+    with open(os.path.join(args.out_folder, 'enumeration_check.tsv'), 'w') as f:
+        f.write('\t'.join(['folder', 'status', 'expected', 'actual', 'seconds', 'reason']) + '\n')
+        for item in results:
+            f.write('\t'.join(['' if item[key] is None else str(item[key])
+                               for key in ['folder', 'status', 'expected', 'actual', 'seconds', 'reason']]) + '\n')
     with open(os.path.join(args.out_folder, 'enum_failed'), 'w') as f:
         for line in failed:
             f.write(line + '\n')
     with open(os.path.join(args.out_folder, 'enum_incomplete'), 'w') as f:
         for line in incomplete:
             f.write(line + '\n')
+    print(f'INFO::: {len(results)} enumerations checked: {len(results) - len(failed) - len(incomplete)} ok, '
+          f'{len(incomplete)} incomplete, {len(failed)} failed')
+    if args.verbose:
+        for item in results:
+            if item['status'] != 'ok':
+                print(f'    {item["folder"]}: {item["status"]} ({item["reason"]})')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,7 @@
+#!/bin/bash
+
+# unit tests that do not need LillyMol nor the test databases (each one works in its own temporary folder)
+current=$(cd "$(dirname "$0")" && pwd)
+export PYTHONPATH=${current}/..:${current}/../classes:${current}:${PYTHONPATH}
+cd ${current}
+python -m unittest -v test_synth_graph test_libdesign_store test_lib_index test_usage_stats test_parameter_reader test_logger test_run_state test_smi_io test_product_qa test_get_multireactions
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+# synthetic_libs
+# Jose Alfredo Martin 2023
+
+__version__ = 'synthetic_libs.v.12.0.0'
+__author__ = 'Alfredo Martin 2023'
+
+# Python modules
+import random
+from types import SimpleNamespace
+# Local modules
+from classes.libdesign import LibDesign
+
+
+def make_libs(n_libs, n_cycles=3, n_reactions=12, n_deprotections=6, n_bbts=20, seed=0):
+    """creates random libDESIGNs for the unit tests (only the attributes used by the stores, the index, the
+    statistics and the multireaction analysis are filled). The lib_ids follow the layout of LibDesign. Reactions and deprotections are drawn with replacement so they can be repeated, and the
+    deprotection 0 (no deprotection) is frequent as in real runs
+    n_libs: int: number of libraries
+    n_cycles: int: maximum number of cycles
+    n_reactions: int: number of enumeration reactions
+    n_deprotections: int: number of enumeration deprotections (including 0)
+    n_bbts: int: number of BBTs
+    seed: int: seed of the random number generator
+    returns: list of instances of LibDesign class"""
+    rng = random.Random(seed)
+    par = SimpleNamespace(par={'max_cycle_na': [10] * n_cycles})
+    libs = []
+    lib_ids = set()
+    while len(libs) < n_libs:
+        lib = LibDesign(par)
+        lib.n_cycles = rng.randint(1, n_cycles)
+        lib.headpiece = rng.randrange(n_bbts)
+        lib.reactions = [rng.randrange(n_reactions) for _ in range(lib.n_cycles)]
+        lib.deprotections = [rng.choice([0, 0, rng.randrange(n_deprotections)]) for _ in range(lib.n_cycles)]
+        lib.bbts = [sorted(rng.sample(range(n_bbts), rng.randint(1, 3))) for _ in range(lib.n_cycles)]
+        # sources of each deprotection and cycle as in the lib_id of LibDesign (c0=0, d0=1, r1=2, c1=3...): the
+        # deprotection of cycle i is applied to anything obtained before it and the reaction joins cycle i + 1 to
+        # anything obtained before it, including that deprotection
+        deprotection_sources = [rng.randrange(3 * i + 1) for i in range(lib.n_cycles)]
+        cycle_sources = [rng.randrange(3 * i + 2) for i in range(lib.n_cycles)]
+        lib.lib_id = tuple([lib.n_cycles] + lib.deprotections + lib.reactions + deprotection_sources + cycle_sources +
+                           [lib.headpiece])
+        if lib.lib_id in lib_ids:
+            continue
+        lib_ids.add(lib.lib_id)
+        lib.id = len(libs)
+        lib.n_all = None if rng.random() < 0.05 else rng.randint(1, 10 ** 6)
+        libs.append(lib)
+    return libs
+
+
+if __name__ == '__main__':
+    print(__version__)
+    print(__author__)
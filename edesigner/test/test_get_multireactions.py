@@ -0,0 +1,68 @@
+import unittest
+import os
+import shutil
+import tempfile
+from classes.libdesign_store import save_libdesigns, load_libdesigns, STORE_FILE
+from get_multireactions import MultiReactionFinder, design_sub_syntheses, first_designs
+from synthetic_libs import make_libs
+
+
+def old_sub_syntheses(design):
+    """sub-syntheses of a libDESIGN as found by the loop of get_multireactions before the topologies were memoized"""
+    sub_syntheses = []
+    finder = MultiReactionFinder(design)
+    _, this_sub_synthesis_list = finder.find_s_reactions_and_nodes()
+    for item in this_sub_synthesis_list:
+        while True:
+            if len(item) == 0:
+                break
+            if item[0].startswith('d'):
+                item.pop(0)
+            else:
+                sub_syntheses.append(tuple(item))
+                break
+    return sub_syntheses
+
+
+def old_report(designs):
+    """rows (sub-synthesis, design_idx) of full_multiereaction_report.csv as written by the loop of
+    get_multireactions before the topologies were memoized"""
+    sub_synthesis_list = []
+    design_idx_list = []
+    for design in designs:
+        for item in old_sub_syntheses(design):
+            if item not in sub_synthesis_list:
+                sub_synthesis_list.append(item)
+                design_idx_list.append(design.id)
+    return list(zip(sub_synthesis_list, design_idx_list))
+
+
+class MyTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.folder = tempfile.mkdtemp()
+        cls.libs = make_libs(700, seed=46)
+        save_libdesigns(cls.libs, os.path.join(cls.folder, STORE_FILE))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.folder)
+
+    def test_full_report(self):
+        for cores in [1, 3]:
+            design_signatures, sub_syntheses = design_sub_syntheses(load_libdesigns(self.folder), cores=cores)
+            # the topologies are shared, otherwise the memoization is not tested
+            self.assertLess(len(sub_syntheses), len(self.libs))
+            rows = list(first_designs(design_signatures, sub_syntheses).items())
+            self.assertEqual(rows, old_report(self.libs))
+
+    def test_design_report(self):
+        design_signatures, sub_syntheses = design_sub_syntheses(load_libdesigns(self.folder), cores=2)
+        self.assertEqual([lib_idx for lib_idx, _ in design_signatures], [lib.id for lib in self.libs])
+        for lib, (_, signature) in zip(self.libs, design_signatures):
+            self.assertEqual(sub_syntheses[signature], old_sub_syntheses(lib), lib.lib_id)
+
+
+if __name__ == '__main__':
+    unittest.main()
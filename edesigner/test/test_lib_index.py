@@ -0,0 +1,137 @@
+import unittest
+import os
+import time
+import copy
+import random
+import shutil
+import tempfile
+from classes.libdesign_store import save_libdesigns, load_libdesigns, STORE_FILE
+from classes.lib_index import LibIndex, load_lib_index, INDEX_FILE
+from synthetic_libs import make_libs
+
+
+def old_filter(designs, reactions, deprotections):
+    """filter of find_libraries before the index (every required reaction and deprotection is popped from a copy of the
+    lists of the library, so repeated ones must be present as many times as repeated)"""
+    found = []
+    for design in designs:
+        design_reactions = copy.deepcopy(design.reactions)
+        design_deprotections = copy.deepcopy(design.deprotections)
+        keep = True
+        if reactions is not None:
+            for reaction in reactions:
+                if reaction in design_reactions:
+                    design_reactions.pop(design_reactions.index(reaction))
+                else:
+                    keep = False
+                    break
+        if deprotections is not None and keep:
+            for deprotection in deprotections:
+                if deprotection in design_deprotections:
+                    design_deprotections.pop(design_deprotections.index(deprotection))
+                else:
+                    keep = False
+                    break
+        if keep:
+            found.append(design)
+    return found
+
+
+def n_all(lib):
+    return 0 if lib.n_all is None else lib.n_all
+
+
+class MyTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.folder = tempfile.mkdtemp()
+        cls.libs = make_libs(500, seed=44)
+        save_libdesigns(cls.libs, os.path.join(cls.folder, STORE_FILE))
+        cls.index = load_lib_index(cls.folder, load_libdesigns(cls.folder))
+        cls.rng = random.Random(44)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.folder)
+
+    def random_keys(self, n_keys, size):
+        return None if size == 0 else [self.rng.randrange(n_keys) for _ in range(size)]
+
+    def assertRanked(self, lib_idxs, expected):
+        """the ids must be the expected ones sorted by decreasing n_all (ties keep increasing id)"""
+        expected = sorted(expected, key=lambda lib: (-n_all(lib), lib.id))
+        self.assertEqual([int(lib_idx) for lib_idx in lib_idxs], [lib.id for lib in expected])
+
+    def test_multiset_query(self):
+        for _ in range(200):
+            reactions = self.random_keys(12, self.rng.randint(0, 3))
+            deprotections = self.random_keys(6, self.rng.randint(0, 2))
+            self.assertRanked(self.index.query(reactions=reactions, deprotections=deprotections),
+                              old_filter(self.libs, reactions, deprotections))
+
+    def test_repeated_reaction(self):
+        reaction = max(range(12), key=lambda key: sum([lib.reactions.count(key) >= 2 for lib in self.libs]))
+        lib_idxs = self.index.query(reactions=[reaction, reaction])
+        self.assertGreater(len(lib_idxs), 0)
+        self.assertRanked(lib_idxs, old_filter(self.libs, [reaction, reaction], None))
+        self.assertLess(len(lib_idxs), len(self.index.query(reactions=[reaction])))
+
+    def test_or_query(self):
+        for _ in range(100):
+            reactions = self.random_keys(12, self.rng.randint(0, 2))
+            any_reactions = self.random_keys(12, self.rng.randint(1, 3))
+            any_deprotections = self.random_keys(6, self.rng.randint(0, 2))
+            expected = [lib for lib in old_filter(self.libs, reactions, None)
+                        if any([key in lib.reactions for key in any_reactions])
+                        and (any_deprotections is None or any([key in lib.deprotections for key in any_deprotections]))]
+            self.assertRanked(self.index.query(reactions=reactions, any_reactions=any_reactions,
+                                               any_deprotections=any_deprotections), expected)
+
+    def test_not_query(self):
+        for _ in range(100):
+            reactions = self.random_keys(12, self.rng.randint(0, 2))
+            not_reactions = self.random_keys(12, self.rng.randint(1, 3))
+            not_deprotections = self.random_keys(6, self.rng.randint(0, 2))
+            expected = [lib for lib in old_filter(self.libs, reactions, None)
+                        if not any([key in lib.reactions for key in not_reactions])
+                        and not any([key in lib.deprotections for key in not_deprotections or []])]
+            self.assertRanked(self.index.query(reactions=reactions, not_reactions=not_reactions,
+                                               not_deprotections=not_deprotections), expected)
+
+    def test_n_all_range(self):
+        for _ in range(50):
+            min_n_all = self.rng.choice([None, self.rng.randint(0, 10 ** 6)])
+            max_n_all = self.rng.choice([None, self.rng.randint(0, 10 ** 6)])
+            reactions = self.random_keys(12, self.rng.randint(0, 1))
+            expected = [lib for lib in old_filter(self.libs, reactions, None)
+                        if (min_n_all is None or n_all(lib) >= min_n_all)
+                        and (max_n_all is None or n_all(lib) <= max_n_all)]
+            self.assertRanked(self.index.query(reactions=reactions, min_n_all=min_n_all, max_n_all=max_n_all),
+                              expected)
+
+    def test_missing_key(self):
+        self.assertEqual(len(self.index.query(reactions=[100])), 0)
+        self.assertEqual(len(self.index.query(not_reactions=[100])), len(self.libs))
+
+    def test_build_from_pickle_stream(self):
+        index = LibIndex.build(self.libs)
+        for _ in range(50):
+            reactions = self.random_keys(12, self.rng.randint(0, 3))
+            deprotections = self.random_keys(6, self.rng.randint(0, 2))
+            self.assertEqual(index.query(reactions=reactions, deprotections=deprotections).tolist(),
+                             self.index.query(reactions=reactions, deprotections=deprotections).tolist())
+
+    def test_index_rebuilt_when_stale(self):
+        folder = os.path.join(self.folder, 'stale')
+        os.mkdir(folder)
+        save_libdesigns(self.libs[:50], os.path.join(folder, STORE_FILE))
+        self.assertEqual(len(load_lib_index(folder, load_libdesigns(folder)).ids), 50)
+        self.assertTrue(os.path.isfile(os.path.join(folder, INDEX_FILE)))
+        time.sleep(0.01)
+        save_libdesigns(self.libs[:80], os.path.join(folder, STORE_FILE))
+        self.assertEqual(len(load_lib_index(folder, load_libdesigns(folder)).ids), 80)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import unittest
+import os
+import shutil
+import tempfile
+import _pickle as pic
+from classes.libdesign_store import save_libdesigns, load_libdesigns, LibDesignStore, PickledLibDesigns, STORE_FILE, \
+    PICKLE_FILE
+from synthetic_libs import make_libs
+
+
+def same_lib(lib1, lib2):
+    return (lib1.id, lib1.lib_id, lib1.n_cycles, lib1.headpiece, lib1.n_all, lib1.reactions, lib1.deprotections,
+            lib1.bbts) == (lib2.id, lib2.lib_id, lib2.n_cycles, lib2.headpiece, lib2.n_all, lib2.reactions,
+                           lib2.deprotections, lib2.bbts)
+
+
+class MyTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.folder = tempfile.mkdtemp()
+        cls.libs = make_libs(300, seed=43)
+        save_libdesigns(cls.libs, os.path.join(cls.folder, STORE_FILE))
+        # stream of pickled libDESIGNs as written by previous versions
+        os.mkdir(os.path.join(cls.folder, 'pickled'))
+        with open(os.path.join(cls.folder, 'pickled', PICKLE_FILE), 'wb') as f:
+            for lib in cls.libs:
+                pic.dump(lib, f)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.folder)
+
+    def test_load_libdesigns(self):
+        self.assertIsInstance(load_libdesigns(self.folder), LibDesignStore)
+        self.assertIsInstance(load_libdesigns(os.path.join(self.folder, 'pickled')), PickledLibDesigns)
+
+    def test_round_trip(self):
+        store = load_libdesigns(self.folder)
+        self.assertEqual(len(store), len(self.libs))
+        for lib, stored in zip(self.libs, store):
+            self.assertTrue(same_lib(lib, stored))
+
+    def test_get(self):
+        for designs in [load_libdesigns(self.folder), load_libdesigns(os.path.join(self.folder, 'pickled'))]:
+            for lib in self.libs[::17]:
+                self.assertTrue(same_lib(designs.get(lib.id), lib))
+            self.assertIsNone(designs.get(len(self.libs)))
+
+    def test_get_by_lib_id(self):
+        for designs in [load_libdesigns(self.folder), load_libdesigns(os.path.join(self.folder, 'pickled'))]:
+            for lib in self.libs[::17]:
+                self.assertTrue(same_lib(designs.get_by_lib_id(list(lib.lib_id)), lib))
+            self.assertIsNone(designs.get_by_lib_id((9, 9, 9)))
+
+    def test_lib_ids(self):
+        expected = [(lib.id, lib.n_cycles, lib.lib_id) for lib in self.libs]
+        self.assertEqual(list(load_libdesigns(self.folder).lib_ids()), expected)
+        self.assertEqual(list(load_libdesigns(os.path.join(self.folder, 'pickled')).lib_ids()), expected)
+
+    def test_indexed_lookups(self):
+        store = load_libdesigns(self.folder)
+        for key in range(12):
+            self.assertEqual(store.ids_with_reaction(key), [lib.id for lib in self.libs if key in lib.reactions])
+            self.assertEqual(store.ids_with_reaction(key, multiplicity=2),
+                             [lib.id for lib in self.libs if lib.reactions.count(key) >= 2])
+        for key in range(1, 6):
+            self.assertEqual(store.ids_with_deprotection(key),
+                             [lib.id for lib in self.libs if key in lib.deprotections])
+        for key in range(20):
+            self.assertEqual(store.ids_with_headpiece(key), [lib.id for lib in self.libs if lib.headpiece == key])
+            self.assertEqual(store.ids_with_bbt(key),
+                             [lib.id for lib in self.libs if any([key in item for item in lib.bbts])])
+
+    def test_pickle_store(self):
+        store = pic.loads(pic.dumps(load_libdesigns(self.folder)))
+        self.assertTrue(same_lib(store.get(5), self.libs[5]))
+
+    def test_overwrite(self):
+        filename = os.path.join(self.folder, 'overwritten.sqlite')
+        save_libdesigns(self.libs, filename)
+        save_libdesigns(self.libs[:10], filename)
+        self.assertEqual(len(LibDesignStore(filename)), 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
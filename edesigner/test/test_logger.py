@@ -0,0 +1,126 @@
+import unittest
+import os
+import sys
+import json
+import shutil
+import tempfile
+import subprocess
+from classes.logger import Logger, get_level
+from classes.parallel import starmap_parallel
+
+# script run in a new interpreter: it logs without closing the logger, so the messages are only written at exit
+AT_EXIT = """
+import sys
+from classes.logger import Logger
+from classes.parallel import starmap_parallel
+from test_logger import log_items
+log = Logger(sys.argv[1], flush_interval=0, buffer_size=1000, structured=True)
+for i in range(5):
+    log.update(f'INFO::: message {i}', to_screen=False)
+if sys.argv[2] == 'workers':
+    starmap_parallel(list(range(8)), log_items, cores=2, is_list=True, args=[log.worker_logger()])
+sys.exit(int(sys.argv[3]))
+"""
+
+
+def log_items(items, log):
+    """worker function: logs one message per item"""
+    for item in items:
+        log.update(f'INFO::: item {item}', to_screen=False, stage='workers', counters={'item': int(item)})
+    return items
+
+
+def read_lines(filename):
+    with open(filename, 'r') as f:
+        return f.read().splitlines()
+
+
+def read_records(filename):
+    return [json.loads(line) for line in read_lines(filename)]
+
+
+class MyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.filename = os.path.join(self.folder, 'test.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_get_level(self):
+        self.assertEqual(get_level('ERROR::: failed'), 'ERROR')
+        self.assertEqual(get_level('  WARNING::: lost compounds'), 'WARNING')
+        self.assertEqual(get_level('DEBUG::: x'), 'DEBUG')
+        self.assertEqual(get_level('no level ERROR::: here'), 'INFO')
+        self.assertEqual(get_level(''), 'INFO')
+
+    def test_buffer_and_flush_level(self):
+        log = Logger(self.filename, flush_interval=0, buffer_size=1000)
+        log.update('INFO::: buffered', to_screen=False)
+        self.assertEqual(len(read_lines(self.filename)), 1)
+        log.update('WARNING::: flushed', to_screen=False)
+        self.assertEqual(read_lines(self.filename)[1:], ['INFO::: buffered', 'WARNING::: flushed'])
+        log.close()
+
+    def test_buffer_size(self):
+        log = Logger(self.filename, flush_interval=0, buffer_size=3)
+        for i in range(7):
+            log.update(f'INFO::: {i}', to_screen=False)
+        self.assertEqual(len(read_lines(self.filename)), 1 + 6)
+        log.close()
+        self.assertEqual(len(read_lines(self.filename)), 1 + 7)
+
+    def test_verbosity_and_to_file(self):
+        log = Logger(self.filename, flush_interval=0, vl=2)
+        log.update('INFO::: hidden', to_screen=False, v=1)
+        log.update('INFO::: screen only', to_screen=False, to_file=False)
+        log.update('INFO::: shown', to_screen=False, v=3)
+        log.close()
+        self.assertEqual(read_lines(self.filename)[1:], ['INFO::: shown'])
+
+    def test_structured(self):
+        log = Logger(self.filename, flush_interval=0, structured=True)
+        log.update('INFO::: reading', to_screen=False, stage='read', counters={'n': 3})
+        log.update('ERROR::: failed', to_screen=False)
+        log.close()
+        records = read_records(os.path.join(self.folder, 'test.jsonl'))
+        self.assertEqual([(record['level'], record['stage'], record['counters']) for record in records],
+                         [('INFO', 'read', {'n': 3}), ('ERROR', 'read', None)])
+        self.assertEqual(records[0]['pid'], os.getpid())
+
+    def test_worker_queue(self):
+        log = Logger(self.filename, flush_interval=0, structured=True)
+        items = starmap_parallel(list(range(40)), log_items, cores=4, is_list=True, args=[log.worker_logger()])
+        self.assertEqual(sorted(items), list(range(40)))
+        log.close()
+        records = read_records(os.path.join(self.folder, 'test.jsonl'))
+        self.assertEqual(sorted([record['counters']['item'] for record in records]), list(range(40)))
+        self.assertTrue(all([record['stage'] == 'workers' for record in records]))
+        self.assertNotIn(os.getpid(), [record['pid'] for record in records])
+        self.assertEqual(sorted(read_lines(self.filename)[1:]), sorted([f'INFO::: item {i}' for i in range(40)]))
+
+    def run_at_exit(self, mode, returncode):
+        env = dict(os.environ)
+        folder = os.path.dirname(os.path.abspath(__file__))
+        env['PYTHONPATH'] = os.pathsep.join([os.path.dirname(folder), os.path.join(os.path.dirname(folder), 'classes'),
+                                             folder, env.get('PYTHONPATH', '')])
+        result = subprocess.run([sys.executable, '-c', AT_EXIT, self.filename, mode, str(returncode)], env=env,
+                                capture_output=True, text=True, timeout=120)
+        self.assertEqual(result.returncode, returncode, result.stderr)
+
+    def test_flush_at_exit(self):
+        for returncode in [0, 1]:
+            self.run_at_exit('main', returncode)
+            self.assertEqual(read_lines(self.filename)[1:], [f'INFO::: message {i}' for i in range(5)])
+
+    def test_flush_at_exit_with_workers(self):
+        self.run_at_exit('workers', 0)
+        lines = read_lines(self.filename)[1:]
+        self.assertEqual(lines[:5], [f'INFO::: message {i}' for i in range(5)])
+        self.assertEqual(sorted(lines[5:]), sorted([f'INFO::: item {i}' for i in range(8)]))
+        self.assertEqual(len(read_records(os.path.join(self.folder, 'test.jsonl'))), 13)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import unittest
+import os
+import shutil
+import tempfile
+import _pickle as pic
+import classes.parameter_reader as parameter_reader
+from classes.parameter_reader import Parameters
+
+PAR = ('fieldname\tdata type\tlist mark\tcomment\tvalue\n'
+       'percentile\tfloat\t\tpercentile\t0.5\n'
+       'max_cycle_na\tint\t;\tatoms per cycle\t25;32;39\n'
+       'name\tstr\t\tname\tR1\n')
+MARKER = {'from': 'sidecar'}
+
+
+class MyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'par.par')
+        self.write(PAR)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write(self, text, mtime_ns=None):
+        with open(self.path, 'w') as f:
+            f.write(text)
+        if mtime_ns is not None:
+            os.utime(self.path, ns=(mtime_ns, mtime_ns))
+
+    def read(self):
+        return Parameters(self.path, fsource='dict', how='to_dict', multiple=False)
+
+    def mark_sidecar(self):
+        """replaces the parameters stored in the sidecar so reads served from it can be told apart from parsing"""
+        cache_file = self.read().cache_file('dict', 'to_dict', False)
+        with open(cache_file, 'rb') as f:
+            cache = pic.load(f)
+        cache['par'] = MARKER
+        with open(cache_file, 'wb') as f:
+            pic.dump(cache, f)
+
+    def test_parse_and_sidecar(self):
+        par = self.read()
+        self.assertTrue(par.success)
+        self.assertEqual(par.par, {'percentile': 0.5, 'max_cycle_na': [25, 32, 39], 'name': 'R1'})
+        self.assertTrue(os.path.isfile(par.cache_file('dict', 'to_dict', False)))
+        self.assertEqual(self.read().par, par.par)
+        self.assertEqual([file for file in os.listdir(self.folder) if file.endswith('.tmp')], [])
+
+    def test_fresh_sidecar_is_used(self):
+        self.mark_sidecar()
+        self.assertEqual(self.read().par, MARKER)
+
+    def test_size_change_invalidates(self):
+        self.mark_sidecar()
+        mtime_ns = os.stat(self.path).st_mtime_ns
+        self.write(PAR.replace('R1', 'R12'), mtime_ns=mtime_ns)
+        self.assertEqual(self.read().par['name'], 'R12')
+
+    def test_mtime_change_with_same_content_keeps_sidecar(self):
+        self.mark_sidecar()
+        mtime_ns = os.stat(self.path).st_mtime_ns
+        self.write(PAR, mtime_ns=mtime_ns + 10 ** 9)
+        self.assertEqual(self.read().par, MARKER)
+
+    def test_hash_change_invalidates(self):
+        self.mark_sidecar()
+        mtime_ns = os.stat(self.path).st_mtime_ns
+        self.write(PAR.replace('R1', 'R2'), mtime_ns=mtime_ns + 10 ** 9)  # same size, new content and mtime
+        self.assertEqual(self.read().par['name'], 'R2')
+
+    def test_options_and_version(self):
+        self.mark_sidecar()
+        par = Parameters(self.path, fsource='dict', how='to_list', multiple=False)
+        self.assertEqual(par.par['name'], 'R1')
+        version = parameter_reader.CACHE_VERSION
+        parameter_reader.CACHE_VERSION = version + 1
+        try:
+            self.assertEqual(self.read().par['name'], 'R1')
+        finally:
+            parameter_reader.CACHE_VERSION = version
+
+    def test_missing_file(self):
+        par = Parameters(os.path.join(self.folder, 'missing.par'))
+        self.assertFalse(par.success)
+        self.assertEqual(len(par.errors), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
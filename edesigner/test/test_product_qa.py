@@ -0,0 +1,91 @@
+import unittest
+import os
+import json
+import shutil
+import tempfile
+from collections import Counter
+from classes.product_qa import ProductQA, count_heavy_atoms
+from classes.smi_io import open_smi
+
+HEAVY_ATOMS = [(b'CCO', 3),
+               (b'c1ccccc1', 6),
+               (b'c1ccc2ccccc2c1', 10),
+               (b'C=C#N', 3),
+               (b'C/C=C\\C', 4),
+               (b'[NH4+]', 1),
+               (b'[Na+].[Cl-]', 2),
+               (b'[13CH3]C', 2),
+               (b'[2H]C', 1),
+               (b'[H]C([H])([H])[H]', 1),
+               (b'ClCBr', 3),
+               (b'[se]1cccc1', 5),
+               (b'*C', 1),
+               (b'[*]C', 1),
+               (b'C%10CC%10', 3),
+               (b'C1CC1C1CC1', 6),
+               (b'C12CC1C2', 4),
+               (b'C%12CC%12C1CC1', 6),
+               (b'C1CC', -1),
+               (b'C%10CC', -1),
+               (b'C(C', -1),
+               (b'C)C(', -1),
+               (b'CC(C)(C', -1),
+               (b'[C', -1),
+               (b'CX', -1),
+               (b'[H]', -1),
+               (b'', -1)]
+
+
+class MyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_count_heavy_atoms(self):
+        for smiles, nha in HEAVY_ATOMS:
+            self.assertEqual(count_heavy_atoms(smiles), nha, smiles)
+
+    def write_enumeration(self, ext):
+        """writes an enumeration file with textual duplicates, a smiles of the same molecule written differently,
+        parse failures and blank lines
+        ext: str: extension of the file (compression)
+        returns: list of str: smiles of the products"""
+        smiles = ['C' * (i % 7 + 1) for i in range(300)] + ['OCC', 'CCO', 'CC(C', 'C1CC', 'c1ccccc1']
+        with open_smi(os.path.join(self.folder, 'enumeration.smi' + ext), 'wt') as f:
+            for i, item in enumerate(smiles):
+                f.write(f'{item} P{i}\n')
+                if i % 100 == 0:
+                    f.write('\n')
+        return smiles
+
+    def test_enumeration_qa(self):
+        for ext in ['', '.gz']:
+            smiles = self.write_enumeration(ext)
+            qa = ProductQA(self.folder, cores=2, n_partitions=4, chunk_bytes=100)
+            report = qa.run()
+            with open(os.path.join(self.folder, 'enumeration_qa.json'), 'r') as f:
+                self.assertEqual(json.load(f)['n_products'], report['n_products'])
+            os.remove(os.path.join(self.folder, 'enumeration.smi' + ext))
+            self.assertFalse(os.path.isdir(os.path.join(self.folder, 'qa_hashes')))
+            self.assertEqual(report['enumeration_file'], os.path.join(self.folder, 'enumeration.smi' + ext))
+            self.assertEqual(report['n_products'], 305)
+            self.assertEqual(report['n_parse_failures'], 2)
+            counts = Counter(smiles)
+            self.assertEqual(report['n_textually_unique_smiles'], len(counts))
+            self.assertEqual(report['n_textually_duplicated_smiles'], len([n for n in counts.values() if n > 1]))
+            self.assertEqual(report['n_textual_duplicate_products'], 305 - len(counts))
+            histogram = Counter([count_heavy_atoms(item.encode()) for item in smiles])
+            del histogram[-1]
+            self.assertEqual(report['nha']['histogram'], dict(sorted(histogram.items())))
+            self.assertEqual(report['nha']['n'], 303)
+            self.assertEqual(report['nha']['min'], 1)
+            self.assertEqual(report['nha']['max'], 7)
+            self.assertAlmostEqual(report['nha']['mean'], sum([k * n for k, n in histogram.items()]) / 303, places=3)
+            self.assertIsNone(report['prediction'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import unittest
+import os
+import shutil
+import tempfile
+import threading
+from types import SimpleNamespace
+from classes.run_state import folder_signature, RunState
+
+
+class MyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        for file in ['par.par', 'libDESIGNs.sqlite', 'BBTs.pic', 'libDESIGNs_index.npz']:
+            self.touch(file, 1)
+        self.signature = folder_signature([self.folder, os.path.join(self.folder, 'missing')])
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def touch(self, file, seconds):
+        with open(os.path.join(self.folder, file), 'w') as f:
+            f.write(file)
+        os.utime(os.path.join(self.folder, file), ns=(seconds * 10 ** 9, seconds * 10 ** 9))
+
+    def current(self):
+        return folder_signature([self.folder, os.path.join(self.folder, 'missing')])
+
+    def test_ignored_files(self):
+        for file in ['.par.par.dict.to_dict.0.parcache', '.par.par.dict.to_dict.0.parcache.123.tmp',
+                     'rxn_usage_report.csv', 'notes.txt']:
+            self.touch(file, 2)
+        self.assertEqual(self.current(), self.signature)
+
+    def test_watched_files(self):
+        for file in ['par.par', 'libDESIGNs.sqlite', 'BBTs.pic', 'libDESIGNs_index.npz']:
+            self.touch(file, 2)
+            self.assertNotEqual(self.current(), self.signature, file)
+            self.touch(file, 1)
+            self.assertEqual(self.current(), self.signature, file)
+
+    def test_new_and_deleted_files(self):
+        self.touch('BBTs.npz', 1)
+        self.assertNotEqual(self.current(), self.signature)
+        os.remove(os.path.join(self.folder, 'BBTs.npz'))
+        os.remove(os.path.join(self.folder, 'BBTs.pic'))
+        self.assertNotEqual(self.current(), self.signature)
+
+
+class StatsTestCase(unittest.TestCase):
+
+    def test_stats_do_not_block_lookups(self):
+        state = RunState.__new__(RunState)
+        state.usage = {}
+        state.lock = threading.Lock()
+        state.usage_lock = threading.Lock()
+        state.designs = SimpleNamespace(get=lambda lib_idx: lib_idx)
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def compute_stats(weighted, cooccurrence, cores):
+            calls.append((weighted, cooccurrence))
+            started.set()
+            release.wait(10)
+            return {'reactions': [1]}
+
+        state._compute_stats = compute_stats
+        thread = threading.Thread(target=state.stats)
+        thread.start()
+        self.assertTrue(started.wait(10))
+        self.assertEqual(state.get_design(lib_idx=3), 3)  # answered while the stats are computed
+        release.set()
+        thread.join()
+        self.assertEqual(state.stats(), {'reactions': [1]})
+        self.assertEqual(calls, [(False, False)])
+
+
+if __name__ == '__main__':
+    unittest.main()
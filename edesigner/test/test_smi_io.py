@@ -0,0 +1,75 @@
+import unittest
+import os
+import random
+import shutil
+import tempfile
+from unittest import mock
+import numpy as np
+from classes.smi_io import write_nha_index, nha_index_file, copy_range
+
+MAXNA = 12
+
+
+class MyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        rng = random.Random(42)
+        self.nha = np.array(sorted([rng.randint(1, MAXNA - 2) for _ in range(200)]))
+        self.lines = [f'{"C" * rng.randint(1, 30)} {i}:{nha}\n'.encode() for i, nha in enumerate(self.nha)]
+        self.smi_file = os.path.join(self.folder, '7.smi')
+        with open(self.smi_file, 'wb') as f:
+            f.writelines(self.lines)
+        write_nha_index(self.smi_file, self.nha, MAXNA)
+        self.index = np.load(nha_index_file(self.smi_file))
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def expected(self, k):
+        """lines of the building blocks with up to k heavy atoms"""
+        return b''.join([line for line, nha in zip(self.lines, self.nha) if nha <= k])
+
+    def test_index(self):
+        self.assertEqual(nha_index_file(self.smi_file), os.path.join(self.folder, '7.idx.npy'))
+        self.assertEqual(self.index.shape, (MAXNA + 2,))
+        self.assertEqual(self.index.dtype, np.int64)
+        with open(self.smi_file, 'rb') as f:
+            data = f.read()
+        self.assertEqual(self.index[0], 0)
+        self.assertEqual(self.index[-1], len(data))
+        for k in range(MAXNA + 1):
+            self.assertEqual(data[:self.index[k + 1]], self.expected(k), k)
+
+    def test_copy_range(self):
+        target = os.path.join(self.folder, 'target.smi')
+        for k in range(MAXNA + 1):
+            with open(target, 'wb') as f:
+                f.write(b'C header\n')
+                copy_range(self.smi_file, f, int(self.index[k + 1]))
+                f.write(b'C footer\n')
+            with open(target, 'rb') as f:
+                self.assertEqual(f.read(), b'C header\n' + self.expected(k) + b'C footer\n', k)
+
+    def test_copy_range_append(self):
+        target = os.path.join(self.folder, 'target.smi')
+        with open(target, 'wb') as f:
+            f.write(b'C header\n')
+        with open(target, 'ab') as f:
+            copy_range(self.smi_file, f, int(self.index[5]))
+            copy_range(self.smi_file, f, int(self.index[3]))
+        with open(target, 'rb') as f:
+            self.assertEqual(f.read(), b'C header\n' + self.expected(4) + self.expected(2))
+
+    def test_copy_range_fallback(self):
+        target = os.path.join(self.folder, 'target.smi')
+        with mock.patch('os.sendfile', side_effect=OSError('sendfile is not supported')):
+            with open(target, 'wb') as f:
+                f.write(b'C header\n')
+                copy_range(self.smi_file, f, int(self.index[MAXNA + 1]))
+        with open(target, 'rb') as f:
+            self.assertEqual(f.read(), b'C header\n' + self.expected(MAXNA))
+
+
+if __name__ == '__main__':
+    unittest.main()
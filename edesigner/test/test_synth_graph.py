@@ -0,0 +1,421 @@
+import unittest
+import os
+import sys
+import json
+import stat
+import shutil
+import tempfile
+import random
+import itertools
+from classes.synth_graph import SynthNode, SynthGraph, decode_ordinal
+from classes.smi_io import open_smi, count_lines
+
+# stand-in for trxn: preparations copy the building blocks (and store the reaction they were given), other reactions
+# combine every line of the first input with every line of the others (smiles joined by . and ids by +). The exit
+# status and an empty output can be forced with the FAKE_TRXN_STATUS and FAKE_TRXN_EMPTY environment variables
+FAKE_TRXN = """#!{python}
+import os, sys, shutil, itertools
+args = sys.argv[1:]
+stem = args[args.index('-S') + 1]
+reaction = args[args.index('-r') + 1]
+inputs = args[args.index('-S') + 2:]
+if 'preparation' in os.path.basename(reaction):
+    shutil.copy(inputs[0], stem + '.smi')
+    shutil.copy(reaction, stem + '.used.rxn')
+    sys.exit(0)
+lines = [[line.split() for line in open(file) if line.strip()] for file in inputs]
+products = ['.'.join([item[0] for item in combo]) + ' ' + '+'.join([item[1] for item in combo]) + chr(10)
+            for combo in itertools.product(*lines)]
+if os.environ.get('FAKE_TRXN_EMPTY'):
+    products = []
+f = sys.stdout if stem == '-' else open(stem + '.smi', 'w')
+f.writelines(products[:len(products) // 2] if os.environ.get('FAKE_TRXN_STATUS') else products)
+f.flush()
+sys.exit(int(os.environ.get('FAKE_TRXN_STATUS', 0)))
+"""
+
+TEMPLATE = """(0 Reaction
+  (0 Scaffold
+    (A C query_file "${EDESIGNER_TEST_FOLDER}/x.qry")
+    (A I isotope (0 $isotope_1))
+  )
+)
+"""
+
+
+class FakeTrxnTestCase(unittest.TestCase):
+    """creates a temporary folder with a fake trxn in LILLYMOL_EXECUTABLES and restores the environment at the end"""
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.environ = dict(os.environ)
+        bin_folder = os.path.join(self.folder, 'bin')
+        self.wfolder = os.path.join(self.folder, 'work')
+        for folder in [bin_folder, self.wfolder]:
+            os.mkdir(folder)
+        trxn = os.path.join(bin_folder, 'trxn')
+        with open(trxn, 'w') as f:
+            f.write(FAKE_TRXN.format(python=sys.executable))
+        os.chmod(trxn, os.stat(trxn).st_mode | stat.S_IEXEC)
+        os.environ['LILLYMOL_EXECUTABLES'] = bin_folder
+        os.environ['EDESIGNER_TEST_FOLDER'] = self.folder
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+        shutil.rmtree(self.folder)
+
+    def write_bbs(self, name, lines):
+        path = os.path.join(self.folder, name)
+        with open(path, 'w') as f:
+            f.write(''.join([line + '\n' for line in lines]))
+        return path
+
+    def make_graph(self, sizes, edges=None, **kwargs):
+        """creates a graph with a headpiece and one node per item of sizes, and adds its nodes. The building blocks of
+        node i are C[iC]... with ids {nha}:N{i}_{j} (nha cycles from 1 to 3). By default each node is joined to the
+        headpiece through the edge of its own index
+        sizes: list of int: number of building blocks of each node (headpiece excluded)
+        edges: list of lists of int or None: edges of each node (headpiece included)
+        kwargs: keyword arguments of SynthGraph
+        returns: instance of SynthGraph class"""
+        n_nodes = len(sizes)
+        if edges is None:
+            edges = [list(range(1, n_nodes + 1))] + [[i] for i in range(1, n_nodes + 1)]
+        tags = ''.join([f'[{i}C]' for i in range(1, n_nodes + 1)])
+        config = [{'node': 0, 'bbs_file': self.write_bbs('hp.smi', [f'C{tags} HP']), 'edges': edges[0],
+                   'out_edges': [0] * len(edges[0]), 'bond_orders': [1] * len(edges[0]), 'cycle_edges': [],
+                   'cycle_bond_orders': [], 'preparations': []}]
+        for i, size in enumerate(sizes):
+            node = i + 1
+            bbs = [f'C[{node}C]{"C" * (j % 3)} {j % 3 + 1}:N{node}_{j}' for j in range(size)]
+            config.append({'node': node, 'bbs_file': self.write_bbs(f'c{node}.smi', bbs), 'edges': edges[node],
+                           'out_edges': [0] * len(edges[node]), 'bond_orders': [1] * len(edges[node]),
+                           'cycle_edges': [], 'cycle_bond_orders': [], 'preparations': []})
+        config_file = os.path.join(self.folder, 'config.json')
+        with open(config_file, 'w') as f:
+            json.dump(config, f)
+        graph = SynthGraph(self.wfolder, config_file, **kwargs)
+        for node in graph.par:
+            graph.add_node(node)
+        return graph
+
+
+class PreparationsTestCase(FakeTrxnTestCase):
+
+    def setUp(self):
+        super().setUp()
+        prep_folder = os.path.join(self.folder, 'preps')
+        os.mkdir(prep_folder)
+        with open(os.path.join(prep_folder, 'prepare_test.rxn'), 'w') as f:
+            f.write(TEMPLATE)
+        self.bbs_file = self.write_bbs('bbs.smi', ['CC[1C] A1', '', 'CCC[1C] A2'])
+        os.environ['EDESIGNER_TEST_PREPS'] = prep_folder
+
+    def make_node(self, reaction):
+        node = {'node': 0, 'bbs_file': self.bbs_file, 'edges': [1], 'bond_orders': [1], 'cycle_edges': [],
+                'cycle_bond_orders': [],
+                'preparations': [{'edges': [7], 'keep_unprepared': False, 'reaction': reaction}]}
+        return SynthNode(self.wfolder, node)
+
+    def test_run_preparations_expands_reaction_path(self):
+        node = self.make_node('${EDESIGNER_TEST_PREPS}/prepare_test.rxn')
+        node.run_preparations()
+        self.assertTrue(node.success)
+        with open(os.path.join(self.wfolder, 'preparation_00.used.rxn'), 'r') as f:
+            reaction = f.read()
+        self.assertIn(f'"{self.folder}/x.qry"', reaction)
+        self.assertIn('(A I isotope (0 7))', reaction)
+        with open(os.path.join(self.wfolder, 'R00.smi'), 'r') as f:
+            self.assertEqual(f.read(), 'CC[1C] A1\nCCC[1C] A2\n')
+        self.assertTrue(os.path.isfile(os.path.join(self.wfolder, 'RP00.smi')))
+
+    def test_preparation_key_expands_reaction_path(self):
+        expanded = self.make_node(os.path.join(os.environ['EDESIGNER_TEST_PREPS'], 'prepare_test.rxn'))
+        unexpanded = self.make_node('${EDESIGNER_TEST_PREPS}/prepare_test.rxn')
+        self.assertEqual(expanded.preparation_key(), unexpanded.preparation_key())
+
+
+class RunReactionTestCase(FakeTrxnTestCase):
+
+    def test_join_node(self):
+        for compression in [None, 'gzip', 'lzma']:
+            graph = self.make_graph([4, 3], compression=compression)
+            graph.join_node(1)
+            scaffolds_file = os.path.join(self.wfolder, 'R00.smi' + graph.ext)
+            self.assertEqual(count_lines(scaffolds_file), 4)
+            os.remove(scaffolds_file)
+
+    def test_failed_trxn_stops_the_enumeration(self):
+        for compression in [None, 'gzip', 'lzma']:
+            graph = self.make_graph([4, 3], compression=compression)
+            os.environ['FAKE_TRXN_STATUS'] = '1'
+            with self.assertRaises(SystemExit):
+                graph.join_node(1)
+            del os.environ['FAKE_TRXN_STATUS']
+            self.assertFalse(graph.success)
+            # the partial products are not merged into the scaffolds
+            self.assertEqual(count_lines(os.path.join(self.wfolder, 'R00.smi')), 1)
+
+    def test_no_products_stops_the_enumeration(self):
+        for compression in [None, 'gzip']:
+            graph = self.make_graph([4, 3], compression=compression)
+            os.environ['FAKE_TRXN_EMPTY'] = '1'
+            with self.assertRaises(SystemExit):
+                graph.join_node(1)
+            del os.environ['FAKE_TRXN_EMPTY']
+            self.assertFalse(graph.success)
+
+    def test_no_reactive_scaffolds(self):
+        graph = self.make_graph([4, 3], compression='gzip')
+        products_file = os.path.join(self.wfolder, 'PRD.smi.gz')
+        empty = self.write_bbs('empty.smi', [])
+        graph.run_reaction(f'{graph.trxn} -r {graph.create_reaction(1)}', empty, os.path.join(self.wfolder, 'PRD'),
+                           products_file, n_reactive=0)
+        with open_smi(products_file, 'rb') as f:
+            self.assertEqual(f.read(), b'')
+
+
+
+class OrdinalsTestCase(FakeTrxnTestCase):
+
+    def node_ids(self, sizes):
+        """ids of the building blocks of each node created by make_graph (headpiece included)"""
+        return [['HP']] + [[f'{j % 3 + 1}:N{i + 1}_{j}' for j in range(size)] for i, size in enumerate(sizes)]
+
+    def test_decode_ordinal_follows_product_order(self):
+        for sizes in [[1], [5], [2, 3], [3, 1, 4, 2]]:
+            n_products = 1
+            for size in sizes:
+                n_products *= size
+            expected = list(itertools.product(*[range(size) for size in sizes]))
+            self.assertEqual([decode_ordinal(ordinal, sizes) for ordinal in range(n_products)], expected)
+
+    def test_last_node_is_least_significant(self):
+        self.assertEqual(decode_ordinal(1, [2, 3]), (0, 1))
+        self.assertEqual(decode_ordinal(3, [2, 3]), (1, 0))
+        self.assertEqual(decode_ordinal(5, [2, 3]), (1, 2))
+
+    def test_bb_tuples(self):
+        graph = self.make_graph([4, 3])
+        expected = list(itertools.product(*self.node_ids([4, 3])))
+        self.assertEqual(graph.bb_tuples(0, 12), expected)
+        self.assertEqual(graph.bb_tuples(5), [expected[5]])
+        self.assertEqual(graph.bb_tuples(3, 7), expected[3:7])
+        with open(graph.ordinals_target_file(3, 7), 'r') as f:
+            self.assertEqual(f.read().splitlines(), [' '.join(item) for item in expected[3:7]])
+
+    def test_stop_is_truncated(self):
+        graph = self.make_graph([4, 3])
+        expected = list(itertools.product(*self.node_ids([4, 3])))
+        self.assertEqual(graph.bb_tuples(10, 20), expected[10:])
+        self.assertTrue(graph.success)
+
+    def test_start_out_of_range_exits(self):
+        for start in [12, 13, -1]:
+            graph = self.make_graph([4, 3])
+            with self.assertRaises(SystemExit):
+                graph.bb_tuples(start)
+            self.assertFalse(graph.success)
+
+
+
+class SamplingTestCase(FakeTrxnTestCase):
+
+    def sample(self, sizes, n, sampling, seed):
+        graph = self.make_graph(sizes, n=n, sampling=sampling, seed=seed)
+        target_file = graph.sample_target_file()
+        if target_file is None:
+            return None
+        with open(target_file, 'r') as f:
+            return [tuple(line.split()) for line in f]
+
+    def test_uniform(self):
+        tuples = self.sample([5, 4, 3], 20, 'uniform', 7)
+        self.assertEqual(len(tuples), 20)
+        self.assertEqual(len(set(tuples)), 20)
+        self.assertTrue(all([len(item) == 4 and item[0] == 'HP' for item in tuples]))
+        self.assertEqual(self.sample([5, 4, 3], 20, 'uniform', 7), tuples)
+        self.assertNotEqual(self.sample([5, 4, 3], 20, 'uniform', 8), tuples)
+
+    def test_nha(self):
+        tuples = self.sample([9, 9], 30, 'nha', 3)
+        self.assertEqual(len(tuples), 30)
+        self.assertEqual(len(set(tuples)), 30)
+        for node in [1, 2]:
+            self.assertEqual(set([item[node].split(':')[0] for item in tuples]), {'1', '2', '3'})
+        self.assertEqual(self.sample([9, 9], 30, 'nha', 3), tuples)
+
+    def test_small_library(self):
+        for sampling in ['uniform', 'nha']:
+            self.assertIsNone(self.sample([4, 3], 12, sampling, 0))
+            self.assertIsNone(self.sample([4, 3], 20, sampling, 0))
+
+    def test_invalid_sampling_exits(self):
+        graph = self.make_graph([4, 3], n=5, sampling='random')
+        with self.assertRaises(SystemExit):
+            graph.sample_target_file()
+        self.assertFalse(graph.success)
+
+
+
+class PartitionTestCase(FakeTrxnTestCase):
+
+    def partition(self, scaffolds, ext, *args):
+        """partitions a scaffolds file and reads back the ids of the reactive and inert scaffolds
+        scaffolds: list of str: lines of the scaffolds file
+        ext: str: extension of the scaffolds and inert files (compression)
+        args: arguments of partition_scaffolds before the file names
+        returns: tuple: counts returned by partition_scaffolds (partition_scaffolds_multi if the tag is a list), ids of
+            the reactive and the inert scaffolds"""
+        graph = self.make_graph([1])
+        scaffolds_file = os.path.join(self.wfolder, 'S.smi' + ext)
+        reactive_file = os.path.join(self.wfolder, 'reactive.smi')
+        inert_file = os.path.join(self.wfolder, 'inert.smi' + ext)
+        with open_smi(scaffolds_file, 'wb') as f:
+            f.write(''.join([line + '\n' for line in scaffolds]).encode())
+        if isinstance(args[0], list):
+            counts = graph.partition_scaffolds_multi(*args, scaffolds_file, reactive_file, inert_file)
+        else:
+            counts = graph.partition_scaffolds(*args, scaffolds_file, reactive_file, inert_file)
+        ids = []
+        for file in [reactive_file, inert_file]:
+            with open_smi(file, 'rb') as f:
+                ids.append([line.split()[1].decode() for line in f])
+        return counts, ids[0], ids[1]
+
+    def test_tag_below_ten(self):
+        scaffolds = ['C[5C] a', 'C[57C] b', 'C[5C]C[5C] c', 'CC d', '', 'C[5CH2][57C] e', 'C[15C] f']
+        for ext in ['', '.gz']:
+            self.assertEqual(self.partition(scaffolds, ext, 5, 1), ((3, 3), ['a', 'c', 'e'], ['b', 'd', 'f']))
+
+    def test_tag_above_nine(self):
+        scaffolds = ['C[5C] a', 'C[57C] b', 'C[5C]C[5C] c', 'CC d', '', 'C[5CH2][57C] e', 'C[15C] f']
+        for ext in ['', '.gz']:
+            self.assertEqual(self.partition(scaffolds, ext, 57, 1), ((4, 2), ['b', 'e'], ['a', 'c', 'd', 'f']))
+
+    def test_cyclization(self):
+        scaffolds = ['C[5C] a', 'C[5C]C[5C] b', 'CC c', 'C[5C]C[57C] d', 'C[57C]C[57C] e']
+        # scaffolds with a single tag can not be cyclized and are discarded
+        self.assertEqual(self.partition(scaffolds, '', 5, 2), ((2, 1), ['b'], ['c', 'e']))
+        self.assertEqual(self.partition(scaffolds, '', 57, 2), ((3, 1), ['e'], ['a', 'b', 'c']))
+
+    def test_multi(self):
+        scaffolds = ['C[1C][2C] a', 'C[1C] b', 'CC c', 'C[12C] d', '', 'C[2C]C[1CH] e', 'C[21C] f']
+        for ext in ['', '.gz']:
+            # partial scaffolds are counted but not written
+            self.assertEqual(self.partition(scaffolds, ext, [1, 2]), ((3, 2, 1), ['a', 'e'], ['c', 'd', 'f']))
+        scaffolds = ['C[3C][12C] a', 'C[3C][1C] b', 'C[12C] c', 'CC d']
+        self.assertEqual(self.partition(scaffolds, '', [3, 12]), ((1, 1, 2), ['a'], ['d']))
+
+
+class FusionTestCase(FakeTrxnTestCase):
+
+    def test_independent_joins_are_fused(self):
+        graph = self.make_graph([4, 3, 5])
+        self.assertTrue(graph.fusable([1], 2))
+        self.assertTrue(graph.fusable([1, 2], 3))
+        self.assertEqual(graph.fused_groups(), [[1, 2, 3]])
+
+    def test_edge_into_the_group(self):
+        # edge 3 attaches node 3 to a building block of node 1
+        graph = self.make_graph([4, 3, 5], edges=[[1, 2], [1, 3], [2], [3]])
+        self.assertTrue(graph.fusable([1], 2))
+        self.assertFalse(graph.fusable([1, 2], 3))
+        self.assertTrue(graph.fusable([2], 3))
+        self.assertEqual(graph.fused_groups(), [[1, 2], [3]])
+
+    def test_isotope_used_by_the_group(self):
+        graph = self.make_graph([4, 3, 5])
+        graph.edges[1]['values']['dest_isotope'] = 1  # join 2 sets the isotope of the tag of node 1
+        self.assertFalse(graph.fusable([1], 2))
+        self.assertEqual(graph.fused_groups(), [[1], [2, 3]])
+
+    def test_chunksize(self):
+        for chunksize, groups in [(13, [[1, 2], [3]]), (12, [[1], [2], [3]]), (61, [[1, 2, 3]]),
+                                  (60, [[1, 2], [3]])]:
+            graph = self.make_graph([4, 3, 5], chunksize=chunksize)
+            self.assertEqual(graph.fused_groups(), groups, chunksize)
+
+
+
+class ChunksTestCase(FakeTrxnTestCase):
+
+    def test_plan_chunks(self):
+        graph = self.make_graph([1])
+        rng = random.Random(40)
+        cases = [(1, 1, 1), (10, 250, 100), (1000, 7, 100), (3, 5, 1000)]
+        cases += [(rng.randint(1, 3000), rng.randint(1, 3000), rng.randint(1, 5000)) for _ in range(500)]
+        for n_scaffolds, n_bbs, capacity in cases:
+            scaffolds_chunk, bbs_chunk = graph.plan_chunks(n_scaffolds, n_bbs, capacity)
+            case = (n_scaffolds, n_bbs, capacity)
+            self.assertTrue(1 <= scaffolds_chunk <= n_scaffolds, case)
+            self.assertTrue(1 <= bbs_chunk <= n_bbs, case)
+            self.assertLessEqual(scaffolds_chunk * bbs_chunk, capacity, case)
+            # the fewest chunks of building blocks, as even as possible
+            n_bbs_chunks = -(-n_bbs // min(n_bbs, capacity))
+            self.assertEqual(-(-n_bbs // bbs_chunk), n_bbs_chunks, case)
+            self.assertEqual(bbs_chunk, -(-n_bbs // n_bbs_chunks), case)
+            self.assertEqual(scaffolds_chunk, min(capacity // bbs_chunk, n_scaffolds), case)
+        self.assertEqual(graph.plan_chunks(10, 250, 100), (1, 84))
+
+    def test_split_bbs_file(self):
+        graph = self.make_graph([1])
+        for lines, nlines, sizes in [([f'C{i} B{i}\n' for i in range(10)], 3, [3, 3, 3, 1]),
+                                     ([f'C{i} B{i}\n' for i in range(9)] + ['C9 B9'], 5, [5, 5]),
+                                     ([f'C{i} B{i}\n' for i in range(4)], 10, [4]), ([], 3, [])]:
+            bbs_file = self.write_bbs('bbs.smi', [])
+            with open(bbs_file, 'w') as f:
+                f.write(''.join(lines))
+            chunks = graph.split_bbs_file(bbs_file, nlines)
+            self.assertEqual(chunks, [os.path.join(self.folder, f'B{str(i).rjust(4, "0")}bbs.smi')
+                                      for i in range(len(sizes))])
+            texts = []
+            for chunk in chunks:
+                with open(chunk, 'r') as f:
+                    texts.append(f.read())
+                os.remove(chunk)
+            self.assertEqual([len(text.splitlines()) for text in texts], sizes)
+            self.assertEqual(''.join(texts), ''.join(lines))
+
+
+
+class LocalChunkTestCase(FakeTrxnTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.counter = os.path.join(self.folder, 'attempts.txt')
+        self.products_file = os.path.join(self.wfolder, '0000PRD.smi')
+
+    def run_chunk(self, command, retries=2):
+        """runs a fake chunk command that records each attempt
+        returns: tuple of int: return code of run_local_chunk and number of attempts"""
+        graph = self.make_graph([1], local=True, retries=retries)
+        returncode = graph.run_local_chunk(f'echo x >> {self.counter}; {command}', self.products_file)
+        attempts = count_lines(self.counter) if os.path.isfile(self.counter) else 0
+        return returncode, attempts
+
+    def test_success(self):
+        self.assertEqual(self.run_chunk(f'touch {self.products_file}'), (0, 1))
+
+    def test_failed_command_is_retried(self):
+        self.assertEqual(self.run_chunk(f'touch {self.products_file}; exit 3'), (3, 3))
+        os.remove(self.counter)
+        self.assertEqual(self.run_chunk('exit 3', retries=0), (3, 1))
+
+    def test_missing_products_file_is_retried(self):
+        self.assertEqual(self.run_chunk('true', retries=4), (1, 5))
+
+    def test_stale_products_file_is_removed(self):
+        with open(self.products_file, 'w') as f:
+            f.write('C P\n')
+        self.assertEqual(self.run_chunk('true'), (1, 3))
+        self.assertFalse(os.path.isfile(self.products_file))
+
+    def test_success_after_a_failure(self):
+        command = f'test $(wc -l < {self.counter}) -ge 2 && touch {self.products_file}'
+        self.assertEqual(self.run_chunk(command), (0, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
+from classes.libdesign_store import save_libdesigns, load_libdesigns, STORE_FILE
+import classes.usage_stats as usage_stats_module
+from classes.usage_stats import usage_stats
+from synthetic_libs import make_libs
+
+SIZES = {'n_reactions': 12, 'n_deprotections': 6, 'n_bbts': 20, 'n_cycles': 3}
+
+
+def old_usage(designs, weighted=False):
+    """usage loop of stats_analyzer before the vectorised reduction (optionally weighted by n_all), plus the
+    co-occurrence matrices computed library by library"""
+    reaction_usage = np.zeros(SIZES['n_reactions'])
+    deprotection_usage = np.zeros(SIZES['n_deprotections'])
+    bbts_usage = np.zeros(SIZES['n_bbts'])
+    reaction_reaction = np.zeros((SIZES['n_reactions'], SIZES['n_reactions']))
+    bbt_cycle = np.zeros((SIZES['n_bbts'], SIZES['n_cycles']))
+    for design in designs:
+        weight = (0 if design.n_all is None else design.n_all) if weighted else 1
+        for idx in design.reactions:
+            reaction_usage[idx] += weight
+        for idx in design.deprotections:
+            if idx != 0:
+                deprotection_usage[idx] += weight
+        for cycle, item in enumerate(design.bbts):
+            for idx in item:
+                bbts_usage[idx] += weight
+                bbt_cycle[idx, cycle] += weight
+        for idx1 in set(design.reactions):
+            for idx2 in set(design.reactions):
+                reaction_reaction[idx1, idx2] += weight
+    return {'reactions': reaction_usage, 'deprotections': deprotection_usage, 'bbts': bbts_usage,
+            'reaction_reaction': reaction_reaction, 'bbt_cycle': bbt_cycle}
+
+
+class MyTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.folder = tempfile.mkdtemp()
+        cls.libs = make_libs(700, seed=45)
+        save_libdesigns(cls.libs, os.path.join(cls.folder, STORE_FILE))
+        cls.chunk_libs = usage_stats_module.CHUNK_LIBS
+        # small chunks so the reductions accumulate several chunks and partitions
+        usage_stats_module.CHUNK_LIBS = 64
+
+    @classmethod
+    def tearDownClass(cls):
+        usage_stats_module.CHUNK_LIBS = cls.chunk_libs
+        shutil.rmtree(cls.folder)
+
+    def assertSameUsage(self, usage, expected, cooccurrence):
+        keys = ['reactions', 'deprotections', 'bbts'] + (['reaction_reaction', 'bbt_cycle'] if cooccurrence else [])
+        self.assertEqual(sorted(usage.keys()), sorted(keys))
+        for key in keys:
+            self.assertEqual(usage[key].shape, expected[key].shape, key)
+            np.testing.assert_allclose(usage[key], expected[key], err_msg=key)
+
+    def test_pickle_stream(self):
+        for weighted in [False, True]:
+            for cooccurrence in [False, True]:
+                usage = usage_stats(iter(self.libs), SIZES, weighted=weighted, cooccurrence=cooccurrence)
+                self.assertSameUsage(usage, old_usage(self.libs, weighted), cooccurrence)
+
+    def test_store(self):
+        for weighted in [False, True]:
+            for cooccurrence in [False, True]:
+                usage = usage_stats(load_libdesigns(self.folder), SIZES, weighted=weighted,
+                                    cooccurrence=cooccurrence, cores=3)
+                self.assertSameUsage(usage, old_usage(self.libs, weighted), cooccurrence)
+
+    def test_empty(self):
+        usage = usage_stats([], SIZES, cooccurrence=True)
+        self.assertSameUsage(usage, old_usage([]), True)
+
+
+if __name__ == '__main__':
+    unittest.main()